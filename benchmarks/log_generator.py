@@ -0,0 +1,66 @@
+"""
+Synthetic log lines for the benchmarks.
+
+Formats: loguru (the default format of the app itself), syslog and JSON lines.  Line
+lengths vary (short messages, long messages, occasional tracebacks) and levels follow
+a typical distribution.  Output is deterministic for a given seed.
+"""
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Iterator, List
+
+FORMATS = ['loguru', 'syslog', 'json']
+
+_LEVELS = ['DEBUG'] * 20 + ['INFO'] * 60 + ['SUCCESS'] * 5 + ['WARNING'] * 10 + ['ERROR'] * 4 + ['CRITICAL']
+_WORDS = ('request user session cache miss hit timeout retry connect socket file read write queue worker '
+          'job done failed started stopped payload bytes ms id token tail view filter index').split()
+_MODULES = ['router.routers:ws_view_file', 'utils.textfile_tailer:_tail_file', 'utils.helper:filter_line',
+            'utils.ws_con_mgr:send_handler', 'main:middleware_hook']
+
+
+class LogGenerator():
+    def __init__(self, log_format: str = 'loguru', seed: int = 42, start: datetime = None):
+        if log_format not in FORMATS:
+            raise ValueError(f'Invalid format [{log_format}], valid formats: {FORMATS}')
+        self.log_format = log_format
+        self._random = random.Random(seed)
+        self._timestamp = start or datetime(2024, 5, 1)
+
+    def _message(self) -> str:
+        # Mostly short messages, some long ones (i.e. dumped payloads)
+        word_count = self._random.choice([3, 5, 8, 12, 20, 40, 80])
+        return ' '.join(self._random.choice(_WORDS) for _ in range(word_count))
+
+    def line(self) -> str:
+        self._timestamp += timedelta(milliseconds=self._random.randint(1, 500))
+        level = self._random.choice(_LEVELS)
+        module = self._random.choice(_MODULES)
+        message = self._message()
+        if self.log_format == 'loguru':
+            return f'{self._timestamp:%Y-%m-%d %H:%M:%S}.{self._timestamp.microsecond // 1000:03d} | {level:8} | {module}:{self._random.randint(10, 500)} - {message}'
+        if self.log_format == 'syslog':
+            return f'{self._timestamp:%b %d %H:%M:%S} host01 dt-fileviewer[{self._random.randint(100, 9999)}]: {level} {module} {message}'
+        return json.dumps({'time': self._timestamp.isoformat(), 'level': level, 'module': module, 'message': message})
+
+    def lines(self, count: int) -> Iterator[str]:
+        for _ in range(count):
+            line = self.line()
+            yield line
+            if self._random.random() < 0.01:
+                # Traceback, continuation lines without timestamp
+                yield 'Traceback (most recent call last):'
+                yield f'  File "/app/{self._random.choice(_MODULES).split(":")[0].replace(".", "/")}.py", line {self._random.randint(1, 400)}, in run'
+                yield 'ValueError: ' + self._message()
+
+
+def generate(log_format: str, count: int, seed: int = 42) -> List[str]:
+    return list(LogGenerator(log_format, seed).lines(count))
+
+
+def write_file(filename: str, log_format: str, count: int, seed: int = 42) -> int:
+    """Write count (+ traceback) lines to filename, returns bytes written."""
+    data = ''.join(f'{line}\n' for line in generate(log_format, count, seed))
+    with open(filename, 'w') as h_file:
+        h_file.write(data)
+    return len(data.encode('utf-8'))
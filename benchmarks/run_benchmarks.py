@@ -0,0 +1,297 @@
+"""
+Benchmarks for the tail pipeline stages, and the reader-to-socket path end to end.
+
+Usage (from the repository root):
+    python benchmarks/run_benchmarks.py [--lines 20000] [--formats loguru,syslog,json]
+                                        [--stages filter_line,e2e] [--output results.json]
+                                        [--baseline baseline.json] [--tolerance 0.2]
+
+Results (lines/sec, per-line latency) are written as JSON.  With --baseline, every
+result is compared to the baseline and the exit code is 1 if any stage is slower
+than the baseline by more than the tolerance (default 20%).
+"""
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / 'dt-fileviewer'))
+sys.path.insert(0, str(REPO_ROOT / 'benchmarks'))
+
+from loguru import logger as LOGGER  # noqa: E402
+
+import log_generator  # noqa: E402
+
+STAGES = ['filter_line', 'compact_line', 'is_date', 'detector_is_date', 'line_filter', 'line_reader', 'tail', 'e2e']
+_LATENCY_SAMPLES = 2000
+_E2E_LATENCY_SAMPLES = 50
+
+
+# == Measurement ==========================================================================
+def _result(lines: int, seconds: float, latencies_ns: List[int] = None) -> dict:
+    result = {'lines': lines, 'seconds': round(seconds, 6), 'lines_per_sec': round(lines / seconds, 1) if seconds > 0 else None}
+    if latencies_ns:
+        latencies_ns = sorted(latencies_ns)
+        result['p50_us'] = round(latencies_ns[len(latencies_ns) // 2] / 1000, 3)
+        result['p99_us'] = round(latencies_ns[int(len(latencies_ns) * 0.99)] / 1000, 3)
+    else:
+        result['mean_us'] = round(seconds / lines * 1_000_000, 3) if lines > 0 else None
+    return result
+
+
+def measure_per_line(func: Callable, lines: List[str], repeat: int) -> dict:
+    """func(line) for every line, best of repeat runs, plus a per call latency sample."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            func(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    latencies: List[int] = []
+    for line in lines[:_LATENCY_SAMPLES]:
+        start = time.perf_counter_ns()
+        func(line)
+        latencies.append(time.perf_counter_ns() - start)
+    return _result(len(lines), best, latencies)
+
+
+def measure_batch(func: Callable, line_count: int, repeat: int) -> dict:
+    """func() processes line_count lines at once, best of repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return _result(line_count, best)
+
+
+# == Stages ===============================================================================
+def bench_filter_line(log_format: str, lines: List[str], work_dir: pathlib.Path, repeat: int) -> dict:
+    from utils.helper import Helper
+    textfile_id = f'bench-{log_format}'
+    return measure_per_line(lambda line: Helper.filter_line(line, textfile_id), lines, repeat)
+
+
+def bench_compact_line(log_format: str, lines: List[str], work_dir: pathlib.Path, repeat: int) -> dict:
+    from utils.helper import Helper
+    textfile_id = f'bench-{log_format}'
+    return measure_per_line(lambda line: Helper.compact_line(line, textfile_id), lines, repeat)
+
+
+def bench_is_date(log_format: str, lines: List[str], work_dir: pathlib.Path, repeat: int) -> dict:
+    # dateutil on every call, the slow path TimestampDetector avoids.  Smaller sample.
+    from utils.helper import Helper
+    tokens = [line.split(maxsplit=1)[0] for line in lines[:2000] if line.strip()]
+    return measure_per_line(Helper.is_date, tokens, 1)
+
+
+def bench_detector_is_date(log_format: str, lines: List[str], work_dir: pathlib.Path, repeat: int) -> dict:
+    from utils.timestamp_detector import TimestampDetector
+    detector = TimestampDetector.for_file(f'bench-{log_format}')
+    tokens = [line.split(maxsplit=1)[0] for line in lines if line.strip()]
+    return measure_per_line(detector.is_date, tokens, repeat)
+
+
+def bench_line_filter(log_format: str, lines: List[str], work_dir: pathlib.Path, repeat: int) -> dict:
+    from utils.line_filter import LineFilter
+    line_filter = LineFilter(include=['timeout', 'retry', 'failed'], exclude=['cache'], ignore_case=True)
+    batch_size = 1000
+    batches = [lines[idx:idx + batch_size] for idx in range(0, len(lines), batch_size)]
+
+    def run():
+        for batch in batches:
+            line_filter.select(batch)
+    return measure_batch(run, len(lines), repeat)
+
+
+def bench_line_reader(log_format: str, lines: List[str], work_dir: pathlib.Path, repeat: int) -> dict:
+    from utils.line_reader import LineReader
+    filename = work_dir / f'reader_{log_format}.log'
+    filename.write_text(''.join(f'{line}\n' for line in lines))
+
+    async def read_all():
+        with LineReader(filename) as reader:
+            while len(await reader.read_lines()) > 0:
+                pass
+    return measure_batch(lambda: asyncio.run(read_all()), len(lines), repeat)
+
+
+def bench_tail(log_format: str, lines: List[str], work_dir: pathlib.Path, repeat: int) -> dict:
+    """Shared reader -> subscriber ring -> batches, no socket (TextFileHandler._tail_file path)."""
+    from utils.textfile_tailer import StartPos, TailRegistry
+    filename = work_dir / f'tail_{log_format}.log'
+    data = ''.join(f'{line}\n' for line in lines)
+
+    async def run(run: int) -> float:
+        # New handler per run, each asyncio.run() has its own event loop
+        filename.write_text('')
+        subscriber = TailRegistry.subscribe(f'tail-{log_format}-{run}', str(filename), start_loc=StartPos.HEAD)
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        with open(filename, 'a') as h_file:
+            h_file.write(data)
+        received = 0
+        while received < len(lines):
+            batch = await subscriber.get_or_waitfor_batch()
+            if batch is None:
+                break
+            received += len(batch)
+        elapsed = time.perf_counter() - start
+        subscriber.stop_tail()
+        await asyncio.sleep(0.05)
+        return elapsed
+
+    best = min(asyncio.run(run(idx)) for idx in range(repeat))
+    return _result(len(lines), best)
+
+
+def bench_e2e(log_format: str, lines: List[str], work_dir: pathlib.Path, repeat: int) -> dict:
+    """File append -> shared reader -> WsConnectionManager -> in-process websocket client (compact protocol)."""
+    from fastapi.testclient import TestClient
+    from utils import cfg
+    import main
+
+    textfile_id = f'e2e-{log_format}'
+    filename = work_dir / f'e2e_{log_format}.log'
+    cfg.text_files[textfile_id] = str(filename)
+    data = ''.join(f'{line}\n' for line in lines)
+
+    def receive_lines(ws, count: int):
+        received = 0
+        while received < count:
+            frame = ws.receive_json()
+            received += len(frame['lines']) + frame['skipped']
+
+    best = None
+    latencies: List[int] = []
+    with TestClient(main.app) as client:
+        for run in range(repeat):
+            filename.write_text(f'{lines[0]}\n')
+            with client.websocket_connect(f'/ws/view/{textfile_id}?start_pos=tail&start_lines=1&protocol=compact') as ws:
+                receive_lines(ws, 1)
+                start = time.perf_counter()
+                with open(filename, 'a') as h_file:
+                    h_file.write(data)
+                receive_lines(ws, len(lines))
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+                if run == 0:
+                    # Latency of a single line, append to received
+                    for line in lines[:_E2E_LATENCY_SAMPLES]:
+                        start = time.perf_counter_ns()
+                        with open(filename, 'a') as h_file:
+                            h_file.write(f'{line}\n')
+                        receive_lines(ws, 1)
+                        latencies.append(time.perf_counter_ns() - start)
+
+    return _result(len(lines), best, latencies)
+
+
+_BENCHMARKS: Dict[str, Callable] = {
+    'filter_line': bench_filter_line,
+    'compact_line': bench_compact_line,
+    'is_date': bench_is_date,
+    'detector_is_date': bench_detector_is_date,
+    'line_filter': bench_line_filter,
+    'line_reader': bench_line_reader,
+    'tail': bench_tail,
+    'e2e': bench_e2e,
+}
+
+
+# == Baseline comparison ==================================================================
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return the regressed stages (lines/sec below baseline * (1 - tolerance))."""
+    regressions: List[str] = []
+    print(f'\n{"Stage":36} {"Baseline":>14} {"Current":>14} {"Change":>8}')
+    print(f'{"-"*36} {"-"*14} {"-"*14} {"-"*8}')
+    for name, result in results['results'].items():
+        base = baseline.get('results', {}).get(name, None)
+        if base is None or not base.get('lines_per_sec') or not result.get('lines_per_sec'):
+            print(f'{name:36} {"-":>14} {result.get("lines_per_sec") or 0:14,.0f} {"new":>8}')
+            continue
+        change = result['lines_per_sec'] / base['lines_per_sec'] - 1
+        flag = ''
+        if change < -tolerance:
+            regressions.append(name)
+            flag = '  << REGRESSION'
+        print(f'{name:36} {base["lines_per_sec"]:14,.0f} {result["lines_per_sec"]:14,.0f} {change:+8.1%}{flag}')
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='dt-fileviewer pipeline benchmarks')
+    parser.add_argument('--lines', type=int, default=20000, help='Lines generated per format')
+    parser.add_argument('--formats', default=','.join(log_generator.FORMATS), help='Log formats (loguru,syslog,json)')
+    parser.add_argument('--stages', default=','.join(STAGES), help=f'Stages to run ({",".join(STAGES)})')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage, best is kept')
+    parser.add_argument('--output', default=None, help='Write results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='Compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown vs baseline (0.2 = 20%%)')
+    parser.add_argument('-v', action='store_true', help='Show app logging')
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    formats = [log_format.strip() for log_format in args.formats.split(',') if log_format.strip()]
+    for stage in stages:
+        if stage not in _BENCHMARKS:
+            parser.error(f'Invalid stage [{stage}], valid stages: {STAGES}')
+
+    LOGGER.remove()
+    if args.v:
+        LOGGER.add(sys.stderr, level='DEBUG')
+
+    os.chdir(REPO_ROOT)    # app paths (templates, static, config) are relative to the repo root
+    with tempfile.TemporaryDirectory(prefix='dtfv-bench-') as tmp_dir:
+        work_dir = pathlib.Path(tmp_dir)
+        from utils import cfg
+        cfg.index_dir = str(work_dir / 'index')
+        cfg.overflow_policy = 'block'    # measure throughput, not dropped lines
+
+        results = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'lines': args.lines,
+                'repeat': args.repeat,
+            },
+            'results': {},
+        }
+        for log_format in formats:
+            lines = log_generator.generate(log_format, args.lines)
+            for stage in stages:
+                name = f'{stage}.{log_format}'
+                result = _BENCHMARKS[stage](log_format, lines, work_dir, args.repeat)
+                results['results'][name] = result
+                latency = f'p50 {result["p50_us"]:.2f}us  p99 {result["p99_us"]:.2f}us' if 'p50_us' in result else f'mean {result["mean_us"]:.2f}us'
+                print(f'{name:36} {result["lines_per_sec"]:14,.0f} lines/sec   {latency}', flush=True)
+
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f'\nResults written to {args.output}')
+
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} stage(s) slower than baseline by more than {args.tolerance:.0%}: {", ".join(regressions)}')
+            return 1
+        print(f'\nNo regressions (tolerance {args.tolerance:.0%}).')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
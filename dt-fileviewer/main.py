@@ -2,6 +2,7 @@ import os
 import pathlib
 import sys
 
+from utils.startup_profile import StartupProfile  # first, times the imports below (--startup-profile)
 import dt_tools.logger.logging_helper as lh
 import utils.cfg as cfg
 import uvicorn
@@ -10,10 +11,13 @@ from fastapi.staticfiles import StaticFiles
 from loguru import logger as LOGGER
 from router import routers
 from utils.helper import Helper
+from utils.metrics import Metrics
+from utils.shared_reader import SharedReader
+from utils.shared_ring import SharedLineRing
+from utils.system_sampler import SystemSampler
 
 SEP_LINE = '='*80
-
-app = FastAPI()
+StartupProfile.mark(f'{__name__}: imports')
 
 async def lifespan(app: FastAPI):
     # Startup code
@@ -42,6 +46,9 @@ async def lifespan(app: FastAPI):
     LOGGER.debug('')
     LOGGER.debug('DEBUG is enabled.')
 
+    Metrics.start_loop_monitor()
+    SystemSampler.start()
+    StartupProfile.report()
     LOGGER.info('')
     LOGGER.success('>> Waiting for connection...')
     yield
@@ -52,10 +59,11 @@ async def lifespan(app: FastAPI):
 app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="./dt-fileviewer/static"), name="static")
 app.include_router(routers.router)
+StartupProfile.mark(f'{__name__}: app created')
 
 @app.middleware('http')
 async def middleware_hook(request: Request, call_next):
-    if '/static/' not in request.url.path:
+    if '/static/' not in request.url.path and request.url.path != '/metrics':
         # LOGGER.warning(request.url.path)
         params = '' if len(request.path_params) == 0 else request.path_params
         LOGGER.info(f'=> {request.client.host:13} [{request.method}] {request.url}  {request.query_params}  {params}')
@@ -72,18 +80,26 @@ if __name__ == "__main__":
     cfg.console_ll = console_ll
     h_console = lh.configure_logger(log_level=cfg.console_ll, log_format=cfg.console_format, brightness=False)  # noqa: F841
     h_infolog = lh.configure_logger(cfg.logfile, log_level=cfg.console_ll, log_format=cfg.file_format, rotation=cfg.rotation, retention=cfg.retention)  # noqa: F841
+    StartupProfile.mark('logger configured')
     
     if '-c' in sys.argv:
         cfg.create_new_config()
     else:
         try:
-            uvicorn.run(app='main:app', 
+            listen_port = cfg.listen_port    # probed here if not in the config file
+            StartupProfile.mark('listen port')
+            if SharedLineRing.enabled():
+                SharedLineRing.publish_prefix(listen_port)
+                SharedReader.start_process()
+            # An import string is only needed to start workers/reload, the app is not imported twice
+            uvicorn.run(app='main:app' if cfg.auto_reload or cfg.num_workers > 1 else app, 
                         host=cfg.bind_host, 
-                        port=cfg.listen_port,
+                        port=listen_port,
                         reload=cfg.auto_reload,
                         workers=cfg.num_workers, 
+                        ws_per_message_deflate=cfg.ws_deflate,
                         proxy_headers=True,
-                        forwarded_allow_ips='*',
+                        forwarded_allow_ips=cfg.forwarded_allow_ips,
                         log_level=cfg.uvicorn_ll.lower())
         except Exception as ex:
             LOGGER.exception(f'uvicorn exception: {ex}')
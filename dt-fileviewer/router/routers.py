@@ -1,14 +1,31 @@
 import asyncio
+import functools
+import hmac
 import pathlib
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
 
-from fastapi import APIRouter, Request, WebSocket
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, status
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from loguru import logger as LOGGER
 from starlette.datastructures import URL, FormData
 from utils import cfg as cfg
+from utils.compressed_file import CompressedFile
+from utils.file_export import FileExport, SnapshotFileResponse
+from utils.file_search import FileSearch
 from utils.helper import Helper
-from utils.textfile_tailer import StartPos, TextFileHandler
+from utils.level_classifier import LevelClassifier
+from utils.level_index import LevelIndex
+from utils.line_filter import LineFilter
+from utils.line_index import LineIndex
+from utils.merged_view import MergedView
+from utils.metrics import Metrics
+from utils.profiler import Profiler
+from utils.system_sampler import SystemStream
+from utils.textfile_tailer import StartPos, TailRegistry, TailSubscriber
+from utils.timestamp_detector import TimestampDetector
 from utils.validation import Validation as Validator
 from utils.ws_con_mgr import WsConnectionManager
 
@@ -17,9 +34,6 @@ router = APIRouter()
 templates = Jinja2Templates(directory="./dt-fileviewer/templates/")
 templates.env.globals['URL'] = URL
 
-connection: WsConnectionManager = None
-tail_process: TextFileHandler = None
-
 
 # == /root  ===============================================================================
 @router.get('/')
@@ -64,12 +78,346 @@ def system_info(request: Request):
     return templates.TemplateResponse('system.html', context={'request': request, 'appinfo': app_info})     
 
 
+# == /metrics  ===============================================================================
+@router.get('/metrics', response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(Metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+# == /admin  ===============================================================================
+_MAX_PROFILE_SECONDS = 300
+_MAX_PROFILE_HZ = 1000
+
+def _check_admin(request: Request):
+    # client is the X-Forwarded-For address only when the peer is a trusted proxy (forwarded_allow_ips)
+    if request.client is None or request.client.host not in [host.strip() for host in cfg.admin_hosts.split(',')]:
+        raise HTTPException(status_code=403, detail='Not allowed (admin_hosts).')
+    if cfg.admin_token and not hmac.compare_digest(request.headers.get('x-admin-token', ''), cfg.admin_token):
+        raise HTTPException(status_code=403, detail='Not allowed (admin_token).')
+
+@router.get('/admin/profile')
+async def admin_profile(request: Request, seconds: float = 10, hz: int = 100, format: str = 'collapsed'):
+    """Sample the server for seconds, collapsed stacks (flamegraph.pl) or json (stacks and stage spans)."""
+    _check_admin(request)
+    if not 0 < seconds <= _MAX_PROFILE_SECONDS or not 0 < hz <= _MAX_PROFILE_HZ or format not in ['collapsed', 'json']:
+        raise HTTPException(status_code=400, detail=f'seconds: 0-{_MAX_PROFILE_SECONDS}, hz: 1-{_MAX_PROFILE_HZ}, format: collapsed or json.')
+    result = await asyncio.to_thread(Profiler.profile, seconds, hz)
+    if result is None:
+        raise HTTPException(status_code=409, detail='A profile is already running.')
+    if format == 'json':
+        return JSONResponse(result)
+    return PlainTextResponse(Profiler.collapsed(result))
+
+@router.post('/admin/profile/stop')
+async def admin_profile_stop(request: Request):
+    """End the running profile now, its request returns what was sampled."""
+    _check_admin(request)
+    running = Profiler.is_running()
+    Profiler.stop()
+    return {'stopped': running}
+
+
+# == /api  ===============================================================================
+_MAX_PAGE_LINES = 10000
+_MAX_SEARCH_RESULTS = 100000
+_MAX_RANGE_BYTES = 16 * 1024 * 1024
+
+async def _get_textfile(textfile_id: str, prepare: bool = True) -> pathlib.Path:
+    textfile = pathlib.Path(cfg.text_files.get(textfile_id, 'DoesNotExist'))
+    if not textfile.exists():
+        raise HTTPException(status_code=404, detail=f'[{textfile_id}] not found.')
+    if prepare:
+        await _prepare_compressed(textfile)
+    return textfile
+
+async def _prepare_compressed(textfile: pathlib.Path):
+    if CompressedFile.is_compressed(textfile):
+        # Decompress once to build the seek checkpoints, off the event loop
+        await asyncio.to_thread(CompressedFile.get, textfile)
+
+def _etag(textfile: pathlib.Path, *parts: int) -> str:
+    # File identity + position, content at a given position of an append-only file doesn't change
+    stat = textfile.stat()
+    return '"' + '-'.join(f'{part:x}' for part in (stat.st_dev, stat.st_ino, *parts)) + '"'
+
+def _not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match', None)
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+@router.get('/api/files/{textfile_id}/lines')
+async def api_file_lines(request: Request, textfile_id: str, from_line: int = None, from_offset: int = None, 
+                         cursor: str = None, count: int = 100):
+    """
+    Page of lines from from_line, from_offset (the line containing it) or a cursor ('offset:line')
+    returned as next_cursor/prev_cursor by a prior page.
+
+    Complete pages (count lines available) can't change and carry an ETag (If-None-Match -> 304).
+    A byte Range header returns the raw bytes of the file instead (206).
+    """
+    textfile = await _get_textfile(textfile_id)
+    if request.headers.get('range', None):
+        return await _file_range(request, textfile)
+    if count < 1:
+        raise HTTPException(status_code=400, detail='count must be > 0.')
+
+    count = min(count, _MAX_PAGE_LINES)
+    index = LineIndex.get(textfile_id, textfile)
+    offset = None
+    if cursor:
+        try:
+            offset, from_line = FileSearch.parse_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f'Invalid cursor [{cursor}].')
+    elif from_offset is not None:
+        if from_offset < 0:
+            raise HTTPException(status_code=400, detail='from_offset must be >= 0.')
+        from_line = await index.line_for_offset(from_offset)
+        if from_line is None:
+            from_line = index.line_count     # past the last complete line
+    from_line = from_line or 0
+    if from_line < 0:
+        raise HTTPException(status_code=400, detail='from_line must be >= 0.')
+
+    if offset is None:
+        offset = await index.offset_for_line(from_line)
+    headers = {'Accept-Ranges': 'bytes', 'Cache-Control': 'no-store'}
+    if offset is not None and index.is_complete(from_line, count):
+        headers['ETag'] = _etag(textfile, offset, count)
+        headers['Cache-Control'] = 'no-cache'
+        if _not_modified(request, headers['ETag']):
+            return Response(status_code=304, headers=headers)
+
+    lines, offset, next_offset = await index.read_lines(from_line, count, offset)
+    next_line = from_line + len(lines)
+    prev_line = max(from_line - count, 0)
+    prev_offset = None if from_line == 0 else await index.offset_for_line(prev_line)
+    return JSONResponse({'textfile_id': textfile_id, 'from_line': from_line, 'from_offset': offset, 
+                         'count': len(lines), 'next_line': next_line, 'eof': len(lines) < count, 
+                         'next_cursor': None if next_offset is None else f'{next_offset}:{next_line}',
+                         'prev_cursor': None if prev_offset is None else f'{prev_offset}:{prev_line}',
+                         'lines': lines}, headers=headers)
+
+async def _file_range(request: Request, textfile: pathlib.Path) -> Response:
+    size = await asyncio.to_thread(CompressedFile.size_of, textfile)
+    found = re.fullmatch(r'bytes=(\d*)-(\d*)', request.headers['range'].strip())
+    if found is None or found.groups() == ('', ''):
+        raise HTTPException(status_code=416, detail='Only a single byte range is supported.', headers={'Content-Range': f'bytes */{size}'})
+    start, end = found.groups()
+    if start == '':
+        start, end = max(size - int(end), 0), size - 1       # suffix range, last n bytes
+    else:
+        start, end = int(start), size - 1 if end == '' else min(int(end), size - 1)
+    if start > end:
+        raise HTTPException(status_code=416, detail='Range not satisfiable.', headers={'Content-Range': f'bytes */{size}'})
+
+    end = min(end, start + _MAX_RANGE_BYTES - 1)
+    headers = {'Accept-Ranges': 'bytes', 'Cache-Control': 'no-cache', 'ETag': _etag(textfile, start, end)}
+    if _not_modified(request, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    data = await asyncio.to_thread(LineIndex.read_bytes, str(textfile), start, end - start + 1)
+    headers['Content-Range'] = f'bytes {start}-{start + len(data) - 1}/{size}'
+    return Response(data, status_code=206, media_type='text/plain; charset=utf-8', headers=headers)
+
+
+@router.get('/api/files/{textfile_id}/search')
+async def api_file_search(request: Request, textfile_id: str, q: List[str] = Query(...), regex: bool = False, 
+                          ignore_case: bool = False, limit: int = 1000, cursor: str = None):
+    textfile = await _get_textfile(textfile_id)
+    try:
+        file_search = FileSearch(textfile, q, regex=regex, ignore_case=ignore_case)
+        FileSearch.parse_cursor(cursor)
+    except (ValueError, re.error) as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+
+    limit = max(1, min(limit, _MAX_SEARCH_RESULTS))
+    return StreamingResponse(file_search.search(cursor, limit, is_cancelled=request.is_disconnected), 
+                             media_type='application/x-ndjson')
+
+
+@router.get('/api/files/{textfile_id}/levels')
+async def api_file_levels(textfile_id: str, level: str = 'ERROR', from_offset: int = 0, direction: str = 'next'):
+    """Offset and line number of the next/previous (direction) line of level (ERROR, WARNING) from from_offset."""
+    textfile = await _get_textfile(textfile_id)
+    code = LevelClassifier.CODES.get(level.upper(), level.upper())
+    if code not in LevelIndex.LEVELS or direction not in ['next', 'prev'] or from_offset < 0:
+        raise HTTPException(status_code=400, detail='level: ERROR or WARNING, direction: next or prev, from_offset >= 0.')
+
+    levels = LevelIndex.get(textfile_id, textfile)
+    offset = await levels.find(code, from_offset, forward=direction == 'next')
+    line = None if offset is None else await LineIndex.get(textfile_id, textfile).line_for_offset(offset)
+    return JSONResponse({'textfile_id': textfile_id, 'level': code, 'direction': direction, 'from_offset': from_offset,
+                         'offset': offset, 'line': line, 'counts': levels.counts()})
+
+
+@router.get('/api/files/{textfile_id}/download')
+async def api_file_download(request: Request, textfile_id: str, gzip: bool = False, from_offset: int = None, 
+                            to_offset: int = None, start_time: str = None, end_time: str = None):
+    """
+    The file as an attachment, as-is (compressed files too), a Range header resumes a download.
+
+    Export: with an offset (from_offset, to_offset) or time (start_time, end_time) range, the filter
+    parameters of /ws/view (filter_text, exclude_text, min_level, filter_regex, ignore_case) or gzip,
+    the selected (decompressed) lines are streamed instead, no Range.  X-Export-Range is the byte range
+    exported, an export is continued with from_offset=<end>.
+    """
+    try:
+        line_filter = LineFilter.from_query(request.query_params, textfile_id)
+    except (ValueError, re.error) as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+    export = gzip or line_filter is not None or any(value is not None for value in (from_offset, to_offset, start_time, end_time))
+    textfile = await _get_textfile(textfile_id, prepare=export)
+    if not export:
+        media_type = 'application/octet-stream' if CompressedFile.is_compressed(textfile) else 'text/plain; charset=utf-8'
+        return SnapshotFileResponse(textfile, stat_result=textfile.stat(), filename=textfile.name, media_type=media_type,
+                                    headers={'Cache-Control': 'no-cache'})
+
+    if (from_offset or 0) < 0 or (to_offset or 0) < 0:
+        raise HTTPException(status_code=400, detail='from_offset and to_offset must be >= 0.')
+    size = await asyncio.to_thread(CompressedFile.size_of, textfile)
+    start, end = from_offset or 0, size if to_offset is None else min(to_offset, size)
+    file_date = datetime.fromtimestamp(textfile.stat().st_mtime)
+    detector = TimestampDetector.for_file(textfile_id)
+    for name, value in (('start_time', start_time), ('end_time', end_time)):
+        if value is None:
+            continue
+        # Time only (i.e. 10:42) is relative to the date the file was last written
+        at = TimestampDetector.parse_start_time(value, file_date)
+        if at is None:
+            raise HTTPException(status_code=400, detail=f'Invalid {name} [{value}].')
+        offset = await asyncio.to_thread(detector.find_offset, str(textfile), at, size)
+        start, end = (max(start, offset), end) if name == 'start_time' else (start, min(end, offset))
+    start = min(start, end)
+
+    file_export = FileExport(textfile, start, end, line_filter=line_filter, gzip=gzip)
+    headers = {'Content-Disposition': FileExport.content_disposition(FileExport.export_name(textfile, gzip)),
+               'Cache-Control': 'no-store', 'X-Export-Range': f'{start}-{end}'}
+    return StreamingResponse(file_export.stream(is_cancelled=request.is_disconnected), headers=headers,
+                             media_type='application/gzip' if gzip else 'text/plain; charset=utf-8')
+
+
 # == /websocket  ===============================================================================
+_MAX_MERGED_FILES = 16
+
+
+def _query_int(websocket: WebSocket, name: str, default: int) -> Optional[int]:
+    """Non-negative integer query parameter, None if invalid."""
+    value = websocket.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        value = -1
+    if value < 0:
+        LOGGER.warning(f'- Invalid {name} [{websocket.query_params.get(name)}].  Ignore.')
+        return None
+    return value
+
+
+async def _ws_reject(websocket: WebSocket):
+    """Close with 1008 (policy violation), accepted first so the client gets the code (not a HTTP 403)."""
+    await websocket.accept()
+    await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+
+
+def _ws_options(websocket: WebSocket, textfile: pathlib.Path, textfile_id: str = None) -> Optional[Tuple[str, LineFilter, int, int, datetime, str]]:
+    """(start_pos, line_filter, start_line, start_lines, start_time, protocol) from the query, None if invalid."""
+    start_pos: str = websocket.query_params.get("start_pos", cfg.start_pos)
+    if start_pos.upper() not in StartPos.__members__:
+        LOGGER.warning(f'- Invalid start_pos [{start_pos}].  Ignore.')
+        return None
+    try:
+        line_filter = LineFilter.from_query(websocket.query_params, textfile_id)
+    except (ValueError, re.error) as ex:
+        LOGGER.warning(f'- Invalid filter: {ex}.  Ignore.')
+        return None
+    start_line: int = _query_int(websocket, "start_line", 0)
+    if start_line is None:
+        return None
+    start_lines: int = _query_int(websocket, "start_lines", cfg.tail_lines)
+    if start_lines is None:
+        return None
+    protocol: str = websocket.query_params.get("protocol", TailSubscriber.PROTOCOL_HTML).lower()
+    if protocol not in [TailSubscriber.PROTOCOL_HTML, TailSubscriber.PROTOCOL_COMPACT]:
+        LOGGER.warning(f'- Invalid protocol [{protocol}].  Ignore.')
+        return None
+    start_time: datetime = None
+    if websocket.query_params.get("start_time"):
+        # Time only (i.e. 10:42) is relative to the date the file was last written
+        file_date = datetime.fromtimestamp(textfile.stat().st_mtime)
+        start_time = TimestampDetector.parse_start_time(websocket.query_params.get("start_time"), file_date)
+        if start_time is None:
+            LOGGER.warning(f'- Invalid start_time [{websocket.query_params.get("start_time")}].  Ignore.')
+            return None
+    return start_pos, line_filter, start_line, start_lines, start_time, protocol
+
+
+async def _handle_ws(websocket: WebSocket, subscriber: Union[TailSubscriber, MergedView, SystemStream]):
+    s_msg_type = WsConnectionManager.MsgType.JSON if subscriber.compact else WsConnectionManager.MsgType.TEXT
+
+    LOGGER.debug('- Create connection manager')
+    connection = WsConnectionManager(websocket=websocket,
+                                    recv_handler=functools.partial(get_incoming_command, subscriber=subscriber),
+                                    send_handler=subscriber.get_or_waitfor_batch,
+                                    r_msg_type=WsConnectionManager.MsgType.JSON,
+                                    s_msg_type=s_msg_type,
+                                    end_status=lambda: subscriber.end_status)
+
+    LOGGER.info('- handle websocket request.')
+    try:
+        await connection.handle_connection()
+    except Exception as ex:
+        LOGGER.error(f'handle_connection error: {ex}')
+    finally:
+        subscriber.stop_tail()
+
+
+@router.websocket("/ws/view")
+async def ws_view_merged(websocket: WebSocket, ids: str = ''):
+    """Several files (ids=app,nginx,worker) merged in timestamp order."""
+    LOGGER.info('='*40) 
+    LOGGER.info(f'==> ws_view_merged("{ids}")')
+    textfiles: Dict[str, str] = {}
+    for textfile_id in [textfile_id.strip() for textfile_id in ids.split(',') if textfile_id.strip()]:
+        textfile_nm = cfg.text_files.get(textfile_id, None)
+        if textfile_nm is None or not pathlib.Path(textfile_nm).exists():
+            LOGGER.warning(f'- {textfile_id} - Does NOT exist.  Ignore.')
+            await websocket.close()
+            return
+        textfiles[textfile_id] = textfile_nm
+    if not 0 < len(textfiles) <= _MAX_MERGED_FILES:
+        LOGGER.warning(f'- {len(textfiles)} files, 1 to {_MAX_MERGED_FILES} files can be merged.  Ignore.')
+        await websocket.close()
+        return
+
+    options = _ws_options(websocket, pathlib.Path(next(iter(textfiles.values()))))
+    if options is None or options[0].upper() == StartPos.LINE.name:
+        LOGGER.warning('- Invalid options (start_pos line is per file).  Ignore.')
+        await _ws_reject(websocket)
+        return
+    start_pos, line_filter, _, start_lines, start_time, protocol = options
+
+    for textfile_nm in textfiles.values():
+        await _prepare_compressed(pathlib.Path(textfile_nm))
+    LOGGER.info(f'- Subscribe to merged tail {list(textfiles)}.  StartPos: {start_pos}  Lines: {start_lines}  Time: {start_time}  Filter: {line_filter}  Protocol: {protocol}')
+    merged_view = MergedView(textfiles, start_loc=StartPos[start_pos.upper()], line_filter=line_filter,
+                             start_time=start_time, start_lines=start_lines, protocol=protocol)
+    await _handle_ws(websocket, merged_view)
+
+
+@router.websocket("/ws/system")
+async def ws_system(websocket: WebSocket):
+    """System information, whole snapshot then changed fields on every sample."""
+    LOGGER.info('='*40) 
+    LOGGER.info('==> ws_system()')
+    await _handle_ws(websocket, SystemStream())
+
 
 @router.websocket("/ws/view/{textfile_id}")
 async def ws_view_file(textfile_id: str, websocket: WebSocket):
-    global tail_process
-
     textfile_nm = cfg.text_files.get(textfile_id, 'DoesNotExist')
     LOGGER.info('='*40) 
     LOGGER.info(f'==> ws_view_file("{textfile_id}")')
@@ -81,40 +429,21 @@ async def ws_view_file(textfile_id: str, websocket: WebSocket):
         await websocket.close()
         return
     
-    if tail_process is not None and tail_process.in_progress:
-        tail_process.stop_tail()
-        while tail_process.in_progress:
-            LOGGER.info(f'- Waiting for prior tail [{tail_process.filename.name}] to complete.')
-            await asyncio.sleep(.25)
-
-    LOGGER.debug('- Create tail_process')
-    tail_process = TextFileHandler(textfile_nm)
-    LOGGER.debug('- Create connection manager')
-    connection = WsConnectionManager(websocket=websocket,
-                                    recv_handler=get_incoming_command,
-                                    send_handler=tail_process.get_or_waitfor_line,
-                                    r_msg_type=WsConnectionManager.MsgType.JSON,
-                                    s_msg_type=WsConnectionManager.MsgType.TEXT)   
-     
-    start_pos: str = websocket.query_params.get("start_pos")
-    filter_text: str = websocket.query_params.get("filter_text")    
-    LOGGER.info(f'- Start  tail_process [{tail_process.filename.name}].  StartPos: {start_pos}  Filter: {filter_text}')
-
-    await tail_process.start_tail(start_loc=StartPos[start_pos.upper()], filter_text=filter_text)
-
-    LOGGER.info('- handle websocket request.')
-    try:
-        await connection.handle_connection()
-    except Exception as ex:
-        LOGGER.error(f'handle_connection error: {ex}')
-    finally:
-        tail_process.stop_tail()
+    options = _ws_options(websocket, textfile, textfile_id)
+    if options is None:
+        await _ws_reject(websocket)
+        return
+    start_pos, line_filter, start_line, start_lines, start_time, protocol = options
 
+    await _prepare_compressed(textfile)
+    LOGGER.info(f'- Subscribe to tail [{textfile.name}].  StartPos: {start_pos}  Line: {start_line}  Lines: {start_lines}  Time: {start_time}  Filter: {line_filter}  Protocol: {protocol}')
+    subscriber = TailRegistry.subscribe(textfile_id, textfile_nm, start_loc=StartPos[start_pos.upper()], line_filter=line_filter, 
+                                        start_line=start_line, start_time=start_time, start_lines=start_lines, protocol=protocol)
+    await _handle_ws(websocket, subscriber)
 
-async def get_incoming_command(message: dict, cm: WsConnectionManager):
-    global tail_process
 
-    LOGGER.warning(f'- Received: {message}  {type(message)} tail: {type(tail_process)}')
+async def get_incoming_command(message: dict, cm: WsConnectionManager, subscriber: Union[TailSubscriber, MergedView, SystemStream]):
+    LOGGER.warning(f'- Received: {message}  {type(message)} tail: {subscriber.name}')
     cmd = message.get('command', None)
     if cmd is None:
         LOGGER.error('Null command received, ignored.')
@@ -122,11 +451,10 @@ async def get_incoming_command(message: dict, cm: WsConnectionManager):
     
     if cmd == 'toggle-pause':
         LOGGER.info('Toggle-Pause requested')
-        tail_process.paused = not tail_process.paused
+        subscriber.paused = not subscriber.paused
 
     elif cmd == 'quit':
         await cm.shutdown()
 
     else:
-        await cm.inject_message(f'{message}')        
-    
\ No newline at end of file
+        await cm.inject_message(f'{message}')
@@ -0,0 +1,40 @@
+// Live system information: /ws/system sends every field once, then the changed fields per sample.
+// Elements are bound by their data-field attribute (i.e. data-field="memory.virtual_used").
+
+const sampled_at = document.getElementById('sampled_at');
+
+let ws_system = null;
+// Rendered before the first sample (no cpu/disk), rendered again once it is received
+let received_full = sampled_at.dataset.partial == 'true';
+
+function apply_fields(fields) {
+    for (const [field, value] of Object.entries(fields)) {
+        for (const element of document.querySelectorAll(`[data-field="${field}"]`)) {
+            element.textContent = value;
+        }
+    }
+}
+
+function connect_system() {
+    ws_system = new WebSocket('ws://' + window.location.host + '/ws/system');
+
+    ws_system.onmessage = function(event) {
+        const frame = JSON.parse(event.data);
+        if (frame.full && received_full) {
+            // Layout changed (i.e. partition mounted), render the page again
+            window.location.reload();
+            return;
+        }
+        received_full = received_full || frame.full;
+        apply_fields(frame.fields);
+        sampled_at.textContent = new Date(frame.sampled * 1000).toLocaleTimeString();
+    };
+
+    ws_system.onclose = function() {
+        // Server restarted or connection lost, retry
+        received_full = sampled_at.dataset.partial == 'true';
+        setTimeout(connect_system, 5000);
+    };
+}
+
+connect_system();
@@ -9,17 +9,269 @@ const view_form     = document.getElementById('viewfile_form');
 const cbo_textfile  = document.getElementById('cbo_text_filename');
 const cbo_start_pos = document.getElementById('cbo_start_pos');
 const txt_filter    = document.getElementById('filter_text');
+const txt_exclude   = document.getElementById('exclude_text');
+const cbo_min_level = document.getElementById('cbo_min_level');
+const chk_regex     = document.getElementById('chk_filter_regex');
+const chk_ignore_case = document.getElementById('chk_ignore_case');
+const txt_start_line = document.getElementById('start_line');
+const txt_start_time = document.getElementById('start_time');
+const txt_start_lines = document.getElementById('start_lines');
+const txt_merge_ids = document.getElementById('merge_ids');
 const btn_submit    = document.getElementById('submit_button')
 const btn_pause     = document.getElementById('pause_button')
+const btn_prev_error = document.getElementById('prev_error_button')
+const btn_next_error = document.getElementById('next_error_button')
+const btn_download  = document.getElementById('download_button')
 const log_window   = document.getElementById('log_window');
 
 const NULL_FILE     = 'not_selected'
+const MAX_LINES     = 1000000    // client side line buffer
+// Browsers cap element heights (Firefox ~17.9M px), a taller log scrolls a scaled height
+const MAX_SCROLL_HEIGHT = 8000000
+
+// Line level code -> css class (same mapping as Helper.LEVEL_CLASSES)
+const LEVEL_CLASSES = {'E': 'text-danger', 'W': 'text-warning', 'S': 'text-success', 'D': 'text-primary', 'I': 'text-white'}
+
+class LineRing {
+    // Fixed capacity ring of (level, text), oldest lines are dropped when full
+    constructor(capacity) {
+        this.capacity = capacity;
+        this.levels = new Array(capacity);
+        this.texts = new Array(capacity);
+        this.offsets = new Array(capacity);     // file offset of the line, null: not a file line
+        this.clear();
+    }
+
+    clear() {
+        this.start = 0;
+        this.length = 0;
+        this.dropped = 0;       // since last take_dropped()
+    }
+
+    push(level, text, offset = null) {
+        let idx = (this.start + this.length) % this.capacity;
+        if (this.length < this.capacity) {
+            this.length++;
+        } else {
+            this.start = (this.start + 1) % this.capacity;
+            this.dropped++;
+        }
+        this.levels[idx] = level;
+        this.texts[idx] = text;
+        this.offsets[idx] = offset;
+    }
+
+    set_text(line_no, text) {
+        this.texts[(this.start + line_no) % this.capacity] = text;
+    }
+
+    level(line_no) {
+        return this.levels[(this.start + line_no) % this.capacity];
+    }
+
+    text(line_no) {
+        return this.texts[(this.start + line_no) % this.capacity];
+    }
+
+    offset(line_no) {
+        return this.offsets[(this.start + line_no) % this.capacity];
+    }
+
+    take_dropped() {
+        let dropped = this.dropped;
+        this.dropped = 0;
+        return dropped;
+    }
+}
+
+class LogView {
+    // Virtualized scroller: only the visible rows exist in the DOM, updates are
+    // batched to one render per animation frame.  The scroll height is capped at
+    // MAX_SCROLL_HEIGHT, scrollTop is mapped to the content position (content_top).
+    constructor(container, capacity) {
+        this.container = container;
+        this.ring = new LineRing(capacity);
+        this.follow = true;             // stick to the end while new lines arrive
+        this.frame_requested = false;
+        this.note_line = -1;
+
+        container.textContent = '';
+        container.style.position = 'relative';
+        this.spacer = document.createElement('div');
+        this.rows = document.createElement('div');
+        this.rows.style.position = 'absolute';
+        this.rows.style.top = '0';
+        this.rows.style.left = '0';
+        this.rows.style.right = '0';
+        container.append(this.spacer, this.rows);
+        this.row_height = this.measure_row_height();
+
+        container.addEventListener('scroll', () => {
+            let bottom = this.container.scrollTop + this.container.clientHeight;
+            this.follow = bottom >= this.container.scrollHeight - this.row_height;
+            this.request_render();
+        });
+        window.addEventListener('resize', () => this.request_render());
+    }
+
+    measure_row_height() {
+        let probe = this.make_row();
+        probe.textContent = 'X';
+        this.rows.appendChild(probe);
+        let height = probe.getBoundingClientRect().height || 16;
+        probe.remove();
+        return height;
+    }
+
+    make_row() {
+        let row = document.createElement('div');
+        row.style.whiteSpace = 'pre';
+        return row;
+    }
+
+    clear(message = '') {
+        this.ring.clear();
+        this.note_line = -1;
+        this.follow = true;
+        if (message.length) {
+            this.ring.push('I', message);
+        }
+        this.request_render();
+    }
+
+    append_frame(frame) {
+        // Compact frame: {skipped, lines: [[seq, offset, level, text(, file id)], ...]}
+        // file id: merged view (/ws/view?ids=...)
+        if (frame.skipped > 0) {
+            this.ring.push('W', '*** WARNING - ' + frame.skipped + ' lines skipped ***');
+        }
+        for (const [seq, offset, level, text, source] of frame.lines) {
+            if (source === undefined) {
+                this.ring.push(level, text, offset);
+            } else {
+                // Offsets of a merged view are in different files
+                this.ring.push(level, '[' + source + '] ' + text);
+            }
+        }
+        this.note_line = -1;
+        this.request_render();
+    }
+
+    append_note(ch) {
+        if (ch == null || this.note_line < 0) {
+            this.ring.push('I', '');
+            this.note_line = this.ring.length - 1;
+        }
+        if (ch != null) {
+            let text = this.ring.text(this.note_line);
+            this.ring.set_text(this.note_line, (ch == '\b') ? text.slice(0, -1) : text + ch);
+        }
+        this.follow = true;
+        this.request_render();
+    }
+
+    scroll_ratio() {
+        // Content px per scrolled px, 1 unless the content is taller than MAX_SCROLL_HEIGHT
+        let view = this.container.clientHeight;
+        let content = this.ring.length * this.row_height;
+        let scroll = Math.min(content, MAX_SCROLL_HEIGHT);
+        return (content > scroll && scroll > view) ? (content - view) / (scroll - view) : 1;
+    }
+
+    content_top() {
+        // Content position (px) at the top of the view
+        return this.container.scrollTop * this.scroll_ratio();
+    }
+
+    anchor_offset() {
+        // File offset of the first (file) line in view, null if none
+        let first = Math.floor(this.content_top() / this.row_height);
+        for (let line_no = Math.max(first, 0); line_no < this.ring.length; line_no++) {
+            let offset = this.ring.offset(line_no);
+            if (offset != null) {
+                return offset;
+            }
+        }
+        return null;
+    }
+
+    find_offset(offset) {
+        // Line number of the line at file offset, -1 if not (or no longer) loaded
+        for (let line_no = this.ring.length - 1; line_no >= 0; line_no--) {
+            let line_offset = this.ring.offset(line_no);
+            if (line_offset === offset) {
+                return line_no;
+            }
+            if (line_offset != null && line_offset < offset) {
+                break;
+            }
+        }
+        return -1;
+    }
+
+    scroll_to(line_no) {
+        // Line at the top of the view, stop following the end
+        this.follow = false;
+        this.container.scrollTop = line_no * this.row_height / this.scroll_ratio();
+        this.request_render();
+    }
+
+    request_render() {
+        if (!this.frame_requested) {
+            this.frame_requested = true;
+            window.requestAnimationFrame(() => this.render());
+        }
+    }
+
+    render() {
+        this.frame_requested = false;
+        let dropped = this.ring.take_dropped();
+        if (this.note_line >= 0) {
+            this.note_line -= dropped;
+        }
+        // Content position before the height (and so the ratio) changes
+        let content_top = this.content_top();
+        this.spacer.style.height = Math.min(this.ring.length * this.row_height, MAX_SCROLL_HEIGHT) + 'px';
+        if (this.follow) {
+            this.container.scrollTop = this.container.scrollHeight;
+            content_top = this.content_top();
+        } else {
+            // Keep the same lines in view while the oldest are dropped
+            content_top = Math.max(0, content_top - dropped * this.row_height);
+            let scroll_top = content_top / this.scroll_ratio();
+            if (Math.abs(scroll_top - this.container.scrollTop) >= 1) {
+                this.container.scrollTop = scroll_top;
+            }
+        }
+
+        let overscan = 10;
+        let first = Math.max(0, Math.floor(content_top / this.row_height) - overscan);
+        let count = Math.min(this.ring.length - first, Math.ceil(this.container.clientHeight / this.row_height) + 2 * overscan);
+        while (this.rows.childElementCount < count) {
+            this.rows.appendChild(this.make_row());
+        }
+        while (this.rows.childElementCount > Math.max(count, 0)) {
+            this.rows.lastElementChild.remove();
+        }
+        // Rows are placed relative to the view (scrollTop), not at their content position
+        this.rows.style.transform = 'translateY(' + (this.container.scrollTop + first * this.row_height - content_top) + 'px)';
+        let row = this.rows.firstElementChild;
+        for (let line_no = first; row != null; line_no++, row = row.nextElementSibling) {
+            row.className = LEVEL_CLASSES[this.ring.level(line_no)] || LEVEL_CLASSES['I'];
+            row.textContent = this.ring.text(line_no);
+        }
+    }
+}
+
+const log_view = new LogView(log_window, MAX_LINES);
 
 // Initial connection
 let ws_file_vw = null
 let base_uri = '/ws/view/'
 let uri = base_uri + cbo_textfile.value;
 let log_window_paused = false
+let merged_view = false
+let pending_jump = null     // file offset to scroll to once received (jump to a line not loaded)
 
 
 reconnectws_file('ws://' + window.location.host + uri)
@@ -30,9 +282,23 @@ submit_button.addEventListener("click", (e) => {
     let text_file = cbo_textfile.value;
     let uri = base_uri + text_file;
     let query_string = '?start_pos='+cbo_start_pos.value;
-    if (txt_filter.value.trim().length) {
-        query_string += '&filter_text='+txt_filter.value.trim()
+    let merge_ids = txt_merge_ids.value.split(',').map(id => id.trim()).filter(id => id.length && id != text_file);
+    merged_view = merge_ids.length > 0;
+    if (merge_ids.length) {
+        // Merged (timestamp ordered) view of the selected file and merge_ids
+        uri = '/ws/view';
+        query_string = '?ids=' + [text_file].concat(merge_ids).map(encodeURIComponent).join(',') + '&start_pos='+cbo_start_pos.value;
+    }
+    if (cbo_start_pos.value == 'line' && txt_start_line.value.trim().length) {
+        query_string += '&start_line='+txt_start_line.value.trim()
+    }
+    if (cbo_start_pos.value == 'tail' && txt_start_lines.value.trim().length) {
+        query_string += '&start_lines='+txt_start_lines.value.trim()
     }
+    if (cbo_start_pos.value == 'time' && txt_start_time.value.trim().length) {
+        query_string += '&start_time='+encodeURIComponent(txt_start_time.value.trim())
+    }
+    query_string += filter_query();
     console.log('submit button clicked.  file: ' + text_file)
 
     reconnectws_file("ws://" + window.location.host + uri + query_string);
@@ -41,6 +307,69 @@ submit_button.addEventListener("click", (e) => {
     enable_button(btn_pause, ButtonState.NORMAL)
     set_paused_indicator(false)
 });
+
+function filter_query() {
+    let query_string = terms_to_query('filter_text', txt_filter.value);
+    query_string += terms_to_query('exclude_text', txt_exclude.value);
+    if (cbo_min_level.value.length) {
+        query_string += '&min_level='+cbo_min_level.value
+    }
+    if (chk_regex.checked) {
+        query_string += '&filter_regex=1'
+    }
+    if (chk_ignore_case.checked) {
+        query_string += '&ignore_case=1'
+    }
+    return query_string;
+}
+
+async function jump_level(level, direction) {
+    // Next/previous line of level (level index on the server), scroll to it or reload the view from its line
+    let text_file = cbo_textfile.value;
+    if (ws_file_vw == null || text_file == NULL_FILE || merged_view) {
+        return;
+    }
+    let anchor = log_view.anchor_offset();
+    if (anchor == null) {
+        anchor = (direction == 'next') ? 0 : Number.MAX_SAFE_INTEGER;
+    }
+    const response = await fetch('/api/files/' + encodeURIComponent(text_file) + '/levels?level=' + level +
+                                 '&direction=' + direction + '&from_offset=' + anchor);
+    if (!response.ok) {
+        console.error('jump_level: ' + response.status);
+        return;
+    }
+    const result = await response.json();
+    if (result.offset == null) {
+        console.log('No ' + direction + ' ' + level + ' line.');
+        return;
+    }
+    let line_no = log_view.find_offset(result.offset);
+    if (line_no >= 0) {
+        log_view.scroll_to(line_no);
+    } else {
+        pending_jump = result.offset;
+        reconnectws_file('ws://' + window.location.host + base_uri + text_file +
+                         '?start_pos=line&start_line=' + result.line + filter_query());
+    }
+}
+
+btn_prev_error.addEventListener("click", (e) => {
+    e.preventDefault();
+    jump_level('ERROR', 'prev');
+});
+
+btn_next_error.addEventListener("click", (e) => {
+    e.preventDefault();
+    jump_level('ERROR', 'next');
+});
+
+btn_download.addEventListener("click", (e) => {
+    e.preventDefault();
+    if (cbo_textfile.value != NULL_FILE) {
+        window.location.href = '/api/files/' + encodeURIComponent(cbo_textfile.value) + '/download';
+    }
+});
   
 pause_button.addEventListener("click", (e) => {
     log_window_paused = !log_window_paused
@@ -73,49 +402,63 @@ cbo_textfile.addEventListener("change", function () {
 
 cbo_start_pos.addEventListener("change", function(){
     console.log('cbo_start_pos changed')
+    txt_start_line.hidden = (cbo_start_pos.value != 'line');
+    txt_start_time.hidden = (cbo_start_pos.value != 'time');
+    txt_start_lines.hidden = (cbo_start_pos.value != 'tail');
     //TODO check not_selected
     enable_button(btn_submit, ButtonState.NORMAL);
 });
 
+txt_start_line.addEventListener("change", function(){
+    enable_button(btn_submit, ButtonState.NORMAL);
+});
+
+txt_start_time.addEventListener("change", function(){
+    enable_button(btn_submit, ButtonState.NORMAL);
+});
+
+txt_start_lines.addEventListener("change", function(){
+    enable_button(btn_submit, ButtonState.NORMAL);
+});
+
 txt_filter.addEventListener("change", function(){
     console.log('txt_filter changed')
     //TODO check not_selected
     enable_button(btn_submit, ButtonState.NORMAL);
 });
 
+for (const filter_input of [txt_exclude, cbo_min_level, chk_regex, chk_ignore_case]) {
+    filter_input.addEventListener("change", function(){
+        enable_button(btn_submit, ButtonState.NORMAL);
+    });
+}
+
+function terms_to_query(param_name, terms) {
+    // Multiple terms are ; separated, each one becomes a repeated query parameter
+    let query = '';
+    for (const term of terms.split(';')) {
+        if (term.trim().length) {
+            query += '&' + param_name + '=' + encodeURIComponent(term.trim());
+        }
+    }
+    return query;
+}
+
 
 log_window.addEventListener('keydown', function (event) {
     console.log('keypress: ' + event.key);
-    var ch = event.key;
     if (ws_file_vw != null) {
+        // Typed text goes to a local note line at the end of the view
         if (event.key == "Enter") {
-            ch = '<br>';
+            log_view.append_note(null);
         } else if (event.key == "Backspace") {
-            log_window.innerHTML = log_window.innerHTML.slice(0, -1);
-            ch = ''
-        } else if (event.key.length > 1) {
-            ch = '';
+            log_view.append_note('\b');
+        } else if (event.key.length == 1) {
+            log_view.append_note(event.key);
         }
-        log_window.innerHTML += ch;
-        log_window.scrollIntoView({ behavior: "smooth", block: "end" })
-        log_window.scrollTop = log_window.scrollHeight;
     }
 });
 
-function limit_file_buffer() {
-    if (log_window.innerHTML.length > 5242080) {
-        let line_cnt = 0;
-        let pos = 0;
-        while (line_cnt < 10 && pos >= 0) {
-            pos = log_window.innerHTML.indexOf('\n', pos);
-            line_cnt += 1;
-        };
-        if (pos > 0) {
-            console.log('limit_file_buffer...')
-            log_window.innerHTML = log_window.innerHTML.slice(pos+1)
-        }
-    }
-};
 
 function set_paused_indicator(pause_state) {
     let cls = log_window.getAttribute('class');
@@ -166,7 +509,7 @@ function enable_button(btn, state) {
 
 function reconnectws_file(newEndpoint) {
     console.log('Reconnectws_file()');
-    log_window.innerHTML = 'Attempting to connect...'
+    log_view.clear('Attempting to connect...');
     if (newEndpoint == NULL_FILE) {
         console.log('[' + NULL_FILE + '] endpoint.  Abandon');
         ws_file_vw = null
@@ -180,9 +523,12 @@ function reconnectws_file(newEndpoint) {
         }
     }
     
+    let endpoint = newEndpoint;
+    // Raw lines + level codes, styling is done client side
+    newEndpoint += (newEndpoint.includes('?') ? '&' : '?') + 'protocol=compact';
     console.log('- Establish new ws connection: ' + newEndpoint);
     ws_file_vw = new WebSocket(newEndpoint);
-    log_window.innerHTML = ''
+    log_view.clear();
 
     // ------------------------------------------------------------------------------------
     ws_file_vw.onopen = () => {
@@ -192,21 +538,25 @@ function reconnectws_file(newEndpoint) {
 
     // ------------------------------------------------------------------------------------
     ws_file_vw.onclose = (event) => {
-        console.log("ws_log closed: " + event);
-        // Implement reconnection logic if needed
-        log_window.innerHTML = ''
+        console.log("ws_log closed: " + event.code + ' ' + event.reason);
+        log_view.clear();
+        if (event.code == 1012 && event.target === ws_file_vw) {
+            // The file moved (configuration changed), reconnect to its new location
+            setTimeout(() => { if (event.target === ws_file_vw) reconnectws_file(endpoint); }, 1000);
+        }
     };
 
     // ------------------------------------------------------------------------------------
     ws_file_vw.onmessage = (event) => {
-        console.log('ws_log onmessage ' + event.type)
-        var log_window = document.getElementById('log_window')
-        // Handle incoming messages
-        log_window.innerHTML += event.data + "\n";
-        limit_file_buffer();
-        // log_obj.scrollIntoView({ behavior: "smooth", block: "end", inline: "nearest" })
-        log_window.scrollIntoView({ behavior: "smooth", block: "end" })
-        log_window.scrollTop = log_window.scrollHeight;
+        // Each frame is a batch of one or more lines
+        log_view.append_frame(JSON.parse(event.data));
+        if (pending_jump != null) {
+            let line_no = log_view.find_offset(pending_jump);
+            if (line_no >= 0) {
+                log_view.scroll_to(line_no);
+                pending_jump = null;
+            }
+        }
     };
 
     // ------------------------------------------------------------------------------------
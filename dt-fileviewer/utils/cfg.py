@@ -3,13 +3,14 @@ import pathlib
 import sys
 from typing import Tuple, Dict
 
-import dt_tools.net.net_helper as nh
 import dt_tools.logger.logging_helper as lh
 from loguru import logger as LOGGER
 
 TEXTFILES_SECTION = 'TEXTFILES'
+LEVELS_SECTION = 'LEVELS'
 
 def _get_available_port(low_port: int, high_port: int) -> int:
+    import dt_tools.net.net_helper as nh    # scapy stack, only imported when a port must be probed
     LOGGER.debug(f'Checking port range {low_port} --> {high_port} for closed (i.e. available) port.')
     for target_port in range(low_port, high_port+1):
         if not nh.is_port_open('localhost', target_port):
@@ -36,6 +37,25 @@ def _get_textfile_section() -> Dict:
         LOGGER.error(f'- No files configured, you must edit {pathlib.Path(FILE_CONFIG).absolute()} to setup.')
     return logfiles
 
+def __getattr__(name: str):
+    """
+    Values (with an expensive default) missing from the config file, resolved on first use.
+    Unresolved values are not listed by to_dict().
+    """
+    resolver = _LAZY_DEFAULTS.get(name, None)
+    if resolver is None:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    val = resolver()
+    globals()[name] = val
+    return val
+
+def _get_levels_section() -> Dict:
+    """Level format per text file ID (see LevelClassifier), files not listed: auto."""
+    if not _CONFIG.has_section(LEVELS_SECTION):
+        return {}
+    # raw: formats may be regular expressions (% is not an interpolation)
+    return {option: _CONFIG.get(LEVELS_SECTION, option, raw=True) for option in _CONFIG[LEVELS_SECTION]}
+
 def _get_section_desc(key: str) -> Tuple[str, str]:
     entry = _KEYWORD_SECTIONS.get(key, None)
     if entry is None:
@@ -54,7 +74,7 @@ def to_dict() -> dict:
         val = h_module.__getattribute__(key)
         var_type = type(val)
         if var_type is str or var_type is int or var_type is bool:
-            if 'pass' in key:
+            if 'pass' in key or 'token' in key:
                 val = '*****'
             config_dict[key] = val
             
@@ -87,6 +107,11 @@ def create_new_config(overwrite: bool = False):
         if fileid != Helper._UNKNOWN_KEY:
             new_config[TEXTFILES_SECTION][fileid] = fileloc
 
+    if len(level_formats) > 0:
+        new_config.add_section(LEVELS_SECTION)
+        for fileid, level_format in level_formats.items():
+            new_config[LEVELS_SECTION][fileid] = level_format
+
     with open(filename, 'w',) as h_file:
         h_file.write(f'# {"="*80}\n')
         h_file.write(f'# {PACKAGE_NAME} configuration file (auto-generated)\n')
@@ -103,6 +128,10 @@ def create_new_config(overwrite: bool = False):
                     h_file.write('# List of text files.  Unique ID and location of text file.\n')
                     h_file.write('# textfile_id = location of text file\n')
                     break
+        if len(level_formats) == 0:
+            h_file.write(f'\n# [{LEVELS_SECTION}] Log level format per text file (auto, loguru, bracket, json, python, keyword\n')
+            h_file.write('# or a regex with a (?P<level>...) group).  Files not listed: auto.\n')
+            h_file.write('# textfile_id = loguru\n')
 
     LOGGER.info(f'Config file [{filename}] created/updated.')
     LOGGER.info('')
@@ -128,6 +157,11 @@ _KEYWORD_SECTIONS = {
     "listen_port": {"section": "WEBSERVER", "desc": "Port server is listening on"},
     "auto_reload": {"section": "WEBSERVER", "desc": "Auto reload server on code file change"},
     "num_workers": {"section": "WEBSERVER", "desc": "Number of thread workers"},
+    "ws_deflate":  {"section": "WEBSERVER", "desc": "Negotiate websocket permessage-deflate compression"},
+    "shared_reader": {"section": "WEBSERVER", "desc": "num_workers > 1, files are read by a single process and shared with the workers"},
+    "admin_hosts": {"section": "WEBSERVER", "desc": "Client addresses allowed to use /admin endpoints (comma separated)"},
+    "admin_token": {"section": "WEBSERVER", "desc": "If set, /admin requests must send it in the X-Admin-Token header"},
+    "forwarded_allow_ips": {"section": "WEBSERVER", "desc": "Proxy addresses trusted for X-Forwarded-For (comma separated, * = any)"},
 
     "rotation":       {"section": "LOGS", "desc": "Limit on log file size (i.e. '15 mb')"},
     "retention":      {"section": "LOGS", "desc": "How many copies to retain (i.e. 3)"},
@@ -138,16 +172,42 @@ _KEYWORD_SECTIONS = {
     "console_format": {"section": "LOGS", "desc": "Log line format for console logging"},
 
     "start_pos":      {"section": "RUNTIME", "desc": "Tail staring pos. (head-begin, center, tail-end)"},
-    "buffer_size":    {"section": "RUNTIME", "desc": "How many bytes to display on a tail (start position)"},
+    "buffer_size":    {"section": "RUNTIME", "desc": "How many bytes to display on a tail (start position) if tail_lines is 0"},
+    "tail_lines":     {"section": "RUNTIME", "desc": "How many lines to display on a tail (start position)"},
     "filter_text":    {"section": "RUNTIME", "desc": "Filter lines containing filter text string"},
+    "watch_backend":  {"section": "RUNTIME", "desc": "File change detection (auto, inotify, poll)"},
+    "poll_max_ms":    {"section": "RUNTIME", "desc": "Max poll interval (ms) for idle files, poll backend"},
+    "batch_max_bytes": {"section": "RUNTIME", "desc": "Max size (bytes) of a websocket frame of lines"},
+    "batch_wait_ms":  {"section": "RUNTIME", "desc": "Max wait (ms) after 1st pending line before sending frame"},
+    "ring_size":      {"section": "RUNTIME", "desc": "Max lines buffered per viewer"},
+    "overflow_policy": {"section": "RUNTIME", "desc": "Viewer buffer full (block, drop_oldest, drop_newest). block slows the shared reader"},
+    "line_index_interval": {"section": "RUNTIME", "desc": "Line index records the offset of every Nth line"},
+    "index_dir":      {"section": "RUNTIME", "desc": "Location of line index (sidecar) files"},
+    "read_chunk_size": {"section": "RUNTIME", "desc": "Bytes read from the file per read request"},
+    "decode_errors":  {"section": "RUNTIME", "desc": "UTF-8 decode error handling (replace, ignore, backslashreplace)"},
+    "checkpoint_mb":  {"section": "RUNTIME", "desc": "Compressed (.gz) files, keep a seek checkpoint every N MB (uncompressed)"},
+    "shared_ring_mb": {"section": "RUNTIME", "desc": "Size (MB) of the shared memory line buffer per file (shared_reader)"},
+    "merge_window_ms": {"section": "RUNTIME", "desc": "Merged view, max wait (ms) for lines of other files before a line is sent"},
+    "sysinfo_interval": {"section": "RUNTIME", "desc": "System information is sampled (in the background) every N seconds"},
+}
+
+# Not set in the config file: resolved by __getattr__ when first used
+_LAZY_DEFAULTS = {
+    "listen_port": lambda: _get_available_port(8000, 8100),
 }
 
 # ========================================================================================
 # When adding variable, also add to _KEYWORD_SECTIONS
 bind_host   = _CONFIG.get(_get_section_desc('bind_host')[0],      "bind_host", fallback='0.0.0.0')
-listen_port = _CONFIG.getint(_get_section_desc('listen_port')[0], "listen_port", fallback=_get_available_port(8000, 8100))
+if _CONFIG.has_option(_get_section_desc('listen_port')[0], "listen_port"):
+    listen_port = _CONFIG.getint(_get_section_desc('listen_port')[0], "listen_port")
 auto_reload = _CONFIG.getboolean(_get_section_desc('auto_reload')[0], "auto_reload", fallback=False)
 num_workers = _CONFIG.getint(_get_section_desc('num_workers')[0], "num_workers", fallback=1) 
+ws_deflate  = _CONFIG.getboolean(_get_section_desc('ws_deflate')[0], "ws_deflate", fallback=True)
+shared_reader = _CONFIG.getboolean(_get_section_desc('shared_reader')[0], "shared_reader", fallback=True)
+admin_hosts   = _CONFIG.get(_get_section_desc('admin_hosts')[0], "admin_hosts", fallback="127.0.0.1,::1")
+admin_token   = _CONFIG.get(_get_section_desc('admin_token')[0], "admin_token", fallback="")
+forwarded_allow_ips = _CONFIG.get(_get_section_desc('forwarded_allow_ips')[0], "forwarded_allow_ips", fallback="127.0.0.1")
    
 rotation    = _CONFIG.get(_get_section_desc('rotation')[0],     "rotation", fallback='1 MB')
 retention   = _CONFIG.getint(_get_section_desc('retention')[0], "retention", fallback=5)
@@ -159,7 +219,23 @@ console_format = _CONFIG.get(_get_section_desc('console_format')[0], "console_fo
 
 start_pos   = _CONFIG.get(_get_section_desc('start_pos')[0], "start_pos", fallback="tail")
 buffer_size = _CONFIG.getint(_get_section_desc('buffer_size')[0], "buffer_size", fallback=4096)
+tail_lines  = _CONFIG.getint(_get_section_desc('tail_lines')[0], "tail_lines", fallback=100)
 filter_text = _CONFIG.get(_get_section_desc('filter_text')[0], "filter_text", fallback="")
+watch_backend = _CONFIG.get(_get_section_desc('watch_backend')[0], "watch_backend", fallback="auto")
+poll_max_ms   = _CONFIG.getint(_get_section_desc('poll_max_ms')[0], "poll_max_ms", fallback=2000)
+batch_max_bytes = _CONFIG.getint(_get_section_desc('batch_max_bytes')[0], "batch_max_bytes", fallback=65536)
+batch_wait_ms   = _CONFIG.getint(_get_section_desc('batch_wait_ms')[0], "batch_wait_ms", fallback=20)
+ring_size       = _CONFIG.getint(_get_section_desc('ring_size')[0], "ring_size", fallback=10000)
+overflow_policy = _CONFIG.get(_get_section_desc('overflow_policy')[0], "overflow_policy", fallback="drop_oldest")
+line_index_interval = _CONFIG.getint(_get_section_desc('line_index_interval')[0], "line_index_interval", fallback=1000)
+index_dir           = _CONFIG.get(_get_section_desc('index_dir')[0], "index_dir", fallback="./index")
+read_chunk_size     = _CONFIG.getint(_get_section_desc('read_chunk_size')[0], "read_chunk_size", fallback=262144)
+decode_errors       = _CONFIG.get(_get_section_desc('decode_errors')[0], "decode_errors", fallback="replace")
+checkpoint_mb       = _CONFIG.getint(_get_section_desc('checkpoint_mb')[0], "checkpoint_mb", fallback=4)
+shared_ring_mb      = _CONFIG.getint(_get_section_desc('shared_ring_mb')[0], "shared_ring_mb", fallback=8)
+merge_window_ms     = _CONFIG.getint(_get_section_desc('merge_window_ms')[0], "merge_window_ms", fallback=500)
+sysinfo_interval    = _CONFIG.getint(_get_section_desc('sysinfo_interval')[0], "sysinfo_interval", fallback=5)
 
 text_files: dict       = _get_textfile_section()
 text_files_configured: bool = True if len(text_files.keys()) > 0 else False
+level_formats: dict    = _get_levels_section()
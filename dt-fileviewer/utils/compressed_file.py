@@ -0,0 +1,193 @@
+import bisect
+import bz2
+import io
+import lzma
+import pathlib
+import threading
+import time
+import zlib
+from typing import BinaryIO, Dict, List, Tuple
+
+from loguru import logger as LOGGER
+from utils import cfg as cfg
+
+
+class CompressedFile():
+    """
+    Random access, by uncompressed offset, to compressed (i.e. rotated) log files.
+
+    gzip: the file is decompressed once, keeping a checkpoint (compressed offset,
+    uncompressed offset, copy of the decompressor state) every cfg.checkpoint_mb of
+    output.  A seek resumes decompression at the nearest checkpoint before the
+    target, so reaching any offset costs at most checkpoint_mb of decompression.
+
+    bz2/xz: the decompressor state can't be copied, these files are read through
+    the standard library file objects (a backward seek decompresses from the start).
+    """
+    GZIP_SUFFIX = '.gz'
+    SUFFIXES = ['.gz', '.bz2', '.xz']
+    _GZIP_WBITS = zlib.MAX_WBITS | 16
+    _READ_SIZE = 64 * 1024
+
+    _files: Dict[str, 'CompressedFile'] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, filename, signature: tuple):
+        self.filename = pathlib.Path(filename)
+        self.signature = signature
+        self.size: int = 0
+        self._checkpoints: List[Tuple[int, int, object]] = []   # (compressed pos, uncompressed pos, decompressor)
+        self._checkpoint_pos: List[int] = []
+        start = time.monotonic()
+        if self.is_gzip:
+            self._build_gzip()
+        else:
+            with self.open_file() as h_file:
+                self.size = h_file.seek(0, io.SEEK_END)
+        LOGGER.info(f'- [{self.filename.name}] {self.size} bytes uncompressed, {len(self._checkpoints)} checkpoints in {time.monotonic() - start:.2f}s')
+
+    @staticmethod
+    def is_compressed(filename) -> bool:
+        return pathlib.Path(filename).suffix.lower() in CompressedFile.SUFFIXES
+
+    @staticmethod
+    def get(filename) -> 'CompressedFile':
+        """Cached per file, (re)built when the file changed.  May take a while for large files."""
+        filename = pathlib.Path(filename)
+        stat = filename.stat()
+        signature = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with CompressedFile._lock:
+            cfile = CompressedFile._files.get(str(filename), None)
+            if cfile is None or cfile.signature != signature:
+                cfile = CompressedFile(filename, signature)
+                CompressedFile._files[str(filename)] = cfile
+        return cfile
+
+    @staticmethod
+    def size_of(filename) -> int:
+        """(Uncompressed) size of a plain or compressed file."""
+        if CompressedFile.is_compressed(filename):
+            return CompressedFile.get(filename).size
+        return pathlib.Path(filename).stat().st_size
+
+    @staticmethod
+    def open(filename, buffering: int = -1) -> BinaryIO:
+        """Open a plain or compressed file for (binary) reading, offsets are uncompressed offsets."""
+        if CompressedFile.is_compressed(filename):
+            return CompressedFile.get(filename).open_file(buffering)
+        return open(filename, 'rb', buffering=buffering)
+
+    @property
+    def is_gzip(self) -> bool:
+        return self.filename.suffix.lower() == self.GZIP_SUFFIX
+
+    def open_file(self, buffering: int = -1) -> BinaryIO:
+        if self.is_gzip:
+            raw = _GzipCheckpointReader(self)
+            return raw if buffering == 0 else io.BufferedReader(raw, self._READ_SIZE)
+        if self.filename.suffix.lower() == '.bz2':
+            return bz2.open(self.filename, 'rb')
+        return lzma.open(self.filename, 'rb')
+
+    def checkpoint_for(self, offset: int) -> Tuple[int, int, object]:
+        """Last checkpoint at or before (uncompressed) offset."""
+        return self._checkpoints[max(bisect.bisect_right(self._checkpoint_pos, offset) - 1, 0)]
+
+    @staticmethod
+    def inflate(decomp, data: bytes) -> Tuple[object, bytes]:
+        """Decompress data, continuing with a new decompressor for each following gzip member."""
+        out: List[bytes] = []
+        while len(data) > 0:
+            if decomp.eof:
+                decomp = zlib.decompressobj(CompressedFile._GZIP_WBITS)
+            out.append(decomp.decompress(data))
+            data = decomp.unused_data if decomp.eof else b''
+        return decomp, b''.join(out)
+
+    def _build_gzip(self):
+        interval = max(cfg.checkpoint_mb, 1) * 1024 * 1024
+        decomp = zlib.decompressobj(self._GZIP_WBITS)
+        self._checkpoints = [(0, 0, decomp.copy())]
+        next_checkpoint = interval
+        upos = 0
+        with open(self.filename, 'rb') as h_file:
+            while True:
+                data = h_file.read(self._READ_SIZE)
+                if len(data) == 0:
+                    break
+                decomp, out = self.inflate(decomp, data)
+                upos += len(out)
+                if upos >= next_checkpoint:
+                    # All input up to here is consumed, decompressor state matches upos
+                    self._checkpoints.append((h_file.tell(), upos, decomp.copy()))
+                    next_checkpoint = upos + interval
+        self._checkpoint_pos = [checkpoint[1] for checkpoint in self._checkpoints]
+        self.size = upos
+
+
+class _GzipCheckpointReader(io.RawIOBase):
+    """Seekable raw reader over a gzip file, seeks restart at the nearest checkpoint."""
+    def __init__(self, cfile: CompressedFile):
+        self._cfile = cfile
+        self._h_file = open(cfile.filename, 'rb')
+        self._restart(cfile.checkpoint_for(0))
+
+    def _restart(self, checkpoint: Tuple[int, int, object]):
+        cpos, upos, decomp = checkpoint
+        self._h_file.seek(cpos)
+        self._decomp = decomp.copy()
+        self._pos = upos        # uncompressed offset of _buffer[_buf_pos]
+        self._buffer = b''
+        self._buf_pos = 0
+
+    def _fill(self) -> bool:
+        data = self._h_file.read(CompressedFile._READ_SIZE)
+        if len(data) == 0:
+            return False
+        self._decomp, self._buffer = CompressedFile.inflate(self._decomp, data)
+        self._buf_pos = 0
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def fileno(self) -> int:
+        return self._h_file.fileno()
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._cfile.size
+        offset = max(offset, 0)
+        checkpoint = self._cfile.checkpoint_for(offset)
+        if not checkpoint[1] <= self._pos <= offset:
+            self._restart(checkpoint)
+        while self._pos < offset:
+            if self._buf_pos >= len(self._buffer) and not self._fill():
+                break
+            skip = min(offset - self._pos, len(self._buffer) - self._buf_pos)
+            self._buf_pos += skip
+            self._pos += skip
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        while self._buf_pos >= len(self._buffer):
+            if not self._fill():
+                return 0
+        size = min(len(buffer), len(self._buffer) - self._buf_pos)
+        buffer[:size] = self._buffer[self._buf_pos:self._buf_pos + size]
+        self._buf_pos += size
+        self._pos += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._h_file.close()
+        super().close()
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import pathlib
+import zlib
+from email.utils import formatdate
+from urllib.parse import quote
+from typing import AsyncIterator, BinaryIO, Callable, Optional, Tuple
+
+from fastapi.responses import Response
+from loguru import logger as LOGGER
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
+from utils import cfg as cfg
+from utils.compressed_file import CompressedFile
+from utils.line_filter import LineFilter
+
+
+class SnapshotFileResponse(Response):
+    """
+    The file as it was when the request arrived (stat_result): a log growing during the
+    download is sent up to the size announced in Content-Length, not to its current end.
+    A single range (Range: bytes=...) resumes a download, If-Range is honoured.
+    """
+    chunk_size = 1024 * 1024
+
+    def __init__(self, path, stat_result: os.stat_result, filename: str, media_type: str, headers: dict = None):
+        super().__init__(status_code=200, headers=headers, media_type=media_type)
+        self.path = path
+        self.stat_result = stat_result
+        self.headers['content-disposition'] = FileExport.content_disposition(filename)
+        self.headers['accept-ranges'] = 'bytes'
+        self.headers['last-modified'] = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers['etag'] = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+    def _range(self, request_headers: Headers) -> Optional[Tuple[int, int]]:
+        """[start, end) of a single range, None: the whole file, ValueError if not satisfiable."""
+        value = request_headers.get('range', '').strip()
+        if_range = request_headers.get('if-range')
+        if not value.startswith('bytes=') or ',' in value:
+            return None     # no, or multiple ranges: the whole file
+        if if_range is not None and if_range not in (self.headers['etag'], self.headers['last-modified']):
+            return None     # file changed since the first part
+        size = self.stat_result.st_size
+        first, _, last = value[len('bytes='):].partition('-')
+        try:
+            if first.strip() == '':
+                start, end = size - int(last), size        # suffix: the last n bytes
+            else:
+                start, end = int(first), size if last.strip() == '' else min(int(last) + 1, size)
+        except ValueError:
+            return None     # malformed: ignored
+        if not 0 <= start < end:
+            raise ValueError(f'Range [{value}] not satisfiable, size {size}')
+        return start, end
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        size = self.stat_result.st_size
+        start, end = 0, size
+        try:
+            byte_range = self._range(Headers(scope=scope))
+        except ValueError as ex:
+            LOGGER.warning(f'- {ex}')
+            self.status_code = 416
+            self.headers['content-range'] = f'bytes */{size}'
+            byte_range = None
+            end = 0
+        if byte_range is not None:
+            start, end = byte_range
+            self.status_code = 206
+            self.headers['content-range'] = f'bytes {start}-{end - 1}/{size}'
+        self.headers['content-length'] = str(end - start)
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        remaining = 0 if scope['method'].upper() == 'HEAD' else end - start
+        more_body = True
+        if remaining > 0:
+            with open(self.path, 'rb', buffering=0) as h_file:
+                h_file.seek(start)
+                while remaining > 0:
+                    chunk = await asyncio.to_thread(h_file.read, min(self.chunk_size, remaining))
+                    if len(chunk) == 0:
+                        break       # truncated during the download
+                    remaining -= len(chunk)
+                    more_body = remaining > 0
+                    await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        if more_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class FileExport():
+    """
+    Bytes [start, end) of a file (compressed files decompressed), optionally only the lines
+    matching a LineFilter and/or gzip compressed, streamed a chunk at a time.
+
+    Chunks are read, filtered and compressed off the event loop, memory use is bounded by
+    the chunk size (plus the longest line), not the size of the export.
+    """
+    CHUNK_SIZE = 1024 * 1024
+    GZIP_LEVEL = 6
+
+    def __init__(self, filename, start: int, end: int, line_filter: LineFilter = None, gzip: bool = False):
+        self.filename = pathlib.Path(filename)
+        self.start = start
+        self.end = end
+        self.line_filter = line_filter
+        self._compressor = zlib.compressobj(self.GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16) if gzip else None
+        self._carry = b''       # partial last line of the previous chunk (filtered export)
+
+    def _next_chunk(self, h_file: BinaryIO, pos: int) -> bytes:
+        data = h_file.read(min(self.CHUNK_SIZE, self.end - pos))
+        if self.line_filter is not None:
+            last = pos + len(data) >= self.end or len(data) == 0
+            data = self._filter(data, last)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        return data
+
+    def _filter(self, data: bytes, last: bool) -> bytes:
+        if self._carry:
+            data = self._carry + data
+        end = len(data) if last else data.rfind(b'\n') + 1
+        self._carry = data[end:]
+        matches = self.line_filter.matches
+        errors = cfg.decode_errors
+        lines = data[:end].split(b'\n')
+        tail = lines.pop()      # empty unless the file doesn't end with a new line
+        selected = [line + b'\n' for line in lines if matches(line.decode('utf-8', errors=errors))]
+        if tail and matches(tail.decode('utf-8', errors=errors)):
+            selected.append(tail)
+        return b''.join(selected)
+
+    async def stream(self, is_cancelled: Callable = None) -> AsyncIterator[bytes]:
+        LOGGER.info(f'- export [{self.filename.name}] {self.start}-{self.end}  filter: {self.line_filter}  gzip: {self._compressor is not None}')
+        pos = self.start
+        with CompressedFile.open(self.filename) as h_file:
+            await asyncio.to_thread(h_file.seek, pos)
+            while pos < self.end:
+                if is_cancelled is not None and await is_cancelled():
+                    LOGGER.warning(f'- export [{self.filename.name}] cancelled at {pos}.')
+                    return
+                before = h_file.tell()
+                data = await asyncio.to_thread(self._next_chunk, h_file, pos)
+                read = h_file.tell() - before
+                pos += read
+                if len(data) > 0:
+                    yield data
+                if read == 0:
+                    break       # truncated during the export
+        if self._compressor is not None:
+            yield self._compressor.flush()
+
+    @staticmethod
+    def export_name(filename, gzip: bool = False) -> str:
+        """Name of the exported file, without the compression suffix of the source."""
+        filename = pathlib.Path(filename)
+        name = filename.stem if CompressedFile.is_compressed(filename) else filename.name
+        return f'{name}.gz' if gzip else name
+
+    @staticmethod
+    def content_disposition(name: str) -> str:
+        """Attachment header of name (as FileResponse)."""
+        quoted = quote(name)
+        if quoted != name:
+            return f"attachment; filename*=utf-8''{quoted}"
+        return f'attachment; filename="{name}"'
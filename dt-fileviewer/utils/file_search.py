@@ -0,0 +1,121 @@
+import asyncio
+import json
+import mmap
+import os
+import pathlib
+import re
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from loguru import logger as LOGGER
+from utils.compressed_file import CompressedFile
+
+
+class FileSearch():
+    """
+    Search a whole file through a memory map, one chunk at a time (compressed files
+    are decompressed a chunk at a time, starting at the nearest seek checkpoint).
+
+    Matches are returned with byte offset and (0-based) line number of the matching
+    line.  Memory use is bounded by the chunk size, not the file size.  The search can
+    be resumed from a continuation cursor ('offset:line') and is cancelled between
+    chunks if the caller goes away.
+    """
+    CHUNK_SIZE = 4 * 1024 * 1024
+    MAX_LINE_LEN = 4096
+
+    def __init__(self, filename, terms: List[str], regex: bool = False, ignore_case: bool = False):
+        self.filename = pathlib.Path(filename)
+        terms = [term for term in terms if len(term) > 0]
+        if len(terms) == 0:
+            raise ValueError('At least one search term is required.')
+        pattern = b'|'.join(b'(?:' + term.encode('utf-8') + b')' if regex else re.escape(term.encode('utf-8')) for term in terms)
+        self._pattern = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+
+    @staticmethod
+    def parse_cursor(cursor: str) -> Tuple[int, int]:
+        """'offset:line' -> (offset, line), raises ValueError if invalid."""
+        if not cursor:
+            return 0, 0
+        offset, line_no = (int(part) for part in cursor.split(':'))
+        if offset < 0 or line_no < 0:
+            raise ValueError(f'Invalid cursor [{cursor}]')
+        return offset, line_no
+
+    def _scan_chunk(self, start: int, line_no: int, end_pos: int, limit: int) -> Tuple[List[dict], int, int]:
+        """
+        Search [start, chunk end) where chunk end is extended to the end of a line.
+
+        Returns:
+            Tuple[List[dict], int, int]: matches, next offset, line number at next offset
+        """
+        if CompressedFile.is_compressed(self.filename):
+            with CompressedFile.open(self.filename) as h_file:
+                # No memory map, the (decompressed) chunk plus the rest of its last line
+                h_file.seek(start)
+                data = h_file.read(min(self.CHUNK_SIZE, end_pos - start))
+                if start + len(data) < end_pos and not data.endswith(b'\n'):
+                    data += h_file.readline()[:end_pos - start - len(data)]
+            matches, pos, line_no = self._scan_buffer(data, 0, line_no, len(data), limit)
+            for match in matches:
+                match['offset'] += start
+            return matches, start + pos, line_no
+
+        with open(self.filename, 'rb') as h_file:
+            if os.fstat(h_file.fileno()).st_size == 0:
+                return [], end_pos, line_no     # truncated since end_pos, an empty file can't be mapped
+            with mmap.mmap(h_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end_pos = min(end_pos, len(mm))
+                chunk_end = min(start + self.CHUNK_SIZE, end_pos)
+                if chunk_end < end_pos:
+                    nl = mm.find(b'\n', chunk_end, end_pos)
+                    chunk_end = end_pos if nl < 0 else nl + 1
+                return self._scan_buffer(mm, start, line_no, chunk_end, limit)
+
+    def _scan_buffer(self, buffer, start: int, line_no: int, chunk_end: int, limit: int) -> Tuple[List[dict], int, int]:
+        matches: List[dict] = []
+        pos = start            # line_no is the line number at pos
+        search_pos = start
+        while len(matches) < limit:
+            found = self._pattern.search(buffer, search_pos, chunk_end)
+            if found is None:
+                break
+            line_start = buffer.rfind(b'\n', pos, found.start()) + 1 or pos
+            line_no += buffer[pos:line_start].count(b'\n')
+            line_end = buffer.find(b'\n', found.end(), chunk_end)
+            line_end = chunk_end if line_end < 0 else line_end
+            text = buffer[line_start:min(line_end, line_start + self.MAX_LINE_LEN)]
+            matches.append({'offset': line_start, 'line': line_no, 'text': text.decode('utf-8', errors='replace').rstrip('\r')})
+            # Continue with the next line, after the last one of a match across lines (regex)
+            pos = search_pos = min(line_end + 1, chunk_end)
+            line_no += buffer[line_start:line_end].count(b'\n') + (1 if line_end < chunk_end else 0)
+
+        if len(matches) < limit:
+            line_no += buffer[pos:chunk_end].count(b'\n')
+            pos = chunk_end
+
+        return matches, pos, line_no
+
+    async def search(self, cursor: str = None, limit: int = 1000,
+                     is_cancelled: Callable = None) -> AsyncIterator[str]:
+        """
+        Yield matches as NDJSON lines, last line is a summary containing next_cursor
+        (None when the end of the file was reached).
+        """
+        offset, line_no = self.parse_cursor(cursor)
+        end_pos = await asyncio.to_thread(CompressedFile.size_of, self.filename)
+        found = 0
+        cancelled = False
+        LOGGER.info(f'- search [{self.filename.name}] {self._pattern.pattern}  from: {offset}  limit: {limit}')
+        while offset < end_pos and found < limit:
+            if is_cancelled is not None and await is_cancelled():
+                LOGGER.warning(f'- search [{self.filename.name}] cancelled at {offset}.')
+                cancelled = True
+                break
+            matches, offset, line_no = await asyncio.to_thread(self._scan_chunk, offset, line_no, end_pos, limit - found)
+            found += len(matches)
+            if len(matches) > 0:
+                yield ''.join(f'{json.dumps(match)}\n' for match in matches)
+
+        next_cursor: Optional[str] = f'{offset}:{line_no}' if offset < end_pos else None
+        yield json.dumps({'done': next_cursor is None, 'cancelled': cancelled, 'matches': found,
+                          'scanned_to': offset, 'next_cursor': next_cursor}) + '\n'
@@ -0,0 +1,214 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import pathlib
+import struct
+import sys
+
+from loguru import logger as LOGGER
+from utils import cfg as cfg
+
+
+class FileWatcher():
+    """
+    Wake a file reader when the watched file (may have) changed.
+
+    Use FileWatcher.create() to get the backend selected by cfg.watch_backend
+    (auto, inotify or poll).  auto uses inotify when available, else polling.
+    """
+    BACKEND_AUTO = 'auto'
+    BACKEND_INOTIFY = 'inotify'
+    BACKEND_POLL = 'poll'
+
+    def __init__(self, filename):
+        self.filename = pathlib.Path(filename)
+        self._event = asyncio.Event()
+        self._closed = False
+
+    @staticmethod
+    def create(filename, backend: str = None) -> 'FileWatcher':
+        backend = (backend or cfg.watch_backend).lower()
+        if backend not in [FileWatcher.BACKEND_AUTO, FileWatcher.BACKEND_INOTIFY, FileWatcher.BACKEND_POLL]:
+            LOGGER.error(f'Invalid watch_backend [{backend}], using {FileWatcher.BACKEND_AUTO}.')
+            backend = FileWatcher.BACKEND_AUTO
+
+        if backend != FileWatcher.BACKEND_POLL:
+            try:
+                return InotifyWatcher(filename)
+            except OSError as ex:
+                log_level = 'DEBUG' if backend == FileWatcher.BACKEND_AUTO else 'WARNING'
+                LOGGER.log(log_level, f'- inotify unavailable ({ex}), fallback to polling.')
+
+        return PollingWatcher(filename)
+
+    @property
+    def backend(self) -> str:
+        raise NotImplementedError()
+
+    async def wait(self):
+        """Wait until the file changes (or wake() is called)."""
+        await self._event.wait()
+        self._event.clear()
+
+    def wake(self):
+        """Release any waiter (i.e. on stop request)."""
+        self._event.set()
+
+    def rewatch(self):
+        """File was replaced (rotated), watch the new file at the same location."""
+        pass
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+
+class InotifyWatcher(FileWatcher):
+    """Linux inotify, the inotify fd is serviced by the event loop (no polling)."""
+    IN_MODIFY      = 0x00000002
+    IN_ATTRIB      = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF   = 0x00000800
+    IN_CLOEXEC     = 0o2000000
+    IN_NONBLOCK    = 0o4000
+
+    _WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF
+    _DIR_WATCH_MASK = IN_CREATE | IN_MOVED_TO
+    _libc = None
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        libc = InotifyWatcher._get_libc()
+        self._wd = -1
+        self._dir_wd = -1
+        self._fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        try:
+            self._wd = self._add_watch(self.filename, self._WATCH_MASK)
+            # Parent directory, to detect the file being (re)created after rotation
+            self._dir_wd = self._add_watch(self.filename.parent, self._DIR_WATCH_MASK)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._fd, self._on_readable)
+        LOGGER.debug(f'- inotify watch [{self.filename.name}] fd: {self._fd}')
+
+    @staticmethod
+    def _get_libc():
+        if InotifyWatcher._libc is None:
+            if not sys.platform.startswith('linux'):
+                raise OSError(f'inotify not supported on {sys.platform}')
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            if not hasattr(libc, 'inotify_init1'):
+                raise OSError('inotify not supported by libc')
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            InotifyWatcher._libc = libc
+
+        return InotifyWatcher._libc
+
+    def _add_watch(self, path: pathlib.Path, mask: int) -> int:
+        wd = InotifyWatcher._libc.inotify_add_watch(self._fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return wd
+
+    @property
+    def backend(self) -> str:
+        return FileWatcher.BACKEND_INOTIFY
+
+    def rewatch(self):
+        # inotify watches inodes, the old watch is dropped by the kernel when the
+        # inode is deleted (or stays on the rotated file, which we no longer read).
+        old_wd = self._wd
+        try:
+            self._wd = self._add_watch(self.filename, self._WATCH_MASK)
+            if old_wd != self._wd:
+                InotifyWatcher._libc.inotify_rm_watch(self._fd, old_wd)
+            LOGGER.debug(f'- inotify re-watch [{self.filename.name}]')
+        except OSError as ex:
+            LOGGER.warning(f'- inotify re-watch [{self.filename.name}] failed: {ex}')
+
+    def _on_readable(self):
+        # Drain all queued events, wake if any of them concern our file.
+        wake = False
+        try:
+            while True:
+                data = os.read(self._fd, 4096)
+                if len(data) == 0:
+                    break
+                wake = self._on_events(data) or wake
+        except BlockingIOError:
+            pass
+        except OSError as ex:
+            LOGGER.error(f'inotify read error [{self.filename.name}]: {ex}')
+            wake = True
+        if wake:
+            self._event.set()
+
+    def _on_events(self, data: bytes) -> bool:
+        relevant = False
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, name_len = struct.unpack_from('iIII', data, pos)
+            if wd != self._dir_wd:
+                relevant = True
+            elif data[pos+16:pos+16+name_len].rstrip(b'\0') == os.fsencode(self.filename.name):
+                LOGGER.debug(f'- inotify [{self.filename.name}] created in directory, mask: {mask:#x}')
+                relevant = True
+            pos += 16 + name_len
+        return relevant
+
+    def close(self):
+        if not self._closed:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+        super().close()
+
+
+class PollingWatcher(FileWatcher):
+    """stat() polling, interval backs off (doubles) while the file is idle."""
+    _MIN_INTERVAL = 0.05
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self._max_interval = max(cfg.poll_max_ms / 1000, self._MIN_INTERVAL)
+        self._interval = self._MIN_INTERVAL
+        self._signature = self._stat_signature()
+        LOGGER.debug(f'- polling watch [{self.filename.name}] max interval: {self._max_interval}s')
+
+    @property
+    def backend(self) -> str:
+        return FileWatcher.BACKEND_POLL
+
+    def _stat_signature(self) -> tuple:
+        try:
+            stat = self.filename.stat()
+            return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            return None
+
+    async def wait(self):
+        while not self._event.is_set():
+            try:
+                await asyncio.wait_for(self._event.wait(), self._interval)
+            except asyncio.TimeoutError:
+                pass
+            signature = self._stat_signature()
+            if signature != self._signature:
+                self._signature = signature
+                self._interval = self._MIN_INTERVAL
+                break
+            self._interval = min(self._interval * 2, self._max_interval)
+
+        self._event.clear()
@@ -1,50 +1,57 @@
-from dateutil.parser import parse as dt_parser
-from dt_tools.os.os_helper import OSHelper
+from typing import Tuple
+
 from loguru import logger as LOGGER
 from utils import cfg as cfg
+from utils.level_classifier import LevelClassifier
+from utils.system_sampler import SystemSampler
+from utils.timestamp_detector import TimestampDetector
 
 
 class Helper:
     _UNKNOWN_KEY = 'not_selected'
     _UNKNOWN = 'Select a file to view'
+    # Line level code -> css class (same mapping in static/js/viewfile.js)
+    LEVEL_CLASSES = {'E': 'text-danger', 'W': 'text-warning', 'S': 'text-success', 'D': 'text-primary', 'I': 'text-white'}
 
     @staticmethod
     def reload_configuration():
         LOGGER.info('- reload cfg.py')
         import importlib
         importlib.reload(cfg)
+        LevelClassifier.reset()
+
+    @staticmethod
+    def filter_line(line_in: str, textfile_id: str = None) -> str:
+        LOGGER.trace('filter_line("{}")', line_in)
+        level, line = Helper.compact_line(line_in, textfile_id)
+        return Helper.html_line(level, line)
+
+    @staticmethod
+    def html_line(level: str, line: str) -> str:
+        """Markup for a line of the given level code."""
+        line = line.replace(' ','&nbsp;')
+        return f'<span class="{Helper.LEVEL_CLASSES[level]}">{line}</span></br>'
 
     @staticmethod
-    def filter_line(line_in: str) -> str:
-        LOGGER.trace(f'filter_line("{line_in}")')
-        token = line_in.split()
-        if len(token) > 0 and Helper.is_date(token[0]):
+    def compact_line(line_in: str, textfile_id: str = None) -> Tuple[str, str]:
+        """Return (level code, line without date), the client does the styling."""
+        # Level of the whole line, the format's level field position includes the date
+        level = Helper.line_level(line_in, textfile_id)
+        token = line_in.split(maxsplit=1)
+        if len(token) > 0 and TimestampDetector.for_file(textfile_id).is_date(token[0]):
             # Remove date from input line
             line_in = line_in.removeprefix(f'{token[0]} ')
 
-        line = line_in.replace(' ','&nbsp;').replace('\r','').replace('\n','')
-        color_class = "text-white"
-        if line.__contains__("ERROR") or line.__contains__("CRITICAL"):
-            color_class = "text-danger"
-        elif line.__contains__("WARNING"):
-            color_class = "text-warning"
-        elif line.__contains__("SUCCESS"):
-            color_class = "text-success"
-        elif line.__contains__("DEBUG"):
-            color_class = "text-primary"
+        return level, line_in.rstrip('\r\n')
 
-        line_out = f'<span class="{color_class}">{line}</span></br>'
-        return line_out
+    @staticmethod
+    def line_level(line: str, textfile_id: str = None) -> str:
+        return LevelClassifier.for_file(textfile_id).level(line)
 
     @staticmethod
     def is_date(in_token: str, fuzzy=False) -> bool:
-        LOGGER.trace(f'is_date("{in_token}", {fuzzy})')
-        try: 
-            dt_parser(in_token, fuzzy=fuzzy)
-            return True
-
-        except ValueError:
-            return False
+        LOGGER.trace('is_date("{}", {})', in_token, fuzzy)
+        return TimestampDetector.parse_is_date(in_token, fuzzy=fuzzy)
             
     @staticmethod
     def get_app_info(for_dialog: str = '') -> dict:
@@ -52,34 +59,15 @@ class Helper:
 
         app_info:dict = {}
 
-        include_cpu  = True if for_dialog in ['system'] else False
-        include_mem  = True if for_dialog in ['system'] else False
-        include_disk = True if for_dialog in ['system'] else False
-        sys_info = OSHelper.sysinfo(include_cpu=include_cpu, 
-                                    include_memory=include_mem,
-                                    include_disk=include_disk)
+        # Background sample (read-only), system info is not collected per request
+        sys_info = SystemSampler.snapshot()
+        app_info = dict(sys_info['system'])
+        if for_dialog in ['system']:
+            # Not in the partial snapshot before the first sample, sent by /ws/system
+            app_info['cpu'] = sys_info.get('cpu', {})
+            app_info['memory'] = sys_info['memory']
+            app_info['disk'] = sys_info.get('disk', {})
 
-        app_info = sys_info['system'].copy()
-        if include_cpu:
-            app_info['cpu']= sys_info['cpu']
-        if include_mem:
-            sys_info['memory']['virtual_total'] = OSHelper.bytes_to_printformat(sys_info['memory']['virtual_total'])
-            sys_info['memory']['virtual_used']  = OSHelper.bytes_to_printformat(sys_info['memory']['virtual_used'])
-            sys_info['memory']['virtual_free']  = OSHelper.bytes_to_printformat(sys_info['memory']['virtual_free'])
-            sys_info['memory']['swap_total'] = OSHelper.bytes_to_printformat(sys_info['memory']['swap_total'])
-            sys_info['memory']['swap_used']  = OSHelper.bytes_to_printformat(sys_info['memory']['swap_used'])
-            sys_info['memory']['swap_free']  = OSHelper.bytes_to_printformat(sys_info['memory']['swap_free'])
-            app_info['memory']= sys_info['memory']
-        if include_disk:
-            for idx in range(len(sys_info['disk']['partitions'])):
-                d_entry = sys_info['disk']['partitions'][idx]
-                if len(d_entry['fstype']) > 0:
-                    d_entry['total'] = OSHelper.bytes_to_printformat(d_entry['total'])
-                    d_entry['used'] = OSHelper.bytes_to_printformat(d_entry['used'])
-                    d_entry['free'] = OSHelper.bytes_to_printformat(d_entry['free'])
-                # LOGGER.warning(sys_info['disk']['partitions'][idx])
-            app_info['disk']= sys_info['disk']
-        
         if Helper._UNKNOWN not in cfg.text_files.values():
             textfiles = {Helper._UNKNOWN_KEY: Helper._UNKNOWN}
             textfiles.update(cfg.text_files)
@@ -93,6 +81,7 @@ class Helper:
         if for_dialog in ['viewfile']:
             app_info['_selected_textfile_nm'] = list(textfiles.values())[0]
             app_info['start_pos'] = cfg.start_pos
+            app_info['tail_lines'] = cfg.tail_lines
             app_info['filter_text'] = cfg.filter_text
 
         LOGGER.debug(f'app_info:\n{app_info}')
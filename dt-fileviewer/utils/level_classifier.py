@@ -0,0 +1,142 @@
+import re
+from typing import Dict, List, Optional
+
+from loguru import logger as LOGGER
+from utils import cfg as cfg
+
+
+class LevelClassifier():
+    """
+    Log level (code) of a line, per file ID.
+
+    The level field is located with a single anchored regex for the file format, so a
+    level word in the message (i.e. 'DEBUG' in an INFO line) is not taken as the level.
+    Formats are set per file in the [LEVELS] config section (default: auto):
+
+    - loguru:  2024-05-01 10:42:00.123 | ERROR    | module:func:12 - message
+    - bracket: 2024-05-01 10:42:00 [ERROR] message
+    - python:  ERROR:logger_name:message
+    - json:    {"time": "...", "level": "error", ...}
+    - keyword: 1st level word (upper case) anywhere in the line
+    - auto:    the first of loguru, bracket, json, python matching one of the first lines,
+               keyword until then (or if none matches)
+    - any other value is a regex with a (?P<level>...) group, matched at the line start
+
+    Codes: E (error, critical), W (warning), S (success), D (debug, trace), I (info or no level).
+    """
+    _LEARN_LINES = 25
+    _FIELD = '(?P<level>[A-Za-z]+)'
+    # {level}: the level field, a template is matched at the start of a line
+    _FORMATS: Dict[str, str] = {
+        'loguru':  r'[^|\n]{0,64}\|[ \t]*{level}[ \t]*\|',
+        'bracket': r'[^\[\n]{0,80}\[{level}\]',
+        'json':    r'[^\n]*?"(?:level|levelname|severity|lvl)"[ \t]*:[ \t]*"{level}"',
+        'python':  r'{level}:[^:\n]*:',
+        'keyword': r'[^\n]*?\b{level}\b',
+    }
+    _AUTO_ORDER = ['loguru', 'bracket', 'json', 'python']
+    _KEYWORDS = '(?P<level>CRITICAL|ERROR|WARNING|WARN|SUCCESS|INFO|DEBUG|TRACE|FATAL)'
+
+    CODES: Dict[str, str] = {
+        'CRITICAL': 'E', 'CRIT': 'E', 'FATAL': 'E', 'ALERT': 'E', 'EMERG': 'E', 'ERROR': 'E', 'ERR': 'E',
+        'WARNING': 'W', 'WARN': 'W',
+        'SUCCESS': 'S',
+        'DEBUG': 'D', 'TRACE': 'D',
+        'INFO': 'I', 'NOTICE': 'I',
+    }
+
+    _classifiers: Dict[str, 'LevelClassifier'] = {}
+
+    def __init__(self, textfile_id: str = '', level_format: str = 'auto'):
+        self.textfile_id = textfile_id
+        self.format: str = 'auto'
+        self.template: str = self._FORMATS['keyword']
+        self._learning = False
+        self._lines_seen: int = 0
+        if level_format in self._FORMATS:
+            self.format = level_format
+            self.template = self._FORMATS[level_format]
+        elif level_format != 'auto':
+            try:
+                if 'level' not in re.compile(level_format).groupindex:
+                    raise ValueError('no (?P<level>...) group')
+                self.format = 'regex'
+                self.template = level_format
+            except (re.error, ValueError) as ex:
+                LOGGER.error(f'- [{textfile_id}] invalid level format [{level_format}]: {ex}, using auto.')
+        self._learning = self.format == 'auto'
+        self._match = self._compile(self.template).match
+
+    def _compile(self, template: str) -> re.Pattern:
+        if self.format == 'regex':
+            return re.compile(template)
+        field = self._KEYWORDS if template == self._FORMATS['keyword'] else self._FIELD
+        return re.compile(template.replace('{level}', field))
+
+    @staticmethod
+    def for_file(textfile_id: str = None) -> 'LevelClassifier':
+        key = textfile_id or ''
+        classifier = LevelClassifier._classifiers.get(key, None)
+        if classifier is None:
+            classifier = LevelClassifier(key, cfg.level_formats.get(key, 'auto'))
+            LevelClassifier._classifiers[key] = classifier
+        return classifier
+
+    @staticmethod
+    def reset(textfile_id: str = None):
+        """Forget (learned) formats, all files if textfile_id is None, i.e. configuration changed."""
+        if textfile_id is None:
+            LevelClassifier._classifiers.clear()
+        else:
+            LevelClassifier._classifiers.pop(textfile_id, None)
+
+    def level(self, line: str) -> str:
+        """Level code of the line, I if it has none (i.e. traceback lines)."""
+        if self._learning:
+            self._learn(line)
+        found = self._match(line)
+        if found is None:
+            return 'I'
+        return self.CODES.get(found.group('level').upper(), 'I')
+
+    def level_word(self, line: str) -> Optional[str]:
+        """Level field of the line (upper case), None if it has none."""
+        if self._learning:
+            self._learn(line)
+        found = self._match(line)
+        return None if found is None else found.group('level').upper()
+
+    def _learn(self, line: str):
+        self._lines_seen += 1
+        if self._lines_seen > self._LEARN_LINES:
+            self._learning = False
+            return
+        for name in self._AUTO_ORDER:
+            template = self._FORMATS[name]
+            found = self._compile(template).match(line)
+            if found is not None and found.group('level').upper() in self.CODES:
+                LOGGER.debug(f'- [{self.textfile_id}] level format learned: {name}')
+                self.template = template
+                self._match = found.re.match
+                self._learning = False
+                return
+
+    def learn(self, lines: List[str]):
+        """Learn the (auto) format from the first lines of the file."""
+        for line in lines:
+            if not self._learning:
+                return
+            self._learn(line)
+
+    def index_pattern(self, codes: str) -> re.Pattern:
+        """
+        Multiline bytes regex finding the lines of the given level codes in a buffer, the
+        match starts at the line start.  For a regex format lines of any level are found.
+        """
+        if self.format == 'regex':
+            return re.compile(b'(?m)^' + self.template.encode('utf-8'))
+        words = sorted((word for word, code in self.CODES.items() if code in codes), key=len, reverse=True)
+        field = f'(?P<level>{"|".join(words)})'
+        if self.template != self._FORMATS['keyword']:
+            field = f'(?i:{field})'
+        return re.compile(b'(?m)^' + self.template.replace('{level}', field).encode('utf-8'))
@@ -0,0 +1,132 @@
+import asyncio
+import bisect
+import pathlib
+import re
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger as LOGGER
+from utils.compressed_file import CompressedFile
+from utils.level_classifier import LevelClassifier
+
+
+class LevelIndex():
+    """
+    Byte offsets of the ERROR and WARNING lines of a text file, per level code.
+
+    Built in the background when the file is tailed and extended as it grows (same
+    triggers as the LineIndex), so the next/previous line of a level is a bisect, not a
+    scan.  The file is scanned with the multiline pattern of the file's LevelClassifier:
+    only the matching lines are visited in Python.  Kept in memory only.
+    """
+    LEVELS = 'EW'
+    _READ_CHUNK = 1024 * 1024
+    _LEARN_BYTES = 64 * 1024
+
+    _indexes: Dict[str, 'LevelIndex'] = {}
+
+    def __init__(self, textfile_id: str, filename):
+        self.textfile_id = textfile_id
+        self.filename = pathlib.Path(filename)
+        self._offsets: Dict[str, array] = {code: array('Q') for code in self.LEVELS}
+        self._indexed_pos: int = 0        # bytes scanned (always ends on a line boundary)
+        self._file_id: Tuple[int, int] = None
+        self._lock = asyncio.Lock()
+        self._update_task: asyncio.Task = None
+
+    @staticmethod
+    def get(textfile_id: str, filename) -> 'LevelIndex':
+        index = LevelIndex._indexes.get(textfile_id, None)
+        if index is None or index.filename != pathlib.Path(filename):
+            index = LevelIndex(textfile_id, filename)
+            LevelIndex._indexes[textfile_id] = index
+        return index
+
+    @property
+    def indexed_pos(self) -> int:
+        return self._indexed_pos
+
+    def counts(self) -> Dict[str, int]:
+        """Lines indexed per level code."""
+        return {code: len(offsets) for code, offsets in self._offsets.items()}
+
+    def _reset(self):
+        self._offsets = {code: array('Q') for code in self.LEVELS}
+        self._indexed_pos = 0
+
+    # -- Build / extend ------------------------------------------------------------------
+    def start_update(self):
+        """Extend the index in the background (no-op if an update is running)."""
+        if self._update_task is None or self._update_task.done():
+            self._update_task = asyncio.create_task(self.update(), name=f'level_index_{self.textfile_id}')
+
+    async def update(self):
+        """Scan any bytes added since the last update."""
+        async with self._lock:
+            try:
+                stat = self.filename.stat()
+                size = await asyncio.to_thread(CompressedFile.size_of, self.filename)
+            except FileNotFoundError:
+                return
+            file_id = (stat.st_dev, stat.st_ino)
+            if file_id != self._file_id or size < self._indexed_pos:
+                if self._file_id is not None:
+                    LOGGER.info(f'- [{self.textfile_id}] file replaced or truncated, rebuild level index.')
+                self._reset()
+                self._file_id = file_id
+            if size == self._indexed_pos:
+                return
+
+            start = time.monotonic()
+            classifier = LevelClassifier.for_file(self.textfile_id)
+            if self._indexed_pos == 0:
+                await asyncio.to_thread(self._learn, str(self.filename), classifier)
+            new_offsets, self._indexed_pos = await asyncio.to_thread(
+                self._scan, str(self.filename), self._indexed_pos, classifier.index_pattern(self.LEVELS))
+            for code, offsets in new_offsets.items():
+                self._offsets[code].extend(offsets)
+            LOGGER.debug('- [{}] level index {} in {:.3f}s', self.textfile_id, self.counts(), time.monotonic() - start)
+
+    @staticmethod
+    def _learn(filename: str, classifier: LevelClassifier):
+        with CompressedFile.open(filename) as h_file:
+            data = h_file.read(LevelIndex._LEARN_BYTES)
+        classifier.learn(data.decode('utf-8', errors='replace').splitlines())
+
+    @staticmethod
+    def _scan(filename: str, pos: int, pattern: re.Pattern) -> Tuple[Dict[str, List[int]], int]:
+        """Scan complete lines from pos, return (offsets of new lines per level code, new pos)."""
+        new_offsets: Dict[str, List[int]] = {code: [] for code in LevelIndex.LEVELS}
+        codes = LevelClassifier.CODES
+        with CompressedFile.open(filename) as h_file:
+            h_file.seek(pos)
+            carry = b''
+            while True:
+                chunk = h_file.read(LevelIndex._READ_CHUNK)
+                if len(chunk) == 0:
+                    break
+                data = carry + chunk if carry else chunk
+                end = data.rfind(b'\n') + 1
+                if end == 0:
+                    # No complete line yet (still being written, or very long)
+                    carry = data
+                    continue
+                for found in pattern.finditer(data, 0, end):
+                    offsets = new_offsets.get(codes.get(found.group('level').decode('ascii', 'replace').upper(), 'I'), None)
+                    if offsets is not None:
+                        offsets.append(pos + found.start())
+                pos += end
+                carry = data[end:]
+        return new_offsets, pos
+
+    # -- Lookup --------------------------------------------------------------------------
+    async def find(self, level: str, offset: int, forward: bool = True) -> Optional[int]:
+        """Offset of the first line of the level code after (forward) or before offset, None if there is none."""
+        await self.update()
+        offsets = self._offsets[level]
+        if forward:
+            idx = bisect.bisect_right(offsets, offset)
+            return offsets[idx] if idx < len(offsets) else None
+        idx = bisect.bisect_left(offsets, offset) - 1
+        return offsets[idx] if idx >= 0 else None
@@ -0,0 +1,118 @@
+import re
+from typing import Dict, List, Optional
+
+from loguru import logger as LOGGER
+from starlette.datastructures import QueryParams
+from utils.level_classifier import LevelClassifier
+
+
+class LineFilter():
+    """
+    Server side line filter, compiled once per subscription.
+
+    - include: line must match at least one term (all terms in a single alternation regex)
+    - exclude: line must not match any term
+    - regex: terms are regular expressions (else literal text)
+    - ignore_case: case-insensitive matching
+    - min_level: minimum log level (i.e. WARNING), the level of a line is found by the
+      LevelClassifier of the file (textfile_id).  Lines without a level (i.e. traceback
+      lines) follow the decision of the prior line with a level.
+    """
+    LEVELS = ['TRACE', 'DEBUG', 'INFO', 'SUCCESS', 'WARNING', 'ERROR', 'CRITICAL']
+    _LEVEL_ALIASES = {'WARN': 'WARNING', 'FATAL': 'CRITICAL', 'ERR': 'ERROR', 'CRIT': 'CRITICAL'}
+    # Other level words rank as their LevelClassifier code
+    _CODE_LEVELS = {'E': 'ERROR', 'W': 'WARNING', 'S': 'SUCCESS', 'I': 'INFO', 'D': 'DEBUG'}
+
+    def __init__(self, include: List[str] = None, exclude: List[str] = None, regex: bool = False,
+                 ignore_case: bool = False, min_level: str = None, textfile_id: str = None):
+        self.include = [term for term in (include or []) if len(term) > 0]
+        self.exclude = [term for term in (exclude or []) if len(term) > 0]
+        self.regex = regex
+        self.ignore_case = ignore_case
+        self.min_level = None if not min_level else self._normalize_level(min_level)
+        if min_level and self.min_level is None:
+            raise ValueError(f'Invalid min_level [{min_level}], valid levels: {self.LEVELS}')
+
+        flags = re.IGNORECASE if ignore_case else 0
+        self._include_re = self._compile(self.include, regex, flags)
+        self._exclude_re = self._compile(self.exclude, regex, flags)
+        self._min_rank = 0 if self.min_level is None else self.LEVELS.index(self.min_level)
+        self._last_level_ok = True
+        self.textfile_id = textfile_id
+        self._classifier = None if self.min_level is None else LevelClassifier.for_file(textfile_id)
+        self._ranks: Dict[str, int] = {}
+
+    @staticmethod
+    def from_query(params: QueryParams, textfile_id: str = None) -> Optional['LineFilter']:
+        """Build filter from query parameters, None if no filtering requested."""
+        include = params.getlist('filter_text')
+        exclude = params.getlist('exclude_text')
+        min_level = params.get('min_level', None)
+        if not any(include) and not any(exclude) and not min_level:
+            return None
+        return LineFilter(include=include, exclude=exclude,
+                          regex=params.get('filter_regex', '').lower() in ['1', 'true', 'on'],
+                          ignore_case=params.get('ignore_case', '').lower() in ['1', 'true', 'on'],
+                          min_level=min_level, textfile_id=textfile_id)
+
+    def for_file(self, textfile_id: str) -> 'LineFilter':
+        """Same filter for another file (own level classifier and continuation state)."""
+        return LineFilter(include=self.include, exclude=self.exclude, regex=self.regex, ignore_case=self.ignore_case,
+                          min_level=self.min_level, textfile_id=textfile_id)
+
+    @staticmethod
+    def _compile(terms: List[str], regex: bool, flags: int) -> Optional[re.Pattern]:
+        if len(terms) == 0:
+            return None
+        pattern = '|'.join(f'(?:{term})' if regex else re.escape(term) for term in terms)
+        return re.compile(pattern, flags)
+
+    @staticmethod
+    def _normalize_level(level: str) -> Optional[str]:
+        level = level.upper()
+        level = LineFilter._LEVEL_ALIASES.get(level, level)
+        return level if level in LineFilter.LEVELS else None
+
+    def __repr__(self) -> str:
+        return f'LineFilter(include={self.include}, exclude={self.exclude}, regex={self.regex}, ignore_case={self.ignore_case}, min_level={self.min_level})'
+
+    def _rank(self, word: str) -> int:
+        rank = self._ranks.get(word, None)
+        if rank is None:
+            level = self._normalize_level(word) or self._CODE_LEVELS[LevelClassifier.CODES.get(word, 'I')]
+            rank = self._ranks[word] = self.LEVELS.index(level)
+        return rank
+
+    def _level_ok(self, line: str) -> bool:
+        word = self._classifier.level_word(line)
+        if word is not None:
+            self._last_level_ok = self._rank(word) >= self._min_rank
+        return self._last_level_ok
+
+    def matches(self, line: str) -> bool:
+        if self.min_level is not None and not self._level_ok(line):
+            return False
+        if self._include_re is not None and self._include_re.search(line) is None:
+            return False
+        if self._exclude_re is not None and self._exclude_re.search(line) is not None:
+            return False
+        return True
+
+    def select(self, lines: List[str]) -> List[int]:
+        """Indexes of the (non-blank) lines in the batch that pass the filter."""
+        if self.min_level is not None:
+            # Stateful (continuation lines), must evaluate in order
+            return [idx for idx, line in enumerate(lines) if len(line) > 0 and self.matches(line)]
+
+        selected = range(len(lines))
+        if self._include_re is not None:
+            search = self._include_re.search
+            selected = [idx for idx in selected if search(lines[idx])]
+        else:
+            selected = [idx for idx in selected if len(lines[idx]) > 0]
+        if self._exclude_re is not None:
+            search = self._exclude_re.search
+            selected = [idx for idx in selected if not search(lines[idx])]
+
+        LOGGER.trace('- filter selected {}/{} lines', len(selected), len(lines))
+        return selected
@@ -0,0 +1,301 @@
+import asyncio
+import bisect
+import json
+import mmap
+import os
+import pathlib
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger as LOGGER
+from utils import cfg as cfg
+from utils.compressed_file import CompressedFile
+
+
+class LineIndex():
+    """
+    Sparse line-offset index for a text file.
+
+    Records the byte offset of every cfg.line_index_interval'th line, so any line can
+    be located with one seek plus (at most) interval-1 line skips.  The index is built
+    in the background, extended incrementally as the file grows and persisted as a
+    sidecar file in cfg.index_dir, so a restart does not rebuild it.
+    """
+    _READ_CHUNK = 1024 * 1024
+    _SAVE_INTERVAL_SECS = 60
+
+    _indexes: Dict[str, 'LineIndex'] = {}
+
+    def __init__(self, textfile_id: str, filename):
+        self.textfile_id = textfile_id
+        self.filename = pathlib.Path(filename)
+        self.interval: int = max(cfg.line_index_interval, 1)
+        self._offsets = array('Q', [0])   # offsets[n] = byte offset of line n * interval
+        self._indexed_pos: int = 0        # bytes scanned (always ends on a line boundary)
+        self._line_count: int = 0         # complete lines scanned
+        self._file_id: Tuple[int, int] = None
+        self._lock = asyncio.Lock()
+        self._update_task: asyncio.Task = None
+        self._last_saved: float = 0.0
+        self._load()
+
+    @staticmethod
+    def get(textfile_id: str, filename) -> 'LineIndex':
+        index = LineIndex._indexes.get(textfile_id, None)
+        if index is None or index.filename != pathlib.Path(filename):
+            index = LineIndex(textfile_id, filename)
+            LineIndex._indexes[textfile_id] = index
+        return index
+
+    @property
+    def sidecar(self) -> pathlib.Path:
+        return pathlib.Path(cfg.index_dir) / f'{self.textfile_id}.idx.json'
+
+    @property
+    def line_count(self) -> int:
+        """Number of complete lines indexed so far."""
+        return self._line_count
+
+    @property
+    def indexed_pos(self) -> int:
+        return self._indexed_pos
+
+    def _stat_file_id(self) -> Tuple[int, int]:
+        stat = self.filename.stat()
+        return (stat.st_dev, stat.st_ino)
+
+    def _reset(self):
+        self._offsets = array('Q', [0])
+        self._indexed_pos = 0
+        self._line_count = 0
+
+    # -- Sidecar persistence -------------------------------------------------------------
+    def _load(self):
+        if not self.sidecar.exists():
+            return
+        try:
+            with open(self.sidecar, 'r') as h_file:
+                data = json.load(h_file)
+            file_id = tuple(data['file_id'])
+            size = CompressedFile.size_of(self.filename)
+            if data['filename'] != str(self.filename) or data['interval'] != self.interval or \
+               file_id != self._stat_file_id() or size < data['indexed_pos']:
+                LOGGER.info(f'- [{self.textfile_id}] line index sidecar is stale, rebuild.')
+                return
+            self._offsets = array('Q', data['offsets'])
+            self._indexed_pos = data['indexed_pos']
+            self._line_count = data['line_count']
+            self._file_id = file_id
+            LOGGER.info(f'- [{self.textfile_id}] line index loaded, {self._line_count} lines / {self._indexed_pos} bytes.')
+        except Exception as ex:
+            LOGGER.warning(f'- [{self.textfile_id}] unable to load line index sidecar: {ex}')
+            self._reset()
+
+    def _save(self):
+        data = {
+            'filename': str(self.filename),
+            'file_id': list(self._file_id),
+            'interval': self.interval,
+            'indexed_pos': self._indexed_pos,
+            'line_count': self._line_count,
+            'offsets': self._offsets.tolist(),
+        }
+        try:
+            self.sidecar.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.sidecar.with_suffix('.tmp')
+            with open(tmp_file, 'w') as h_file:
+                json.dump(data, h_file)
+            tmp_file.replace(self.sidecar)
+            self._last_saved = time.monotonic()
+        except Exception as ex:
+            LOGGER.warning(f'- [{self.textfile_id}] unable to save line index sidecar: {ex}')
+
+    # -- Build / extend ------------------------------------------------------------------
+    def start_update(self):
+        """Extend the index in the background (no-op if an update is running)."""
+        if self._update_task is None or self._update_task.done():
+            self._update_task = asyncio.create_task(self.update(), name=f'line_index_{self.textfile_id}')
+
+    async def update(self):
+        """Scan any bytes added since the last update."""
+        async with self._lock:
+            try:
+                file_id = self._stat_file_id()
+                size = await asyncio.to_thread(CompressedFile.size_of, self.filename)
+            except FileNotFoundError:
+                # i.e. file rotated and not yet re-created
+                return
+            if file_id != self._file_id or size < self._indexed_pos:
+                if self._file_id is not None:
+                    LOGGER.info(f'- [{self.textfile_id}] file replaced or truncated, rebuild line index.')
+                self._reset()
+                self._file_id = file_id
+            if size == self._indexed_pos:
+                return
+
+            start = time.monotonic()
+            prior_lines = self._line_count
+            new_offsets, self._indexed_pos, self._line_count = await asyncio.to_thread(
+                self._scan, str(self.filename), self._indexed_pos, self._line_count, self.interval)
+            self._offsets.extend(new_offsets)
+            LOGGER.debug(f'- [{self.textfile_id}] line index +{self._line_count - prior_lines} lines in {time.monotonic() - start:.3f}s')
+            if len(new_offsets) > 0 and (prior_lines == 0 or time.monotonic() - self._last_saved > self._SAVE_INTERVAL_SECS):
+                self._save()
+
+    @staticmethod
+    def _scan(filename: str, pos: int, line_count: int, interval: int) -> Tuple[List[int], int, int]:
+        """Scan complete lines from pos, return (new index offsets, new pos, new line count)."""
+        new_offsets: List[int] = []
+        with CompressedFile.open(filename) as h_file:
+            h_file.seek(pos)
+            base = pos
+            while True:
+                chunk = h_file.read(LineIndex._READ_CHUNK)
+                if len(chunk) == 0:
+                    break
+                cnt = chunk.count(b'\n')
+                if cnt > 0:
+                    to_next = interval - (line_count % interval)
+                    idx = -1
+                    seen = 0
+                    while to_next <= cnt:
+                        # Locate the newline ending the line before the next index point
+                        while seen < to_next:
+                            idx = chunk.find(b'\n', idx + 1)
+                            seen += 1
+                        new_offsets.append(base + idx + 1)
+                        to_next += interval
+                    line_count += cnt
+                    pos = base + chunk.rfind(b'\n') + 1
+                base += len(chunk)
+
+        return new_offsets, pos, line_count
+
+    # -- Lookup --------------------------------------------------------------------------
+    def locate(self, line_no: int) -> Tuple[int, int]:
+        """Return (offset of nearest indexed line <= line_no, lines to skip from there)."""
+        idx = min(max(line_no, 0) // self.interval, len(self._offsets) - 1)
+        return self._offsets[idx], line_no - (idx * self.interval)
+
+    async def offset_for_line(self, line_no: int) -> Optional[int]:
+        """Byte offset of (0-based) line_no, None if the file has fewer lines."""
+        if line_no >= self._line_count:
+            await self.update()
+        offset, skip = self.locate(line_no)
+        if skip == 0:
+            return offset
+        return await asyncio.to_thread(self._skip_lines, str(self.filename), offset, skip)
+
+    @staticmethod
+    def _skip_lines(filename: str, offset: int, skip: int) -> Optional[int]:
+        with CompressedFile.open(filename) as h_file:
+            h_file.seek(offset)
+            for _ in range(skip):
+                line = h_file.readline()
+                if not line.endswith(b'\n'):
+                    return None
+                offset += len(line)
+        return offset
+
+    @staticmethod
+    def offset_for_last_lines(filename: str, count: int, end_pos: int) -> int:
+        """
+        Byte offset of the start of the last count lines before end_pos.
+
+        Scans backward from end_pos over a memory map (only the tail pages are touched),
+        so the cost depends on count, not on the file size.  Returns 0 if the file
+        has fewer lines.
+        """
+        if end_pos <= 0 or count <= 0:
+            return max(end_pos, 0)
+        if CompressedFile.is_compressed(filename):
+            return LineIndex._offset_for_last_lines_compressed(filename, count, end_pos)
+        with open(filename, 'rb') as h_file:
+            if os.fstat(h_file.fileno()).st_size == 0:
+                return 0        # truncated/rotated since end_pos, an empty file can't be mapped
+            with mmap.mmap(h_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = LineIndex._rfind_lines(mm, count, min(end_pos, len(mm)))
+        return max(offset, 0)
+
+    @staticmethod
+    def _offset_for_last_lines_compressed(filename: str, count: int, end_pos: int) -> int:
+        # No memory map, read backward in growing blocks
+        block_size = LineIndex._READ_CHUNK
+        with CompressedFile.open(filename) as h_file:
+            while True:
+                start = max(end_pos - block_size, 0)
+                h_file.seek(start)
+                data = h_file.read(end_pos - start)
+                offset = LineIndex._rfind_lines(data, count, len(data))
+                if offset >= 0 or start == 0:
+                    return start + max(offset, 0)
+                block_size *= 4
+
+    @staticmethod
+    def _rfind_lines(buffer, count: int, end: int) -> int:
+        """Offset (in buffer) of the start of the last count lines before end, -1 if fewer lines."""
+        pos = end
+        if pos > 0 and buffer[pos - 1] == 0x0A:
+            pos -= 1   # terminator of the last line
+        for _ in range(count):
+            pos = buffer.rfind(b'\n', 0, pos)
+            if pos < 0:
+                return -1
+        return pos + 1
+
+    async def line_for_offset(self, offset: int) -> Optional[int]:
+        """(0-based) number of the line containing byte offset, None if past the last complete line."""
+        if offset >= self._indexed_pos:
+            await self.update()
+        if offset < 0 or offset >= self._indexed_pos:
+            return None
+        idx = bisect.bisect_right(self._offsets, offset) - 1
+        cnt = await asyncio.to_thread(self._count_lines, str(self.filename), self._offsets[idx], offset)
+        return idx * self.interval + cnt
+
+    @staticmethod
+    def _count_lines(filename: str, offset: int, end_pos: int) -> int:
+        with CompressedFile.open(filename) as h_file:
+            h_file.seek(offset)
+            return h_file.read(end_pos - offset).count(b'\n')
+
+    def is_complete(self, from_line: int, count: int) -> bool:
+        """True if the file (as indexed) has all count lines from from_line, i.e. the page can't change."""
+        return from_line + count <= self._line_count
+
+    async def read_lines(self, from_line: int, count: int, offset: int = None) -> Tuple[List[str], Optional[int], Optional[int]]:
+        """
+        Return up to count lines starting at (0-based) from_line, or at offset if known
+        (i.e. from a cursor).
+
+        Returns:
+            Tuple[List[str], int, int]: lines, offset of from_line and offset following
+            the last line returned (both None if from_line is past the end of the file).
+        """
+        if offset is None:
+            offset = await self.offset_for_line(from_line)
+        if offset is None:
+            return [], None, None
+        lines, end_pos = await asyncio.to_thread(self._read_lines, str(self.filename), offset, count)
+        return lines, offset, end_pos
+
+    @staticmethod
+    def _read_lines(filename: str, offset: int, count: int) -> Tuple[List[str], int]:
+        lines: List[str] = []
+        with CompressedFile.open(filename) as h_file:
+            h_file.seek(offset)
+            while len(lines) < count:
+                line = h_file.readline()
+                if not line.endswith(b'\n'):
+                    break
+                lines.append(line.decode('utf-8', errors='replace').rstrip('\r\n'))
+                offset += len(line)
+        return lines, offset
+
+    @staticmethod
+    def read_bytes(filename: str, offset: int, size: int) -> bytes:
+        """Raw (uncompressed) bytes, i.e. for a byte Range request."""
+        with CompressedFile.open(filename) as h_file:
+            h_file.seek(offset)
+            return h_file.read(size)
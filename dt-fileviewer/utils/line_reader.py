@@ -0,0 +1,143 @@
+import asyncio
+import codecs
+import os
+import pathlib
+from typing import List
+
+from loguru import logger as LOGGER
+from utils import cfg as cfg
+from utils.compressed_file import CompressedFile
+
+
+class LineReader():
+    """
+    Read complete lines from a text file in large binary chunks.
+
+    The file handle is kept open between reads.  Partial (last) lines are carried
+    over to the next read, and only complete lines are decoded (UTF-8, incremental,
+    error policy from cfg.decode_errors) and returned, a batch at a time.
+    Compressed files are read through CompressedFile (positions are uncompressed).
+
+    A line is returned truncated to MAX_LINE_LEN bytes once that much was read without a
+    line end (binary file, huge line), the rest of it is skipped: the carry stays bounded.
+    """
+    MAX_LINE_LEN = 64 * 1024
+
+    def __init__(self, filename, position: int = 0, chunk_size: int = None, errors: str = None):
+        self.filename = pathlib.Path(filename)
+        self._chunk_size: int = chunk_size or cfg.read_chunk_size
+        self._h_file = CompressedFile.open(self.filename, buffering=0)
+        self._position: int = position      # end of the last complete line returned
+        self._carry: bytes = b''            # partial line following _position
+        self._skip_line: bool = False       # rest of a truncated line, up to its line end
+        self._batch_start: int = position   # offset and raw bytes of the last batch returned
+        self._batch_data: bytes = b''
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors=errors or cfg.decode_errors)
+
+    @property
+    def position(self) -> int:
+        """Offset of the 1st byte not yet returned as (part of) a complete line."""
+        return self._position
+
+    def stat(self) -> os.stat_result:
+        """stat of the open file (which may no longer be the file at self.filename)."""
+        return os.fstat(self._h_file.fileno())
+
+    def _read_chunk(self, offset: int, size: int) -> bytes:
+        self._h_file.seek(offset)
+        return self._h_file.read(size)
+
+    async def read_lines(self, end_pos: int = None) -> List[str]:
+        """
+        Return the next batch of complete lines (without line terminators), [] at EOF.
+
+        Args:
+            end_pos (int): optional, do not read past this offset.
+        """
+        while True:
+            read_pos = self._position + len(self._carry)
+            size = self._chunk_size if end_pos is None else min(self._chunk_size, end_pos - read_pos)
+            if size <= 0:
+                return []
+            chunk = await asyncio.to_thread(self._read_chunk, read_pos, size)
+            if len(chunk) == 0:
+                return []
+
+            if self._skip_line:
+                nl = chunk.find(b'\n')
+                self._position += len(chunk) if nl < 0 else nl + 1
+                self._skip_line = nl < 0
+                chunk = chunk[nl + 1:] if nl >= 0 else b''
+                if len(chunk) == 0:
+                    continue
+
+            data = self._carry + chunk if self._carry else chunk
+            last_nl = data.rfind(b'\n')
+            if last_nl < 0:
+                # No complete line yet (very long line, or still being written)
+                self._carry = data
+                if len(data) > self.MAX_LINE_LEN:
+                    return self._truncate_line()
+                continue
+
+            self._carry = data[last_nl + 1:]
+            self._batch_start = self._position
+            self._batch_data = data[:last_nl]
+            self._position += last_nl + 1
+            text = self._decoder.decode(data[:last_nl])
+            if '\r' in text:
+                text = text.replace('\r', '')
+            LOGGER.trace('- [{}] read {} bytes', self.filename.name, last_nl + 1)
+            return text.split('\n')
+
+    def _truncate_line(self) -> List[str]:
+        """The carry (a line without end) cut to MAX_LINE_LEN (at a character boundary), the rest is skipped."""
+        cut = self.MAX_LINE_LEN
+        while cut > 0 and self._carry[cut] & 0xC0 == 0x80:
+            cut -= 1        # UTF-8 continuation byte
+        LOGGER.warning(f'- [{self.filename.name}] line at {self._position} longer than {self.MAX_LINE_LEN} bytes, truncated.')
+        text = self._decoder.decode(self._carry[:cut]).replace('\r', '')
+        self._batch_start = self._position
+        self._batch_data = self._carry[:cut]
+        self._position += len(self._carry)
+        self._carry = b''
+        self._skip_line = True
+        return [text]
+
+    def line_offsets(self) -> List[int]:
+        """Byte offsets of the lines returned by the last read_lines() (or flush())."""
+        offsets = [self._batch_start]
+        find = self._batch_data.find
+        pos = find(b'\n')
+        while pos >= 0:
+            offsets.append(self._batch_start + pos + 1)
+            pos = find(b'\n', pos + 1)
+        return offsets
+
+    def flush(self) -> List[str]:
+        """Return the carried over partial line (if any) as a line, i.e. file was rotated."""
+        if len(self._carry) == 0:
+            return []
+        text = self._decoder.decode(self._carry, final=True).replace('\r', '')
+        self._batch_start = self._position
+        self._batch_data = self._carry
+        self._position += len(self._carry)
+        self._carry = b''
+        return [text]
+
+    def reset(self, position: int = 0):
+        """Restart reading at position (i.e. file truncated)."""
+        self._position = position
+        self._carry = b''
+        self._skip_line = False
+        self._decoder.reset()
+
+    def close(self):
+        if not self._h_file.closed:
+            self._h_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,193 @@
+import asyncio
+import heapq
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+from loguru import logger as LOGGER
+from utils import cfg as cfg
+from utils.helper import Helper
+from utils.line_filter import LineFilter
+from utils.textfile_tailer import StartPos, TailRegistry, TailSubscriber
+
+
+class MergedView():
+    """
+    Tail of several files, lines interleaved in timestamp order (streaming k-way merge).
+
+    Every file has its own TailSubscriber (shared reader, bounded ring).  The heap holds
+    at most one line per file, the oldest line is sent when every (active) file has a
+    line in the heap, or when a line has waited cfg.merge_window_ms: the reorder window
+    for files written late (or idle).  Memory is proportional to the number of files
+    (a heap entry and at most a ring of lines per file), not to their size.
+
+    Lines without a timestamp (i.e. tracebacks) keep the timestamp of the previous line
+    of the same file.  Each line is tagged with its file ID.
+
+    Protocols (see TailSubscriber):
+    - html: batches of pre-rendered lines, prefixed with [file id]
+    - compact: JSON frames {skipped, lines: [[seq, offset, level, text, file id], ...]}
+    """
+    def __init__(self, textfiles: Dict[str, str], start_loc: StartPos = StartPos.TAIL, line_filter: LineFilter = None,
+                 start_time: datetime = None, start_lines: int = 0, protocol: str = TailSubscriber.PROTOCOL_HTML):
+        self.ids: List[str] = list(textfiles)
+        self.compact: bool = protocol == TailSubscriber.PROTOCOL_COMPACT
+        self._sources: List[TailSubscriber] = [
+            TailRegistry.subscribe(textfile_id, filename, start_loc=start_loc, start_time=start_time,
+                                   line_filter=None if line_filter is None else line_filter.for_file(textfile_id),
+                                   start_lines=start_lines, protocol=TailSubscriber.PROTOCOL_MERGE)
+            for textfile_id, filename in textfiles.items()
+        ]
+        self._chunks: List[Deque[Tuple[float, tuple]]] = [deque() for _ in self._sources]   # (arrival time, item)
+        self._last_timestamp: List[datetime] = [datetime.min] * len(self._sources)
+        # (timestamp, arrival order, source idx, item, arrival time), one entry per source at most
+        self._heap: List[Tuple[datetime, int, int, tuple, float]] = []
+        self._in_heap: List[bool] = [False] * len(self._sources)
+        self._arrivals: int = 0
+        self._skipped: int = 0
+        self._seq: int = 0
+        self._window: float = cfg.merge_window_ms / 1000
+        self._batch_max_bytes: int = cfg.batch_max_bytes
+        self._paused: bool = False
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+        self._active: bool = True
+
+    @property
+    def name(self) -> str:
+        return '+'.join(self.ids)
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    @paused.setter
+    def paused(self, state: bool):
+        # Sources keep buffering (overflow policy applies), the merge stops
+        LOGGER.warning(f'Paused set to: {state}')
+        self._paused = state
+        if state:
+            self._resumed.clear()
+        else:
+            self._resumed.set()
+
+    @property
+    def end_status(self) -> Tuple[int, str]:
+        """Websocket close (code, reason) once every tail ended, 1011 if any failed, 1012 if a file was relocated."""
+        if any(source.relocated for source in self._sources):
+            return 1012, 'File location changed, reconnect'
+        if any(source.end_status[0] == 1011 for source in self._sources):
+            return 1011, 'Tail failed'
+        return 1001, 'Tail ended'
+
+    @property
+    def in_progress(self) -> bool:
+        # A relocated file ends the merge, it would be missing from the rest of it
+        return self._active and not any(source.relocated for source in self._sources) and \
+            (len(self._heap) > 0 or any(source.in_progress for source in self._sources))
+
+    def _fill(self):
+        """Move the next line of every source without one into the heap."""
+        now = time.monotonic()
+        for idx, source in enumerate(self._sources):
+            if self._in_heap[idx]:
+                continue
+            chunk = self._chunks[idx]
+            if len(chunk) == 0:
+                # Everything available (bounded by the source ring), so a backlog
+                # arrives at once and waits for the window only once.
+                skipped, items = source.take()
+                self._skipped += skipped
+                chunk.extend((now, item) for item in items)
+                if len(chunk) == 0:
+                    continue
+            arrival, (offset, level, line, timestamp) = chunk.popleft()
+            if timestamp is None:
+                timestamp = self._last_timestamp[idx]
+            else:
+                self._last_timestamp[idx] = timestamp
+            self._arrivals += 1
+            heapq.heappush(self._heap, (timestamp, self._arrivals, idx, (offset, level, line), arrival))
+            self._in_heap[idx] = True
+
+    def _ready(self, now: float) -> bool:
+        """The oldest line can be sent: no active source is without a line, or the window expired."""
+        if len(self._heap) == 0:
+            return False
+        waiting = sum(1 for idx, source in enumerate(self._sources) if not self._in_heap[idx] and source.in_progress)
+        if waiting == 0:
+            return True
+        return min(entry[4] for entry in self._heap) + self._window <= now
+
+    def _next_timeout(self, now: float) -> Optional[float]:
+        if len(self._heap) == 0:
+            return None
+        return max(min(entry[4] for entry in self._heap) + self._window - now, 0)
+
+    async def _wait(self, timeout: Optional[float]):
+        """Wait for a line from a source without one in the heap, at most timeout seconds."""
+        waiters = [asyncio.create_task(source.wait_data()) for idx, source in enumerate(self._sources)
+                   if not self._in_heap[idx] and source.in_progress]
+        if len(waiters) == 0:
+            if timeout is not None:
+                await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def get_or_waitfor_batch(self) -> Union[List[str], dict]:
+        """Next batch (compact: frame) of merged lines, None when all tails ended."""
+        while self.in_progress:
+            if self.paused:
+                await self._resumed.wait()
+                continue
+
+            items: List[Tuple[int, tuple]] = []
+            batch_bytes = 0
+            self._fill()
+            now = time.monotonic()
+            while batch_bytes < self._batch_max_bytes and self._ready(now):
+                _, _, idx, item, _ = heapq.heappop(self._heap)
+                self._in_heap[idx] = False
+                items.append((idx, item))
+                batch_bytes += len(item[2]) + 16
+                self._fill()
+
+            skipped = self._skipped
+            self._skipped = 0
+            if len(items) > 0 or skipped > 0:
+                return self._frame(skipped, items) if self.compact else self._batch(skipped, items)
+
+            if not any(source.in_progress for source in self._sources) and len(self._heap) == 0:
+                break
+            await self._wait(self._next_timeout(now))
+
+        return None
+
+    def _frame(self, skipped: int, items: List[Tuple[int, tuple]]) -> dict:
+        self._seq += skipped
+        lines = []
+        for idx, (offset, level, line) in items:
+            lines.append([self._seq, offset, level, line, self.ids[idx]])
+            self._seq += 1
+        return {'skipped': skipped, 'lines': lines}
+
+    def _batch(self, skipped: int, items: List[Tuple[int, tuple]]) -> List[str]:
+        batch: List[str] = []
+        if skipped > 0:
+            batch.append(Helper.filter_line(f'*** WARNING - {skipped} lines skipped ***'))
+        for idx, (_, level, line) in items:
+            batch.append(Helper.html_line(level, f'[{self.ids[idx]}] {line}'))
+        return batch
+
+    def stop_tail(self):
+        LOGGER.warning(f'stop merged tail requested [{self.name}].')
+        if self._active:
+            self._active = False
+            self._resumed.set()
+            for source in self._sources:
+                source.stop_tail()
@@ -0,0 +1,137 @@
+import asyncio
+import bisect
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from loguru import logger as LOGGER
+
+
+class Histogram():
+    """Fixed bucket histogram, buckets are allocated once (observe() only updates counts)."""
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)    # last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class FileMetrics():
+    """Per file counters, held by the TextFileHandler (and its subscribers) for the life of the process."""
+    __slots__ = ('bytes_read', 'lines_read', 'lines_filtered', 'lines_dropped', 'lag_bytes')
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.lines_filtered = 0
+        self.lines_dropped = 0
+        self.lag_bytes = Histogram(Metrics.LAG_BYTES_BUCKETS)
+
+
+class Metrics():
+    """
+    Process wide metrics of the tail pipeline, in Prometheus text format (/metrics).
+
+    The hot path only does integer adds on preallocated objects (FileMetrics, Histogram),
+    per batch rather than per line.  Gauges (active tails, subscribers, buffer depth)
+    are collected when scraped, from callbacks registered with register_gauge().
+    """
+    PREFIX = 'dtfv'
+    SEND_SECONDS_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+    LOOP_LAG_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+    LAG_BYTES_BUCKETS = [0, 1024, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864]
+    _LOOP_INTERVAL = 0.25
+
+    _files: Dict[str, FileMetrics] = {}
+    _gauges: List[Tuple[str, str, str, Callable[[], Dict[str, float]]]] = []
+    ws_send_seconds = Histogram(SEND_SECONDS_BUCKETS)
+    ws_frames_sent = 0
+    ws_lines_sent = 0
+    loop_lag_seconds = Histogram(LOOP_LAG_BUCKETS)
+    _loop_task: asyncio.Task = None
+
+    @staticmethod
+    def for_file(textfile_id: str) -> FileMetrics:
+        metrics = Metrics._files.get(textfile_id, None)
+        if metrics is None:
+            metrics = FileMetrics()
+            Metrics._files[textfile_id] = metrics
+        return metrics
+
+    @staticmethod
+    def register_gauge(name: str, help_text: str, label: str, collect: Callable[[], Dict[str, float]]):
+        """collect() returns {label value: gauge value}, called on each scrape.  label None: {'': value}."""
+        Metrics._gauges.append((name, help_text, label, collect))
+
+    # -- Event loop lag ------------------------------------------------------------------
+    @staticmethod
+    def start_loop_monitor():
+        if Metrics._loop_task is None or Metrics._loop_task.done():
+            Metrics._loop_task = asyncio.create_task(Metrics._monitor_loop(), name='metrics_loop_monitor')
+
+    @staticmethod
+    async def _monitor_loop():
+        LOGGER.debug('- event loop lag monitor started.')
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(Metrics._LOOP_INTERVAL)
+            Metrics.loop_lag_seconds.observe(max(loop.time() - start - Metrics._LOOP_INTERVAL, 0.0))
+
+    # -- Exposition ----------------------------------------------------------------------
+    @staticmethod
+    def render() -> str:
+        lines: List[str] = []
+        file_counters = [
+            ('bytes_read_total', 'Bytes read from the file', 'bytes_read'),
+            ('lines_read_total', 'Lines read from the file', 'lines_read'),
+            ('lines_filtered_total', 'Lines not sent to a viewer due to its filter', 'lines_filtered'),
+            ('lines_dropped_total', 'Lines dropped due to a full viewer buffer', 'lines_dropped'),
+        ]
+        for name, help_text, attr in file_counters:
+            Metrics._header(lines, name, help_text, 'counter')
+            for textfile_id, metrics in Metrics._files.items():
+                lines.append(f'{Metrics.PREFIX}_{name}{{file="{textfile_id}"}} {getattr(metrics, attr)}')
+
+        Metrics._header(lines, 'viewer_lag_bytes', 'Bytes between EOF and the last line queued for a viewer, per frame sent', 'histogram')
+        for textfile_id, metrics in Metrics._files.items():
+            Metrics._histogram(lines, 'viewer_lag_bytes', metrics.lag_bytes, f'file="{textfile_id}"')
+
+        Metrics._header(lines, 'ws_frames_sent_total', 'Websocket frames sent', 'counter')
+        lines.append(f'{Metrics.PREFIX}_ws_frames_sent_total {Metrics.ws_frames_sent}')
+        Metrics._header(lines, 'ws_lines_sent_total', 'Lines sent to viewers', 'counter')
+        lines.append(f'{Metrics.PREFIX}_ws_lines_sent_total {Metrics.ws_lines_sent}')
+        Metrics._header(lines, 'ws_send_seconds', 'Time to send a websocket frame', 'histogram')
+        Metrics._histogram(lines, 'ws_send_seconds', Metrics.ws_send_seconds)
+        Metrics._header(lines, 'event_loop_lag_seconds', 'Event loop scheduling delay', 'histogram')
+        Metrics._histogram(lines, 'event_loop_lag_seconds', Metrics.loop_lag_seconds)
+
+        for name, help_text, label, collect in Metrics._gauges:
+            Metrics._header(lines, name, help_text, 'gauge')
+            for label_value, value in collect().items():
+                labels = '' if label is None else f'{{{label}="{label_value}"}}'
+                lines.append(f'{Metrics.PREFIX}_{name}{labels} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _header(lines: List[str], name: str, help_text: str, metric_type: str):
+        lines.append(f'# HELP {Metrics.PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {Metrics.PREFIX}_{name} {metric_type}')
+
+    @staticmethod
+    def _histogram(lines: List[str], name: str, histogram: Histogram, labels: str = ''):
+        sep = ',' if labels else ''
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            lines.append(f'{Metrics.PREFIX}_{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{Metrics.PREFIX}_{name}_bucket{{{labels}{sep}le="+Inf"}} {histogram.count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{Metrics.PREFIX}_{name}_sum{suffix} {histogram.total}')
+        lines.append(f'{Metrics.PREFIX}_{name}_count{suffix} {histogram.count}')
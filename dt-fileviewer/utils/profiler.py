@@ -0,0 +1,104 @@
+import collections
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger as LOGGER
+
+
+class Profiler():
+    """
+    Sampling profiler of the running server (/admin/profile) and tail pipeline stage spans.
+
+    Every thread's stack is sampled (sys._current_frames) by a background thread, the
+    result is a collapsed stack dump (flamegraph.pl, speedscope):
+        thread;outer_func (file.py:line);...;inner_func (file.py:line) count
+
+    Stages are timed only while a profile runs, a span costs a flag check otherwise:
+        span = time.perf_counter() if Profiler.active else None
+        ...
+        if span is not None:
+            Profiler.record('tail.read', span)
+    """
+    active: bool = False
+
+    _running = threading.Lock()
+    _stop = threading.Event()
+    _spans: Dict[str, List[float]] = {}    # stage: [count, total seconds, max seconds]
+
+    @staticmethod
+    def record(stage: str, start: float):
+        """End of a stage span started at start (perf_counter)."""
+        elapsed = time.perf_counter() - start
+        span = Profiler._spans.get(stage, None)
+        if span is None:
+            Profiler._spans[stage] = [1, elapsed, elapsed]
+            return
+        span[0] += 1
+        span[1] += elapsed
+        if elapsed > span[2]:
+            span[2] = elapsed
+
+    @staticmethod
+    def is_running() -> bool:
+        return Profiler._running.locked()
+
+    @staticmethod
+    def stop():
+        """Stop the running profile early, it returns what was sampled so far."""
+        Profiler._stop.set()
+
+    @staticmethod
+    def profile(seconds: float, hz: int) -> Optional[dict]:
+        """
+        Sample all threads hz times per second for (at most) seconds, blocking: run it in a thread.
+
+        Returns:
+            dict: {seconds, samples, stacks: {collapsed stack: count}, spans: {stage: {count, total_ms, max_ms}}},
+                  None if a profile is already running.
+        """
+        if not Profiler._running.acquire(blocking=False):
+            return None
+        LOGGER.warning(f'- Profiling for {seconds}s at {hz} Hz.')
+        try:
+            Profiler._stop.clear()
+            Profiler._spans = {}
+            Profiler.active = True
+            stacks = collections.Counter()
+            own = threading.get_ident()
+            interval = 1 / hz
+            samples = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds and not Profiler._stop.is_set():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident != own:
+                        stacks[Profiler._collapse(names.get(ident, str(ident)), frame)] += 1
+                samples += 1
+                Profiler._stop.wait(interval)
+            elapsed = time.perf_counter() - start
+        finally:
+            Profiler.active = False
+            Profiler._running.release()
+
+        spans = {stage: {'count': int(count), 'total_ms': round(total * 1000, 3), 'max_ms': round(longest * 1000, 3)}
+                 for stage, (count, total, longest) in sorted(Profiler._spans.items())}
+        LOGGER.warning(f'- Profile complete, {samples} samples, {len(stacks)} distinct stacks.')
+        return {'seconds': round(elapsed, 3), 'samples': samples, 'stacks': dict(stacks.most_common()), 'spans': spans}
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        frames: List[str] = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        frames.append(thread_name.replace(';', '_'))
+        return ';'.join(reversed(frames))
+
+    @staticmethod
+    def collapsed(result: dict) -> str:
+        """Collapsed stack text of a profile() result."""
+        return ''.join(f'{stack} {count}\n' for stack, count in result['stacks'].items())
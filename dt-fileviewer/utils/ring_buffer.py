@@ -0,0 +1,154 @@
+import asyncio
+from enum import Enum
+from typing import Any, Callable, List
+
+from loguru import logger as LOGGER
+
+
+class OverflowPolicy(Enum):
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+
+class RingBuffer():
+    """
+    Bounded, preallocated FIFO of items for a single producer and single consumer
+    running on the same event loop.
+
+    Producers and consumers await 'space available' / 'data available' signals
+    instead of sleeping.  When full, the OverflowPolicy decides if the producer must
+    wait (BLOCK) or which item is discarded (DROP_OLDEST, DROP_NEWEST).  Discarded
+    items are counted, see take_skipped().
+
+    The size of the buffered items (item_size) is tracked, see pending_bytes.
+    """
+    def __init__(self, capacity: int, policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+                 item_size: Callable[[Any], int] = len):
+        if capacity < 1:
+            raise ValueError(f'Invalid capacity [{capacity}], must be > 0')
+        self._capacity = capacity
+        self._policy = policy
+        self._slots: List[Any] = [None] * capacity
+        self._head: int = 0
+        self._count: int = 0
+        self._skipped: int = 0
+        self._item_size = item_size
+        self._bytes: int = 0
+        self._closed: bool = False
+        self._data_available = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._space_available.set()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def policy(self) -> OverflowPolicy:
+        return self._policy
+
+    @property
+    def pending_bytes(self) -> int:
+        """Sum of item_size(item)+1 of the buffered items."""
+        return self._bytes
+
+    @property
+    def is_full(self) -> bool:
+        return self._count == self._capacity
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put_nowait(self, item: Any) -> bool:
+        """
+        Add item to the buffer.
+
+        Returns:
+            bool: False if the buffer is full and policy is BLOCK (item NOT added),
+            else True (even if an item was dropped by the overflow policy).
+        """
+        if self._count == self._capacity:
+            if self._policy == OverflowPolicy.BLOCK:
+                return False
+            self._skipped += 1
+            if self._policy == OverflowPolicy.DROP_NEWEST:
+                return True
+            # DROP_OLDEST
+            self._bytes -= self._item_size(self._slots[self._head]) + 1
+            self._slots[self._head] = None
+            self._head = (self._head + 1) % self._capacity
+            self._count -= 1
+
+        self._slots[(self._head + self._count) % self._capacity] = item
+        self._count += 1
+        self._bytes += self._item_size(item) + 1
+        self._data_available.set()
+        if self._count == self._capacity:
+            self._space_available.clear()
+        return True
+
+    async def put(self, item: Any, block: bool = False):
+        """Add item to the buffer, waiting for space when policy is BLOCK (or block, whatever the policy)."""
+        while block and self._count == self._capacity:
+            if self._closed:
+                return
+            await self._space_available.wait()
+        while not self.put_nowait(item):
+            if self._closed:
+                return
+            await self._space_available.wait()
+
+    def get_batch(self, max_bytes: int = None, max_items: int = None) -> List[Any]:
+        """
+        Remove and return available items (oldest first), up to max_bytes (sum of
+        item_size(item)+1) and/or max_items.
+        """
+        batch: List[Any] = []
+        batch_bytes = 0
+        limit = self._count if max_items is None else min(max_items, self._count)
+        while len(batch) < limit:
+            if max_bytes is not None and batch_bytes >= max_bytes:
+                break
+            item = self._slots[self._head]
+            self._slots[self._head] = None
+            self._head = (self._head + 1) % self._capacity
+            self._count -= 1
+            batch.append(item)
+            batch_bytes += self._item_size(item) + 1
+        self._bytes -= batch_bytes
+
+        if self._count == 0 and not self._closed:
+            self._data_available.clear()
+        if len(batch) > 0:
+            self._space_available.set()
+        return batch
+
+    def take_skipped(self) -> int:
+        """Return and reset the number of items dropped due to overflow."""
+        skipped = self._skipped
+        self._skipped = 0
+        return skipped
+
+    def add_skipped(self, count: int):
+        """Count items dropped outside the buffer, so the consumer is notified."""
+        self._skipped += count
+        self._data_available.set()
+
+    async def wait_data(self):
+        """Wait until at least one item is available (or buffer is closed)."""
+        await self._data_available.wait()
+
+    async def wait_space(self):
+        """Wait until at least one slot is free (or buffer is closed)."""
+        await self._space_available.wait()
+
+    def close(self):
+        LOGGER.trace('RingBuffer closed.')
+        self._closed = True
+        self._data_available.set()
+        self._space_available.set()
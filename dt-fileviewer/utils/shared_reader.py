@@ -0,0 +1,130 @@
+import asyncio
+import multiprocessing
+import pathlib
+import signal
+import sys
+from typing import Dict, List, Tuple
+
+from loguru import logger as LOGGER
+from utils import cfg as cfg
+from utils.compressed_file import CompressedFile
+from utils.shared_ring import SharedLineRing
+from utils.textfile_tailer import TextFileHandler
+
+
+class _RingSink():
+    """Live lines of a TextFileHandler, written as-is (with file offsets) to a SharedLineRing."""
+    protocol = 'shared_ring'
+    compact = True
+
+    def __init__(self, ring: SharedLineRing):
+        self.ring = ring
+        self._lines: List[str] = []
+        self._offsets: List[int] = []
+
+    def select(self, lines: List[str]) -> List[int]:
+        return list(range(len(lines)))
+
+    def format_line(self, line: str, offset: int = None) -> Tuple[int, str]:
+        return offset, line
+
+    def publish(self, line: Tuple[int, str]) -> bool:
+        self._offsets.append(line[0])
+        self._lines.append(line[1])
+        return True
+
+    def queued_to(self, position: int):
+        # End of a batch, publish it to the workers
+        if self.ring is not None:
+            self.ring.write_lines(self._lines, self._offsets, position)
+        self._lines = []
+        self._offsets = []
+
+    async def wait_for_space(self):
+        pass
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.unlink()
+            self.ring = None
+
+
+class SharedReader():
+    """
+    Single reader process, used when uvicorn runs more than 1 worker (cfg.shared_reader).
+
+    Every configured (uncompressed) file is tailed once, by this process, and its new lines
+    are published to a SharedLineRing.  The workers (TailRegistry) attach to the rings and
+    only do the fan-out to their websockets.  The configuration file is checked for
+    added/changed/removed files every _CONFIG_INTERVAL seconds.
+    """
+    _CONFIG_INTERVAL = 5.0
+
+    @staticmethod
+    def start_process() -> multiprocessing.Process:
+        process = multiprocessing.get_context('spawn').Process(target=SharedReader.run, name='dtfv-shared-reader', daemon=True)
+        process.start()
+        LOGGER.info(f'- Shared reader process started, pid: {process.pid}')
+        return process
+
+    @staticmethod
+    def run():
+        import dt_tools.logger.logging_helper as lh
+        lh.configure_logger(log_level=cfg.console_ll, log_format=cfg.console_format, brightness=False)
+        # Terminated with the server, unwind so the rings are unlinked
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            asyncio.run(SharedReader._run())
+        except (KeyboardInterrupt, SystemExit):
+            pass
+
+    @staticmethod
+    async def _run():
+        from utils.helper import Helper
+        tails: Dict[str, Tuple[TextFileHandler, _RingSink]] = {}
+        config_file = pathlib.Path(cfg.FILE_CONFIG)
+        config_mtime = config_file.stat().st_mtime_ns if config_file.exists() else None
+        try:
+            while True:
+                mtime = config_file.stat().st_mtime_ns if config_file.exists() else None
+                if mtime != config_mtime:
+                    Helper.reload_configuration()
+                    config_mtime = mtime
+                for textfile_id, (handler, _) in list(tails.items()):
+                    if not handler.in_progress:
+                        LOGGER.warning(f'- [{textfile_id}] shared tail ended, restarting.')
+                        SharedReader._stop(tails, textfile_id)
+                SharedReader._sync(tails)
+                await asyncio.sleep(SharedReader._CONFIG_INTERVAL)
+        finally:
+            for textfile_id in list(tails):
+                SharedReader._stop(tails, textfile_id)
+
+    @staticmethod
+    def _sync(tails: Dict[str, Tuple[TextFileHandler, _RingSink]]):
+        """Tail the configured files, stop tails of removed or moved files."""
+        for textfile_id in list(tails):
+            handler, _ = tails[textfile_id]
+            filename = cfg.text_files.get(textfile_id, None)
+            if filename is None or handler.filename != pathlib.Path(filename):
+                SharedReader._stop(tails, textfile_id)
+
+        for textfile_id, filename in cfg.text_files.items():
+            if textfile_id in tails or CompressedFile.is_compressed(filename) or not pathlib.Path(filename).is_file():
+                continue
+            handler = TextFileHandler(textfile_id, filename)
+            try:
+                handler.start_tail()
+                sink = _RingSink(SharedLineRing.create(textfile_id, filename, handler.position))
+                handler.add_sink(sink)
+                tails[textfile_id] = (handler, sink)
+            except Exception as ex:
+                LOGGER.error(f'- [{textfile_id}] unable to start shared tail: {repr(ex)}')
+                handler.stop_tail()
+
+    @staticmethod
+    def _stop(tails: Dict[str, Tuple[TextFileHandler, _RingSink]], textfile_id: str):
+        handler, sink = tails.pop(textfile_id)
+        handler.stop_tail()
+        sink.close()
+        LOGGER.info(f'- [{textfile_id}] shared tail stopped.')
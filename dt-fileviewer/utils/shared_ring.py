@@ -0,0 +1,277 @@
+import hashlib
+import os
+import pathlib
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+from loguru import logger as LOGGER
+from utils import cfg as cfg
+
+
+class SharedLineRing():
+    """
+    Shared memory ring of lines for one file, single writer (the reader process),
+    any number of readers (uvicorn workers).
+
+    Layout: header, then a data ring of records [length u32][file offset u64][utf-8 text].
+    Positions (head, tail) are absolute byte counts, ring index = position % capacity.
+    The writer advances tail (oldest valid record) before overwriting, readers
+    re-check tail after copying, so an overwritten record is detected and counted as
+    skipped, never returned.  The header is updated under a sequence lock.
+
+    Readers keep their own cursor, nothing is copied out of shared memory until the
+    lines are decoded.
+
+    Ring names are prefixed with the listen port, published by main.py in the environment
+    (RING_PREFIX_ENV) for the reader process and the workers: a port probed in each
+    process could differ.
+    """
+    POLL_INTERVAL = 0.02
+    RING_PREFIX_ENV = 'DTFV_RING_PREFIX'
+    _HEADER_TIMEOUT = 0.5    # seconds the header may stay locked (odd lock seq), writer died mid-update
+    _MAGIC = 0x56465444    # 'DTFV'
+    _HEADER = struct.Struct('<IIQQQQQQQ')    # magic, version, capacity, lock seq, head, tail, tail line seq, head line seq, file position
+    _FILENAME = struct.Struct('<H')         # length, followed by the (utf-8) filename
+    _FILENAME_MAX = 1024
+    _DATA_START = 4096
+    _LOCK_SEQ_POS = 16
+    _FIELDS = struct.Struct('<QQQQQ')   # head .. file position, the header part updated under the lock
+    _FIELDS_POS = 24
+    _RECORD = struct.Struct('<IQ')
+    _WRAP = 0xFFFFFFFF
+    _NO_OFFSET = 0xFFFFFFFFFFFFFFFF
+    _VERSION = 1
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self._shm = shm
+        self._owner = owner
+        self._buf = shm.buf
+        magic, version, self.capacity, *_ = self._HEADER.unpack_from(self._buf, 0)
+        if owner:
+            self.capacity = shm.size - self._DATA_START
+        elif magic != self._MAGIC or version != self._VERSION:
+            raise ValueError(f'{shm.name} is not a line ring (version {self._VERSION}).')
+        # Writer state (published in the header)
+        self._lock_seq = 0
+        self._head = self._tail = self._tail_seq = self._head_seq = 0
+        self._position = 0
+        # Reader cursor (absolute position, line seq)
+        self._cursor = 0
+        self._cursor_seq = 0
+
+    @staticmethod
+    def publish_prefix(listen_port: int):
+        """Ring name prefix of this server, inherited by the processes started from now on."""
+        os.environ[SharedLineRing.RING_PREFIX_ENV] = f'dtfv_{listen_port}'
+
+    @staticmethod
+    def name_for(textfile_id: str) -> str:
+        digest = hashlib.md5(textfile_id.encode('utf-8')).hexdigest()[:16]
+        prefix = os.environ.get(SharedLineRing.RING_PREFIX_ENV, None) or f'dtfv_{cfg.listen_port}'
+        return f'{prefix}_{digest}'
+
+    @staticmethod
+    def enabled() -> bool:
+        # uvicorn ignores workers when reloading
+        return cfg.shared_reader and cfg.num_workers > 1 and not cfg.auto_reload
+
+    # -- Writer --------------------------------------------------------------------------
+    @staticmethod
+    def create(textfile_id: str, filename: str, position: int) -> 'SharedLineRing':
+        name = SharedLineRing.name_for(textfile_id)
+        size = SharedLineRing._DATA_START + max(cfg.shared_ring_mb, 1) * 1024 * 1024
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            LOGGER.warning(f'- Removing stale shared ring [{name}] for [{textfile_id}].')
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+
+        ring = SharedLineRing(shm, owner=True)
+        encoded = str(pathlib.Path(filename)).encode('utf-8')[:SharedLineRing._FILENAME_MAX]
+        SharedLineRing._FILENAME.pack_into(ring._buf, SharedLineRing._HEADER.size, len(encoded))
+        start = SharedLineRing._HEADER.size + SharedLineRing._FILENAME.size
+        ring._buf[start:start + len(encoded)] = encoded
+        ring._position = position
+        SharedLineRing._HEADER.pack_into(ring._buf, 0, SharedLineRing._MAGIC, SharedLineRing._VERSION, ring.capacity, 0, 0, 0, 0, 0, 0)
+        ring._commit()
+        LOGGER.info(f'- [{textfile_id}] shared ring [{name}] {ring.capacity} bytes, from: {position}')
+        return ring
+
+    def _commit(self):
+        # Sequence lock: odd while the header is being updated.  pack_into zero fills before
+        # packing, the lock seq is not part of the fields packed (would read 0: unlocked).
+        self._lock_seq += 1
+        struct.pack_into('<Q', self._buf, self._LOCK_SEQ_POS, self._lock_seq)
+        self._FIELDS.pack_into(self._buf, self._FIELDS_POS, self._head, self._tail, self._tail_seq, self._head_seq, self._position)
+        self._lock_seq += 1
+        struct.pack_into('<Q', self._buf, self._LOCK_SEQ_POS, self._lock_seq)
+
+    def _advance_tail(self, needed: int):
+        """Free ring space up to (absolute) position needed, oldest records first."""
+        tail = self._tail
+        while self._tail < needed and self._tail < self._head:
+            idx = self._tail % self.capacity
+            remaining = self.capacity - idx
+            if remaining < self._RECORD.size:
+                self._tail += remaining
+                continue
+            length, _ = self._RECORD.unpack_from(self._buf, self._DATA_START + idx)
+            if length == self._WRAP:
+                self._tail += remaining
+                continue
+            self._tail += self._RECORD.size + length
+            self._tail_seq += 1
+        if self._tail != tail:
+            # Also when only a wrap marker was freed: it is overwritten next
+            self._commit()
+
+    def write_lines(self, lines: List[str], offsets: List[int], position: int):
+        """Append lines (file offsets of each line) and publish them, position: end of the last line."""
+        for line, offset in zip(lines, offsets):
+            data = line.encode('utf-8', errors='replace')[:self.capacity // 2]
+            idx = self._head % self.capacity
+            remaining = self.capacity - idx
+            if remaining < self._RECORD.size + len(data):
+                # Doesn't fit before the end of the ring, continue at the start
+                self._advance_tail(self._head + remaining - self.capacity)
+                if remaining >= self._RECORD.size:
+                    self._RECORD.pack_into(self._buf, self._DATA_START + idx, self._WRAP, 0)
+                self._head += remaining
+                idx = 0
+            end = self._head + self._RECORD.size + len(data)
+            self._advance_tail(end - self.capacity)
+            start = self._DATA_START + idx
+            self._RECORD.pack_into(self._buf, start, len(data), self._NO_OFFSET if offset is None else offset)
+            self._buf[start + self._RECORD.size:start + self._RECORD.size + len(data)] = data
+            self._head = end
+            self._head_seq += 1
+        self._position = position
+        self._commit()
+
+    # -- Reader --------------------------------------------------------------------------
+    @staticmethod
+    def attach(textfile_id: str, filename) -> Optional['SharedLineRing']:
+        """Reader side ring for the file, None if not running shared or no ring is published for it."""
+        if not SharedLineRing.enabled():
+            return None
+        name = SharedLineRing.name_for(textfile_id)
+        try:
+            # Workers and the reader process are started from main.py and share its resource
+            # tracker, attaching doesn't hand the segment's cleanup to the worker.
+            shm = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            LOGGER.warning(f'- [{textfile_id}] no shared ring [{name}], reading the file in this worker.')
+            return None
+        try:
+            ring = SharedLineRing(shm, owner=False)
+        except ValueError as ex:
+            LOGGER.error(f'- [{textfile_id}] {ex}')
+            shm.close()
+            return None
+        if ring.filename != str(pathlib.Path(filename)):
+            LOGGER.warning(f'- [{textfile_id}] shared ring is for [{ring.filename}], reading the file in this worker.')
+            ring.close()
+            return None
+        try:
+            ring._cursor, ring._cursor_seq, position = ring.snapshot()
+        except TimeoutError as ex:
+            LOGGER.error(f'- [{textfile_id}] {ex}, reading the file in this worker.')
+            ring.close()
+            return None
+        LOGGER.info(f'- [{textfile_id}] attached to shared ring [{name}], position: {position}')
+        return ring
+
+    @property
+    def filename(self) -> str:
+        length, = self._FILENAME.unpack_from(self._buf, self._HEADER.size)
+        start = self._HEADER.size + self._FILENAME.size
+        return str(self._buf[start:start + length], 'utf-8')
+
+    def _read_header(self) -> Tuple[int, int, int, int, int]:
+        """
+        Consistent (head, tail, tail line seq, head line seq, file position).
+
+        Raises:
+            TimeoutError: the header stayed locked for _HEADER_TIMEOUT (writer died mid-update).
+        """
+        deadline = None
+        while True:
+            # Lock seq read on its own before and after the fields: unpack_from (memcpy)
+            # doesn't load the header bytes in order
+            lock_seq, = struct.unpack_from('<Q', self._buf, self._LOCK_SEQ_POS)
+            fields = self._HEADER.unpack_from(self._buf, 0)
+            if lock_seq % 2 == 0 and struct.unpack_from('<Q', self._buf, self._LOCK_SEQ_POS)[0] == lock_seq:
+                return fields[4:]
+            if deadline is None:
+                deadline = time.monotonic() + self._HEADER_TIMEOUT
+            elif time.monotonic() > deadline:
+                raise TimeoutError(f'shared ring [{self._shm.name}] header locked, the writer stopped mid-update')
+
+    def snapshot(self) -> Tuple[int, int, int]:
+        """(head, head line seq, file position), where a new reader starts."""
+        head, _, _, head_seq, position = self._read_header()
+        return head, head_seq, position
+
+    def read(self) -> Tuple[int, List[str], List[int], int]:
+        """
+        Lines published since the last read.
+
+        Returns:
+            Tuple: lines skipped (overwritten before they were read), lines, file offsets, file position
+        """
+        head, tail, tail_seq, _, position = self._read_header()
+        skipped = 0
+        if self._cursor < tail:
+            skipped = tail_seq - self._cursor_seq
+            self._cursor, self._cursor_seq = tail, tail_seq
+        starts: List[int] = []
+        lines: List[str] = []
+        offsets: List[int] = []
+        pos = self._cursor
+        while pos < head:
+            idx = pos % self.capacity
+            remaining = self.capacity - idx
+            if remaining < self._RECORD.size:
+                pos += remaining
+                continue
+            length, offset = self._RECORD.unpack_from(self._buf, self._DATA_START + idx)
+            if length == self._WRAP:
+                pos += remaining
+                continue
+            start = self._DATA_START + idx + self._RECORD.size
+            starts.append(pos)
+            lines.append(str(self._buf[start:start + length], 'utf-8', 'replace'))
+            offsets.append(None if offset == self._NO_OFFSET else offset)
+            pos += self._RECORD.size + length
+
+        # The writer may have freed (and overwritten) records while they were copied,
+        # from the first such record on the walk is not reliable: restart at the tail.
+        _, tail, tail_seq, _, _ = self._read_header()
+        if len(starts) > 0 and starts[0] < tail or pos < tail:
+            skipped += tail_seq - self._cursor_seq
+            self._cursor, self._cursor_seq = tail, tail_seq
+            return skipped, [], [], position
+        self._cursor = pos
+        self._cursor_seq += len(starts)
+        return skipped, lines, offsets, position
+
+    @property
+    def closed(self) -> bool:
+        """The writer removed the ring (file no longer tailed), readers should detach."""
+        return self._buf is None or struct.unpack_from('<I', self._buf, 0)[0] != self._MAGIC
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner and self._buf is not None:
+            struct.pack_into('<I', self._buf, 0, 0)
+        self.close()
+        if self._owner:
+            self._shm.unlink()
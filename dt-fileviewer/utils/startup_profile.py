@@ -0,0 +1,73 @@
+import builtins
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class StartupProfile():
+    """
+    main.py --startup-profile: time spent in each (top level) import and startup step,
+    logged once the server is ready to accept connections.
+
+    Enabled when this module is imported (first import of main.py), imports are timed by
+    wrapping builtins.__import__ until report().  Nested imports are counted in the
+    import that triggered them.
+    """
+    FLAG = '--startup-profile'
+    _REPORT_MIN_MS = 1.0
+
+    _enabled: bool = False
+    _start: float = time.perf_counter()
+    _imports: Dict[str, float] = {}
+    _marks: List[Tuple[str, float]] = []
+    _depth: int = 0
+    _import: Optional[Callable] = None
+
+    @staticmethod
+    def enable():
+        if StartupProfile._enabled:
+            return
+        StartupProfile._enabled = True
+        StartupProfile._import = builtins.__import__
+        builtins.__import__ = StartupProfile._timed_import
+
+    @staticmethod
+    def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if StartupProfile._depth > 0 or name in sys.modules:
+            return StartupProfile._import(name, globals, locals, fromlist, level)
+        StartupProfile._depth += 1
+        start = time.perf_counter()
+        try:
+            return StartupProfile._import(name, globals, locals, fromlist, level)
+        finally:
+            StartupProfile._depth -= 1
+            StartupProfile._imports[name] = StartupProfile._imports.get(name, 0.0) + time.perf_counter() - start
+
+    @staticmethod
+    def mark(step: str):
+        """End of a startup step."""
+        if StartupProfile._enabled:
+            StartupProfile._marks.append((step, time.perf_counter()))
+
+    @staticmethod
+    def report():
+        if not StartupProfile._enabled:
+            return
+        from loguru import logger as LOGGER
+        StartupProfile.mark('ready')
+        builtins.__import__ = StartupProfile._import
+        StartupProfile._enabled = False
+
+        LOGGER.info('== Startup profile (ms) ==')
+        for name, elapsed in sorted(StartupProfile._imports.items(), key=lambda entry: entry[1], reverse=True):
+            if elapsed * 1000 >= StartupProfile._REPORT_MIN_MS:
+                LOGGER.info(f'  import {name:40} {elapsed * 1000:8.1f}')
+        previous = StartupProfile._start
+        for step, at in StartupProfile._marks:
+            LOGGER.info(f'  {step:47} {(at - previous) * 1000:8.1f}')
+            previous = at
+        LOGGER.info(f'  {"total (since main.py started)":47} {(previous - StartupProfile._start) * 1000:8.1f}')
+
+
+if StartupProfile.FLAG in sys.argv:
+    StartupProfile.enable()
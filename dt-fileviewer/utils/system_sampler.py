@@ -0,0 +1,168 @@
+import asyncio
+import time
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
+
+from loguru import logger as LOGGER
+from utils import cfg as cfg
+
+
+class SystemSampler():
+    """
+    System information (host, cpu, memory, disk), collected in the background every
+    cfg.sysinfo_interval seconds.
+
+    psutil calls are slow (cpu usage is measured over 1 second, disk partitions are
+    queried one by one), they run in a worker thread and the result is published as an
+    immutable snapshot, byte counts already formatted.  Page renders read the snapshot,
+    /ws/system clients are woken up on every new one.
+
+    Until the sampler published its first sample, or when it is not running (i.e. no
+    lifespan) and the sample expired (TTL), reads get a partial snapshot: the fast parts
+    (system, memory) collected now, cpu/disk of the last sample (if any).
+    """
+    _TTL_FACTOR = 3
+    _MEMORY_BYTES = ['virtual_total', 'virtual_used', 'virtual_free', 'swap_total', 'swap_used', 'swap_free']
+    _DISK_BYTES = ['total', 'used', 'free']
+
+    _snapshot: Optional[Mapping] = None
+    _sampled_at: float = 0.0
+    _version: int = 0
+    _task: Optional[asyncio.Task] = None
+    _updated: Optional[asyncio.Event] = None
+
+    @staticmethod
+    def interval() -> float:
+        return max(cfg.sysinfo_interval, 1)
+
+    @staticmethod
+    def start():
+        if SystemSampler._task is None or SystemSampler._task.done():
+            SystemSampler._updated = asyncio.Event()
+            SystemSampler._task = asyncio.create_task(SystemSampler._sample_loop(), name='system_sampler')
+
+    @staticmethod
+    async def _sample_loop():
+        LOGGER.debug(f'- system sampler started, every {SystemSampler.interval()} seconds.')
+        while True:
+            try:
+                SystemSampler._publish(await asyncio.to_thread(SystemSampler._collect))
+            except Exception as ex:
+                LOGGER.error(f'system sampler: {repr(ex)}')
+            await asyncio.sleep(SystemSampler.interval())
+
+    @staticmethod
+    def _collect(partial: bool = False) -> Mapping:
+        """Full sample, partial: no cpu (measured over 1 second) and disk."""
+        from dt_tools.os.os_helper import OSHelper    # psutil stack, on demand
+        sys_info = OSHelper.sysinfo(include_cpu=not partial, include_memory=True, include_disk=not partial)
+        memory = sys_info['memory']
+        for key in SystemSampler._MEMORY_BYTES:
+            memory[key] = OSHelper.bytes_to_printformat(memory[key])
+        for d_entry in sys_info.get('disk', {}).get('partitions', []):
+            if len(d_entry['fstype']) > 0:
+                for key in SystemSampler._DISK_BYTES:
+                    d_entry[key] = OSHelper.bytes_to_printformat(d_entry[key])
+        return SystemSampler._freeze(sys_info)
+
+    @staticmethod
+    def _freeze(value: Any) -> Any:
+        if isinstance(value, dict):
+            return MappingProxyType({key: SystemSampler._freeze(val) for key, val in value.items()})
+        if isinstance(value, list):
+            return tuple(SystemSampler._freeze(val) for val in value)
+        return value
+
+    @staticmethod
+    def _publish(snapshot: Mapping):
+        SystemSampler._snapshot = snapshot
+        SystemSampler._sampled_at = time.time()
+        SystemSampler._version += 1
+        if SystemSampler._updated is not None:
+            # Wake up the current waiters, later ones wait for the next sample
+            updated, SystemSampler._updated = SystemSampler._updated, asyncio.Event()
+            updated.set()
+
+    @staticmethod
+    def snapshot() -> Mapping:
+        """
+        Latest sample (read-only).  A partial one (no cpu/disk, or those of the last sample)
+        when there is none yet, or it expired and the sampler is not running: never blocks on psutil.
+        """
+        running = SystemSampler._task is not None and not SystemSampler._task.done()
+        expired = time.time() - SystemSampler._sampled_at > SystemSampler.interval() * SystemSampler._TTL_FACTOR
+        if SystemSampler._snapshot is None or (expired and not running):
+            partial = dict(SystemSampler._collect(partial=True))
+            if SystemSampler._snapshot is not None:
+                partial.setdefault('cpu', SystemSampler._snapshot['cpu'])
+                partial.setdefault('disk', SystemSampler._snapshot['disk'])
+            return MappingProxyType(partial)
+        return SystemSampler._snapshot
+
+    @staticmethod
+    async def wait_update(version: int) -> int:
+        """Wait for a sample newer than version, returns the current version."""
+        SystemSampler.start()
+        if SystemSampler._snapshot is None:
+            SystemSampler._publish(await asyncio.to_thread(SystemSampler._collect))
+        while SystemSampler._version == version:
+            await SystemSampler._updated.wait()
+        return SystemSampler._version
+
+    @staticmethod
+    def flatten(value: Any, prefix: str = '') -> Dict[str, Any]:
+        """{'memory.virtual_used': ..., 'disk.partitions.0.free': ...} of a snapshot."""
+        fields: Dict[str, Any] = {}
+        if isinstance(value, Mapping):
+            items = value.items()
+        elif isinstance(value, tuple):
+            items = enumerate(value)
+        else:
+            fields[prefix] = value
+            return fields
+        for key, val in items:
+            fields.update(SystemSampler.flatten(val, f'{prefix}.{key}' if prefix else str(key)))
+        return fields
+
+
+class SystemStream():
+    """
+    /ws/system subscriber: the whole (flattened) snapshot first, then only the fields
+    changed by each sample.  The layout (i.e. partitions mounted) changed: whole snapshot again.
+
+    Frames: {full: bool, sampled: epoch seconds, fields: {path: value}}
+    """
+    compact = True
+    name = 'system'
+    end_status = (1001, 'Stream ended')
+
+    def __init__(self):
+        self.paused: bool = False
+        self._fields: Optional[Dict[str, Any]] = None
+        self._version: int = -1
+        self._active: bool = True
+
+    @property
+    def in_progress(self) -> bool:
+        return self._active
+
+    async def get_or_waitfor_batch(self) -> Optional[dict]:
+        while self._active:
+            self._version = await SystemSampler.wait_update(self._version)
+            if self.paused:
+                # Changes accumulate, sent in one frame on resume
+                continue
+            fields = SystemSampler.flatten(SystemSampler.snapshot())
+            if self._fields is None or fields.keys() != self._fields.keys():
+                frame = {'full': True, 'sampled': SystemSampler._sampled_at, 'fields': fields}
+            else:
+                changed = {key: val for key, val in fields.items() if self._fields[key] != val}
+                if len(changed) == 0:
+                    continue
+                frame = {'full': False, 'sampled': SystemSampler._sampled_at, 'fields': changed}
+            self._fields = fields
+            return frame
+        return None
+
+    def stop_tail(self):
+        self._active = False
@@ -1,153 +1,634 @@
 import asyncio
+import collections
 import pathlib
-from threading import Lock
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple, Union
 
-import aiofiles
 from loguru import logger as LOGGER
 # from utils.helper import Helper, Message, MessageCommand
 from enum import Enum
+from utils.compressed_file import CompressedFile
+from utils.file_watcher import FileWatcher
 from utils.helper import Helper
+from utils.line_filter import LineFilter
+from utils.level_index import LevelIndex
+from utils.line_index import LineIndex
+from utils.line_reader import LineReader
+from utils.metrics import Metrics
+from utils.profiler import Profiler
+from utils.ring_buffer import OverflowPolicy, RingBuffer
+from utils.shared_ring import SharedLineRing
+from utils.timestamp_detector import TimestampDetector
 from utils import cfg as cfg
 
 class StartPos(Enum):
     HEAD = 1
     CENTER = 2
     TAIL = 3
+    LINE = 4
+    TIME = 5
 
-        
-class TextFileHandler():
-    
-    def __new__(cls, filename):
-        if not hasattr(cls, 'instance'):
-            LOGGER.debug('CREATING initial TextFileHandler instance.')
-            cls.instance = super(TextFileHandler, cls).__new__(cls)
 
-        return cls.instance
+class TailSubscriber():
+    """
+    A single viewer of a shared file tail.
 
-    def __init__(self, filename):
-        LOGGER.debug('TextFileHandler() __init__')
-        self.filename = pathlib.Path(filename)
-        if not self.filename.exists():
-            raise FileNotFoundError(f'{filename} not found.')
+    Each subscriber has its own starting cursor, filter and pause state.  The backlog
+    (start position up to the point the subscriber joined) is read privately, after
+    that, lines are received from the shared TextFileHandler reader.
 
-        self._processing = False
-        self._stop_requested = False
+    Lines are held in a bounded RingBuffer, cfg.overflow_policy decides what happens
+    when the viewer can't keep up (or is paused) with live lines.  The backlog always
+    waits for space, the range asked for is delivered in full.
+
+    Protocols:
+    - html: batches of pre-rendered lines (<span class=...>)
+    - compact: JSON frames {skipped, lines: [[seq, offset, level, text], ...]}, the
+      client does the styling.  seq gaps are lines dropped for this viewer.
+    - merge: (offset, level, line, timestamp) items, taken by a MergedView.
+    """
+    PROTOCOL_HTML = 'html'
+    PROTOCOL_COMPACT = 'compact'
+    PROTOCOL_MERGE = 'merge'
+
+    def __init__(self, handler: 'TextFileHandler', start_loc: StartPos = StartPos.TAIL, line_filter: LineFilter = None, 
+                 start_line: int = 0, start_time: datetime = None, start_lines: int = 0, protocol: str = PROTOCOL_HTML):
+        self.handler = handler
+        self.protocol = protocol
+        # Items are tuples with the line's file offset (compact, merge)
+        self.compact: bool = protocol != TailSubscriber.PROTOCOL_HTML
+        self.start_loc = start_loc
+        self.start_line = start_line
+        self.start_time = start_time
+        # Last N lines (TAIL), never more than the viewer buffer can hold
+        self.start_lines = min(max(start_lines, 0), cfg.ring_size)
+        self.line_filter = line_filter
+
+        self._active: bool = True
+        self.relocated: bool = False     # file ID moved to another file, the client reconnects
         self._paused: bool = False
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+        self._catching_up: bool = True
+        self._ring = RingBuffer(cfg.ring_size, TailSubscriber._get_overflow_policy(),
+                                item_size=TailSubscriber._compact_size if self.compact else len)
+        # Live lines published during the catch-up
+        self._pending: collections.deque = collections.deque(maxlen=cfg.ring_size)
+        self._backlog_batch: bool = False
+        self._seq: int = 0
+        self._queued_pos: int = 0     # file position of the last line queued (lag metric)
+        self._catchup_task: asyncio.Task = None
+        self._batch_max_bytes: int = cfg.batch_max_bytes
+        self._batch_wait: float = cfg.batch_wait_ms / 1000
 
-        self._tail_block_size: int = cfg.buffer_size
-        self._buffer: list = []
-        self._lock_buffer: Lock = Lock()
-        self._tail_task: asyncio.Task = None
+    @staticmethod
+    def _get_overflow_policy() -> OverflowPolicy:
+        try:
+            return OverflowPolicy(cfg.overflow_policy.lower())
+        except ValueError:
+            LOGGER.error(f'Invalid overflow_policy [{cfg.overflow_policy}], using {OverflowPolicy.DROP_OLDEST.value}.')
+            return OverflowPolicy.DROP_OLDEST
+
+    @property
+    def filename(self) -> pathlib.Path:
+        return self.handler.filename
+
+    @property
+    def name(self) -> str:
+        return self.filename.name
 
     @property
     def paused(self) -> bool:
         return self._paused
-    
+
     @paused.setter
     def paused(self, state: bool):
         LOGGER.warning(f'Paused set to: {state}')
         self._paused = state
+        if state:
+            self._resumed.clear()
+        else:
+            self._resumed.set()
+
+    @property
+    def in_progress(self) -> bool:
+        return self._active and self.handler.in_progress
+
+    @property
+    def end_status(self) -> Tuple[int, str]:
+        """Websocket close (code, reason) once the tail ended."""
+        if self.relocated:
+            return 1012, 'File location changed, reconnect'
+        if self.handler.failed:
+            return 1011, 'Tail failed'
+        return 1001, 'Tail ended'
+
+    @staticmethod
+    def _compact_size(item: tuple) -> int:
+        return len(item[2]) + 16
+
+    def format_line(self, line: str, offset: int = None) -> Union[str, tuple]:
+        """Ring item for a line, html markup, (offset, level, text) or (offset, level, line, timestamp)."""
+        if self.protocol == TailSubscriber.PROTOCOL_MERGE:
+            line = line.rstrip('\r\n')
+            timestamp = TimestampDetector.for_file(self.handler.textfile_id).parse_timestamp(line)
+            return offset, Helper.line_level(line, self.handler.textfile_id), line, timestamp
+        if self.compact:
+            return (offset, *Helper.compact_line(line, self.handler.textfile_id))
+        return Helper.filter_line(line, self.handler.textfile_id)
+
+    def select(self, lines: List[str]) -> List[int]:
+        """Indexes of the lines in the batch this subscriber wants (non-blank, passes filter)."""
+        return TailSubscriber._select(self.line_filter, lines)
+
+    @staticmethod
+    def _select(line_filter: LineFilter, lines: List[str]) -> List[int]:
+        if line_filter is not None:
+            return line_filter.select(lines)
+        return [idx for idx, line in enumerate(lines) if len(line) > 0]
+
+    def publish(self, line: Union[str, tuple]) -> bool:
+        """
+        Called by the shared reader for every new (formatted, selected) line, see format_line().
+
+        Returns:
+            bool: False if the buffer is full (BLOCK policy), the reader must
+            wait_for_space() and publish again.
+        """
+        if not self._active:
+            return True
+        if self._catching_up:
+            if len(self._pending) == self._pending.maxlen:
+                # Oldest pending line is discarded by the append
+                self._ring.add_skipped(1)
+            self._pending.append(line)
+            return True
+        return self._ring.put_nowait(line)
+
+    def skip(self, count: int):
+        """Live lines lost before they reached this subscriber (shared ring overrun)."""
+        if self._active:
+            self._ring.add_skipped(count)
+
+    def queued_to(self, position: int):
+        """Live lines up to position have been queued (or filtered out)."""
+        if not self._catching_up:
+            self._queued_pos = position
+
+    async def wait_for_space(self):
+        await self._ring.wait_space()
+
+    async def wait_data(self):
+        """Wait until lines (or a skipped count) are available, or the tail ended."""
+        await self._ring.wait_data()
+
+    def take(self, max_items: int = None) -> Tuple[int, list]:
+        """(lines skipped, available items), without waiting.  For consumers other than get_or_waitfor_batch()."""
+        skipped = self._ring.take_skipped()
+        self.handler.metrics.lines_dropped += skipped
+        return skipped, self._ring.get_batch(max_items=max_items)
+
+    def start_catchup(self, end_pos: int):
+        self._catchup_task = asyncio.create_task(self._catch_up(end_pos))
+
+    async def _catch_up(self, end_pos: int):
+        start_pos, aligned = await self.handler.get_start_offset(self.start_loc, end_pos, self.start_line, self.start_time, self.start_lines)
+        LOGGER.info(f'- Catch-up [{self.filename.name}]  from: {start_pos}  to: {end_pos}  filter: {self.line_filter}')
+        # Last N lines are collected and delivered as a single batch
+        backlog: List[str] = None if self.start_loc != StartPos.TAIL or self.start_lines == 0 else []
+        # Own filter state, the level of continuation lines (min_level) must not be taken
+        # from the live lines selected in between
+        line_filter = None if self.line_filter is None else self.line_filter.for_file(self.handler.textfile_id)
+        try:
+            if end_pos > start_pos:
+                with LineReader(self.filename, start_pos) as reader:
+                    first_line = not aligned
+                    while self._active:
+                        lines = await reader.read_lines(end_pos)
+                        if len(lines) == 0:
+                            break
+                        offsets = reader.line_offsets() if self.compact else None
+                        if first_line:
+                            # Most likely a partial line
+                            first_line = False
+                            lines = lines[1:]
+                            offsets = offsets and offsets[1:]
+                        selected = TailSubscriber._select(line_filter, lines)
+                        self.handler.metrics.lines_filtered += len(lines) - len(selected)
+                        for idx in selected:
+                            line = self.format_line(lines[idx], None if offsets is None else offsets[idx])
+                            if backlog is None:
+                                await self._ring.put(line, block=True)
+                            else:
+                                backlog.append(line)
+                        self._queued_pos = reader.position
+        except Exception as ex:
+            LOGGER.exception(repr(ex))
+
+        finally:
+            if backlog:
+                # Fits in the (empty) ring, so no await yields to the consumer in between
+                self._backlog_batch = True
+                for line in backlog:
+                    await self._ring.put(line, block=True)
+            # Live lines, the overflow policy applies (more may be published while the put waits)
+            while len(self._pending) > 0:
+                await self._ring.put(self._pending.popleft())
+            self._catching_up = False
+            self._queued_pos = self.handler.position
+            LOGGER.debug(f'- Catch-up complete [{self.filename.name}]')
+
+    async def get_or_waitfor_batch(self) -> Union[List[str], dict]:
+        """
+        Wait for available lines and return them as a batch (a frame for compact).
+
+        The batch is returned when batch_max_bytes is reached, or batch_wait_ms after
+        the first line was available, whichever comes first.  None when the tail ended.
+        """
+        LOGGER.debug('get_or_waitfor_batch() -  buffer_size: {} - in_process: {}', len(self._ring), self.in_progress)
+        while self.in_progress:
+            if self.paused:  # Don't get lines if we are paused.
+                await self._resumed.wait()
+                continue
+
+            await self._ring.wait_data()
+            if self._batch_wait > 0 and 0 < self._ring.pending_bytes < self._batch_max_bytes:
+                # Let the batch fill up, a full batch is sent right away
+                await asyncio.sleep(self._batch_wait)
+            if not self.in_progress or self.paused:
+                continue
+
+            skipped = self._ring.take_skipped()
+            max_bytes = None if self._backlog_batch else self._batch_max_bytes
+            self._backlog_batch = False
+            items = self._ring.get_batch(max_bytes=max_bytes)
+            metrics = self.handler.metrics
+            metrics.lines_dropped += skipped
+            metrics.lag_bytes.observe(self.handler.position - self._queued_pos)
+            Metrics.ws_lines_sent += len(items)
+            if self.compact:
+                if skipped > 0 or len(items) > 0:
+                    return self._compact_frame(skipped, items)
+                continue
+
+            batch: List[str] = []
+            if skipped > 0:
+                batch.append(Helper.filter_line(f'*** WARNING - {skipped} lines skipped ***'))
+            batch.extend(items)
+            if len(batch) > 0:
+                return batch
+
+        return None
+
+    def _compact_frame(self, skipped: int, items: List[tuple]) -> dict:
+        self._seq += skipped
+        lines = []
+        for offset, level, text in items:
+            lines.append([self._seq, offset, level, text])
+            self._seq += 1
+        return {'skipped': skipped, 'lines': lines}
+
+    def close(self):
+        self._active = False
+        self._ring.close()
+        self._resumed.set()
+
+    def stop_tail(self):
+        LOGGER.warning(f'stop tail requested [{self.filename.name}].')
+        if self._active:
+            self.close()
+            TailRegistry.unsubscribe(self)
+
+    def relocate(self):
+        """End the stream, the file ID is now tailed from another file (see TailRegistry.subscribe)."""
+        self.relocated = True
+        self.stop_tail()
+
+
+class TextFileHandler():
+    """
+    Shared reader for a single text file.
+
+    One reader task per file, new lines are formatted once and published to every
+    subscriber.  With a SharedLineRing (multiple workers, see SharedReader) the new
+    lines are taken from the ring instead of the file.
+    """
+    def __init__(self, textfile_id: str, filename, shared: SharedLineRing = None):
+        LOGGER.debug(f'TextFileHandler({textfile_id}) __init__')
+        self.textfile_id = textfile_id
+        self.filename = pathlib.Path(filename)
+        if not self.filename.exists():
+            raise FileNotFoundError(f'{filename} not found.')
+
+        self._processing = False
+        self._stop_requested = False
+        self.failed: bool = False       # reader ended with an exception
+        # Compressed (rotated) files are not appended to, nothing to follow
+        self.compressed: bool = CompressedFile.is_compressed(self.filename)
+
+        self._tail_block_size: int = cfg.buffer_size
+        self._position: int = 0
+        self._subscribers: List[TailSubscriber] = []
+        self._watcher: FileWatcher = None
+        self._reader: LineReader = None
+        self._shared = shared
+        self.index: LineIndex = LineIndex.get(textfile_id, self.filename)
+        self.levels: LevelIndex = LevelIndex.get(textfile_id, self.filename)
+        self._tail_task: asyncio.Task = None
+        self.metrics = Metrics.for_file(textfile_id)
 
     @property
     def in_progress(self) -> bool:
         return self._processing
 
-    async def start_tail(self, start_loc: StartPos = StartPos.TAIL, filter_text: str = None ):
-        LOGGER.debug(f'start_tail(start_loc={start_loc}, filter_text={filter_text})')
+    @property
+    def position(self) -> int:
+        """End of the last line read by the shared reader."""
+        return self._position
 
+    @property
+    def buffered_lines(self) -> int:
+        return sum(len(subscriber._ring) for subscriber in self._subscribers)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    async def get_start_offset(self, start_loc: StartPos, current_size: int, start_line: int = 0, start_time: datetime = None,
+                               start_lines: int = 0) -> Tuple[int, bool]:
+        """
+        Resolve the starting byte offset for a subscriber.
+
+        Returns:
+            Tuple[int, bool]: offset, aligned (offset is known to be at the start of a line)
+        """
+        offset = 0
+        if start_loc == StartPos.CENTER:
+            offset = 0 if current_size < self._tail_block_size else int(current_size / 2)
+        elif start_loc == StartPos.TAIL and start_lines > 0:
+            offset = await asyncio.to_thread(LineIndex.offset_for_last_lines, str(self.filename), start_lines, current_size)
+            return offset, True
+        elif start_loc == StartPos.TAIL:
+            offset = 0 if current_size < self._tail_block_size else current_size - self._tail_block_size
+        elif start_loc == StartPos.LINE:
+            line_offset = await self.index.offset_for_line(start_line)
+            return (current_size if line_offset is None else min(line_offset, current_size)), True
+        elif start_loc == StartPos.TIME and start_time is not None:
+            detector = TimestampDetector.for_file(self.textfile_id)
+            offset = await asyncio.to_thread(detector.find_offset, str(self.filename), start_time, current_size)
+            return offset, True
+
+        return offset, offset == 0
+
+    def add_subscriber(self, start_loc: StartPos = StartPos.TAIL, line_filter: LineFilter = None, 
+                       start_line: int = 0, start_time: datetime = None, start_lines: int = 0,
+                       protocol: str = TailSubscriber.PROTOCOL_HTML) -> TailSubscriber:
+        if not self.in_progress:
+            self.start_tail()
+
+        # No await between snapshot and registration, so every line past _position
+        # is published to the new subscriber and everything before is its backlog.
+        subscriber = TailSubscriber(self, start_loc, line_filter, start_line, start_time, start_lines, protocol)
+        self._subscribers.append(subscriber)
+        subscriber.start_catchup(self._position)
+        LOGGER.info(f'- [{self.textfile_id}] subscriber added, {self.subscriber_count} active.')
+        return subscriber
+
+    def add_sink(self, sink):
+        """Register a consumer of live lines only (no catch-up), i.e. the shared ring writer."""
+        if not self.in_progress:
+            self.start_tail()
+        self._subscribers.append(sink)
+
+    def remove_subscriber(self, subscriber: TailSubscriber):
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+        LOGGER.info(f'- [{self.textfile_id}] subscriber removed, {self.subscriber_count} active.')
+        if self.subscriber_count == 0:
+            self.stop_tail()
+
+    def relocate_subscribers(self):
+        """End the stream of every subscriber (1012, reconnect), the reader stops with the last one."""
+        for subscriber in list(self._subscribers):
+            subscriber.relocate()
+
+    def start_tail(self):
+        LOGGER.debug(f'start_tail() [{self.textfile_id}]')
         if self.in_progress:
             LOGGER.error(f'Tail in progress, cannot start new tail for [{self.filename.name}].')
             raise RuntimeError('Tail already in progress, stop_tail first!')
-        
-        self._tail_task = asyncio.create_task(self._tail_file(start_loc, filter_text))
 
-    async def _tail_file(self, start_loc: StartPos = StartPos.TAIL, filter_text: str = None ):
-        if self._processing:
-            raise RuntimeError('Tail already in progress, stop_tail first!')
-        
+        self._processing = True
+        self._stop_requested = False
+        self.failed = False
+        self.index.start_update()
+        self.levels.start_update()
+        if self._shared is not None:
+            _, _, self._position = self._shared.snapshot()
+            self._tail_task = asyncio.create_task(self._tail_shared(), name=f'tail_{self.textfile_id}')
+            return
+
+        # Watch before taking the size snapshot, so no write can be missed
+        self._watcher = FileWatcher.create(self.filename)
+        self._position = CompressedFile.size_of(self.filename)
+        self._reader = LineReader(self.filename, self._position)
+        self._tail_task = asyncio.create_task(self._tail_file(), name=f'tail_{self.textfile_id}')
+
+    async def _tail_file(self):
         LOGGER.info(f'_tail_task started for {self.filename.name}')
-        # Determine starting position
         try:
-            current_size = self.filename.stat().st_size
-            if start_loc == StartPos.HEAD:
-                last_pos = 0
-            elif start_loc == StartPos.CENTER:
-                last_pos = 0 if current_size < self._tail_block_size else int(current_size / 2)
-            elif start_loc == StartPos.TAIL:
-                last_pos = 0 if current_size < self._tail_block_size else current_size - self._tail_block_size
-            else:
-                last_pos = 0
-
-            # Loop looking for new textfile lines
-            first_line = True
-            self._processing = True
-            LOGGER.info(f'- Begin processing - [{self.filename}]  from: {start_loc.value}  filter: {filter_text}')
-            LOGGER.info(f'                     Current size: {current_size}  Last size: {last_pos}  stop_requesed: {self._stop_requested}')
+            LOGGER.info(f'- Begin processing - [{self.filename}]  from: {self._position}  watch: {self._watcher.backend}')
             while not self._stop_requested:
-                await asyncio.sleep(1)
-                current_size = self.filename.stat().st_size
-                # Get next line if file has grown, and process is NOT paused
-                if current_size > last_pos and not self.paused:
-                    async with aiofiles.open(str(self.filename), mode='r') as h_file:
-                        if last_pos > 0:
-                            LOGGER.debug(f'- seek to {last_pos}')
-                            await h_file.seek(last_pos)
-                        LOGGER.info('Begin read loop...')
-                        while not self._stop_requested:
-                            new_line = await h_file.readline()
-                            chk_line = new_line.replace('\n','').replace('\r','')
-                            LOGGER.debug(f'- line read: {chk_line}')
-                            # If new line is just a blank line, new line char or empty string, skip it
-                            if new_line in ["\n", "\r\n", ""] or (first_line and last_pos != 0):
-                                first_line = False
-                                continue
-                            if filter_text and filter_text not in new_line:
-                                # eat this line
-                                LOGGER.debug(f'- filtering line: {new_line}')
-                                continue
-                            
-                            line = Helper.filter_line(new_line)
-                            with self._lock_buffer:
-                                self._buffer.append(line)
-                            if len(self._buffer) > 50:
-                                while len(self._buffer) > 25 and not self._stop_requested:
-                                    # Don't let buffer get too far behind
-                                    if not self.paused:
-                                        LOGGER.info(f'- waiting for buffer to empty [{len(self._buffer)}]')
-                                    await asyncio.sleep(2)
-
-                    last_pos = current_size
+                await self._watcher.wait()
+                if self._stop_requested:
+                    break
+                if self.compressed:
+                    continue
+                # Read (batches of) new lines until EOF, then check for rotation/truncation
+                while not self._stop_requested:
+                    while not self._stop_requested:
+                        span = time.perf_counter() if Profiler.active else None
+                        lines = await self._reader.read_lines()
+                        if span is not None:
+                            Profiler.record('tail.read', span)
+                        if len(lines) == 0:
+                            break
+                        await self._publish(lines)
+                    if self._stop_requested or not await self._check_rotation():
+                        break
+                self.index.start_update()
+                self.levels.start_update()
 
         except Exception as ex:
             LOGGER.exception(repr(ex))
-        
+            self.failed = True
+
+        finally:
+            LOGGER.success(f'** tail file completed for {self.filename}')
+            self._watcher.close()
+            self._reader.close()
+            for subscriber in self._subscribers:
+                subscriber.close()
+            self._processing = False
+            self._stop_requested = False
+
+    async def _tail_shared(self):
+        LOGGER.info(f'- Begin processing - [{self.filename}]  from: {self._position}  shared ring')
+        try:
+            while not self._stop_requested and not self._shared.closed:
+                span = time.perf_counter() if Profiler.active else None
+                skipped, lines, offsets, position = self._shared.read()
+                if span is not None:
+                    Profiler.record('tail.shared_read', span)
+                if skipped > 0:
+                    LOGGER.warning(f'- [{self.textfile_id}] {skipped} lines overwritten in shared ring before read.')
+                    self.metrics.lines_dropped += skipped
+                    for subscriber in self._subscribers:
+                        subscriber.skip(skipped)
+                if len(lines) > 0:
+                    # No index update per batch, that would read the new bytes again in
+                    # every worker.  The index catches up when a line number is looked up.
+                    await self._publish(lines, position, offsets)
+                else:
+                    await asyncio.sleep(SharedLineRing.POLL_INTERVAL)
+
+        except Exception as ex:
+            LOGGER.exception(repr(ex))
+            self.failed = True
+
         finally:
             LOGGER.success(f'** tail file completed for {self.filename}')
+            self._shared.close()
+            for subscriber in self._subscribers:
+                subscriber.close()
             self._processing = False
             self._stop_requested = False
-            self._paused = False
-            await asyncio.sleep(.5)
-            with self._lock_buffer:
-                self._buffer = []
-
-
-    async def get_or_waitfor_line(self) -> str:
-        line = None
-        LOGGER.debug(f'get_or_waitfor_line() -  buffer_size: {len(self._buffer)} - in_process: {self.in_progress}')
-        while line is None and self.in_progress:
-            if not self.paused:  # Don't get line if we are paused.
-                try:
-                    with self._lock_buffer:
-                        line = self._buffer.pop(0)
-                except IndexError:
-                    line = None
-            if line is None:
-                await asyncio.sleep(.5)
-
-        return line
-    
+
+    async def _publish(self, lines: List[str], position: int = None, offsets: List[int] = None):
+        """Publish lines ending at position (default: the file reader position), offsets: of each line (lazy)."""
+        # Advance before publishing: a subscriber added while publishing
+        # reads this batch as backlog, and is not in the snapshot below.
+        position = self._reader.position if position is None else position
+        self.metrics.bytes_read += max(position - self._position, 0)
+        self.metrics.lines_read += len(lines)
+        self._position = position
+        subscribers = list(self._subscribers)
+        LOGGER.debug('- [{}] {} lines read, position: {}', self.textfile_id, len(lines), self._position)
+        span = time.perf_counter() if Profiler.active else None
+        # Each line is formatted (at most) once per protocol, and only if a subscriber selected it
+        caches: Dict[str, list] = {}
+        for subscriber in subscribers:
+            cache = caches.get(subscriber.protocol, None)
+            if cache is None:
+                cache = caches[subscriber.protocol] = [None] * len(lines)
+            selected = subscriber.select(lines)
+            self.metrics.lines_filtered += len(lines) - len(selected)
+            for idx in selected:
+                line = cache[idx]
+                if line is None:
+                    if subscriber.compact and offsets is None:
+                        offsets = self._reader.line_offsets()
+                    line = cache[idx] = subscriber.format_line(lines[idx], None if offsets is None else offsets[idx])
+                while not subscriber.publish(line):
+                    await subscriber.wait_for_space()
+            subscriber.queued_to(self._position)
+        if span is not None:
+            Profiler.record('tail.publish', span)
+
+    async def _check_rotation(self) -> bool:
+        """
+        Detect rotation (file moved and re-created) or truncation (copytruncate).
+
+        Called once the open file has been read to EOF.  When the file was replaced, the
+        old file is read to EOF again (lines written between the last read and the stat)
+        before switching.  Only stat() calls, the file is only re-opened if it was replaced.
+
+        Returns:
+            bool: True if reading was switched/reset and should continue.
+        """
+        open_stat = self._reader.stat()
+        try:
+            path_stat = self.filename.stat()
+        except FileNotFoundError:
+            # Moved, new file not (yet) created.  Keep waiting on the old one.
+            return False
+
+        if (path_stat.st_dev, path_stat.st_ino) != (open_stat.st_dev, open_stat.st_ino):
+            LOGGER.warning(f'- [{self.textfile_id}] file rotated, switching to new [{self.filename}].')
+            # Drain the old file, then its last (unterminated) line
+            while True:
+                lines = await self._reader.read_lines()
+                if len(lines) == 0:
+                    break
+                await self._publish(lines)
+            lines = self._reader.flush()
+            if len(lines) > 0:
+                await self._publish(lines)
+            self._reader.close()
+            self._reader = LineReader(self.filename, 0)
+            self._position = 0
+            self._watcher.rewatch()
+            return True
+
+        if open_stat.st_size < self._reader.position:
+            LOGGER.warning(f'- [{self.textfile_id}] file truncated ({open_stat.st_size} < {self._reader.position}), restart at 0.')
+            self._reader.reset(0)
+            self._position = 0
+            return True
+
+        return False
 
     def stop_tail(self):
-        LOGGER.warning('stop tail requested.')
+        LOGGER.warning(f'stop tail requested [{self.textfile_id}].')
         self._stop_requested = True
+        if self._watcher is not None:
+            self._watcher.wake()
+
+
+class TailRegistry():
+    """One shared TextFileHandler per configured file ID."""
+    _handlers: Dict[str, TextFileHandler] = {}
+
+    @staticmethod
+    def subscribe(textfile_id: str, filename: str, start_loc: StartPos = StartPos.TAIL, line_filter: LineFilter = None, 
+                  start_line: int = 0, start_time: datetime = None, start_lines: int = 0,
+                  protocol: str = TailSubscriber.PROTOCOL_HTML) -> TailSubscriber:
+        handler = TailRegistry._handlers.get(textfile_id, None)
+        if handler is not None and not handler.in_progress:
+            LOGGER.warning(f'- [{textfile_id}] tail ended, restarting reader.')
+            TailRegistry._handlers.pop(textfile_id)
+            handler = None
+        elif handler is not None and handler.filename != pathlib.Path(filename):
+            # Not stopped under its viewers: they are told to reconnect (to the new location)
+            LOGGER.warning(f'- [{textfile_id}] location changed, {handler.subscriber_count} viewers of [{handler.filename}] relocated.')
+            TailRegistry._handlers.pop(textfile_id)
+            handler.relocate_subscribers()
+            handler = None
+        if handler is None:
+            LOGGER.debug(f'- Create shared tail for [{textfile_id}]')
+            shared = None if CompressedFile.is_compressed(filename) else SharedLineRing.attach(textfile_id, filename)
+            handler = TextFileHandler(textfile_id, filename, shared)
+            TailRegistry._handlers[textfile_id] = handler
+
+        return handler.add_subscriber(start_loc, line_filter, start_line, start_time, start_lines, protocol)
+
+    @staticmethod
+    def unsubscribe(subscriber: TailSubscriber):
+        handler = subscriber.handler
+        handler.remove_subscriber(subscriber)
+        if handler.subscriber_count == 0 and TailRegistry._handlers.get(handler.textfile_id) is handler:
+            TailRegistry._handlers.pop(handler.textfile_id)
+
+    @staticmethod
+    def active_tails() -> Dict[str, int]:
+        return {textfile_id: handler.subscriber_count for textfile_id, handler in TailRegistry._handlers.items()}
+
+    @staticmethod
+    def buffered_lines() -> Dict[str, int]:
+        return {textfile_id: handler.buffered_lines for textfile_id, handler in TailRegistry._handlers.items()}
+
 
+Metrics.register_gauge('active_tails', 'Files being tailed', None, lambda: {'': len(TailRegistry._handlers)})
+Metrics.register_gauge('subscribers', 'Viewers per file', 'file', TailRegistry.active_tails)
+Metrics.register_gauge('buffer_depth_lines', 'Lines buffered for viewers, per file', 'file', TailRegistry.buffered_lines)
@@ -0,0 +1,182 @@
+import re
+from datetime import datetime
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from loguru import logger as LOGGER
+from utils.compressed_file import CompressedFile
+
+
+class TimestampDetector():
+    """
+    Detect if a (line prefix) token is a date/time, learning the format per file.
+
+    The first lines of a file are matched against common timestamp layouts (loguru,
+    ISO-8601, syslog, ...), the 1st matching layout is kept and used as a fast path.
+    All other results are cached by token 'shape' (digits normalized to 9), so
+    dateutil is only called the 1st time a new shape is seen.
+    """
+    _LEARN_LINES = 25
+    _SEARCH_SCAN_BYTES = 4096
+    _SEARCH_PROBE_LINES = 1000
+    _SHAPE_CACHE_LIMIT = 4096
+    _DIGIT_SHAPE = str.maketrans('0123456789', '9999999999')
+
+    # Token layouts, most common first
+    _PATTERNS: List[re.Pattern] = [
+        re.compile(r'\d{4}-\d{2}-\d{2}'),                                                       # loguru / ISO date
+        re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?'),  # ISO-8601
+        re.compile(r'\d{4}/\d{2}/\d{2}'),
+        re.compile(r'\d{1,2}/\d{1,2}/\d{2,4}'),
+        re.compile(r'\d{2}:\d{2}:\d{2}(?:[.,]\d+)?'),
+        re.compile(r'(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)'),                   # syslog
+        re.compile(r'\[\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2}'),                                  # nginx / apache
+    ]
+
+    _detectors: Dict[str, 'TimestampDetector'] = {}
+
+    def __init__(self, textfile_id: str = ''):
+        self.textfile_id = textfile_id
+        self._pattern: Optional[re.Pattern] = None
+        self._lines_seen: int = 0
+        self._shapes: Dict[str, bool] = {}
+
+    @staticmethod
+    def for_file(textfile_id: str = None) -> 'TimestampDetector':
+        key = textfile_id or ''
+        detector = TimestampDetector._detectors.get(key, None)
+        if detector is None:
+            detector = TimestampDetector(key)
+            TimestampDetector._detectors[key] = detector
+        return detector
+
+    @staticmethod
+    def reset(textfile_id: str = None):
+        """Forget learned format(s), all files if textfile_id is None."""
+        if textfile_id is None:
+            TimestampDetector._detectors.clear()
+        else:
+            TimestampDetector._detectors.pop(textfile_id, None)
+
+    @property
+    def pattern(self) -> Optional[str]:
+        return None if self._pattern is None else self._pattern.pattern
+
+    def is_date(self, token: str) -> bool:
+        if self._pattern is not None and self._pattern.fullmatch(token):
+            return True
+
+        shape = token.translate(self._DIGIT_SHAPE)
+        result = self._shapes.get(shape, None)
+        if result is None:
+            result = TimestampDetector.parse_is_date(token)
+            if len(self._shapes) >= self._SHAPE_CACHE_LIMIT:
+                self._shapes.clear()
+            self._shapes[shape] = result
+
+        if self._lines_seen < self._LEARN_LINES:
+            self._lines_seen += 1
+            if result and self._pattern is None:
+                self._learn(token)
+
+        return result
+
+    def _learn(self, token: str):
+        for pattern in self._PATTERNS:
+            if pattern.fullmatch(token):
+                self._pattern = pattern
+                LOGGER.debug(f'- [{self.textfile_id}] timestamp format learned: {pattern.pattern}')
+                return
+
+    @staticmethod
+    def parse_is_date(token: str, fuzzy: bool = False) -> bool:
+        from dateutil.parser import parse as dt_parser    # on demand, not needed to start the server
+        try:
+            dt_parser(token, fuzzy=fuzzy)
+            return True
+
+        except (ValueError, OverflowError):
+            return False
+
+    @staticmethod
+    def parse_start_time(start_time: str, default_date: datetime = None) -> Optional[datetime]:
+        """Parse a user supplied start time (i.e. '10:42'), missing date parts taken from default_date."""
+        from dateutil.parser import parse as dt_parser
+        default = (default_date or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        try:
+            return dt_parser(start_time, default=default).replace(tzinfo=None)
+        except (ValueError, OverflowError):
+            return None
+
+    def parse_timestamp(self, line: str) -> Optional[datetime]:
+        """
+        Return the (naive) timestamp at the start of line, None if line has no timestamp.
+
+        Up to 3 leading tokens are tried, longest first (i.e. syslog 'May  1 10:42:00',
+        loguru '2024-05-01 10:42:00.123', ISO '2024-05-01T10:42:00').
+        """
+        tokens = line.split(maxsplit=3)
+        if len(tokens) == 0 or not self.is_date(tokens[0]):
+            return None
+        # ISO / loguru layouts, without dateutil
+        for cnt in range(min(len(tokens), 2), 0, -1):
+            try:
+                return datetime.fromisoformat(' '.join(tokens[:cnt])).replace(tzinfo=None)
+            except ValueError:
+                continue
+        from dateutil.parser import parse as dt_parser
+        for cnt in range(min(len(tokens), 3), 0, -1):
+            try:
+                return dt_parser(' '.join(tokens[:cnt])).replace(tzinfo=None)
+            except (ValueError, OverflowError):
+                continue
+        return None
+
+    def find_offset(self, filename: str, target: datetime, end_pos: int) -> int:
+        """
+        Binary search (by byte offset) for the start of the 1st line with timestamp >= target.
+
+        O(log n) probes, each reading a line or two.  Returns end_pos if no such line.
+        """
+        target = target.replace(tzinfo=None)
+        with CompressedFile.open(filename) as h_file:
+            lo, hi = 0, end_pos   # lo is always at the start of a line
+            while hi - lo > self._SEARCH_SCAN_BYTES:
+                mid = (lo + hi) // 2
+                probe = self._next_timestamp(h_file, mid, hi)
+                if probe is None:
+                    hi = mid
+                elif probe[0] < target:
+                    lo = probe[2]
+                else:
+                    hi = mid
+
+            # Linear scan of the remaining (small) range
+            h_file.seek(lo)
+            pos = lo
+            while pos < end_pos:
+                raw = h_file.readline()
+                if not raw.endswith(b'\n'):
+                    break
+                timestamp = self.parse_timestamp(raw.decode('utf-8', errors='replace'))
+                if timestamp is not None and timestamp >= target:
+                    return pos
+                pos += len(raw)
+
+        return end_pos
+
+    def _next_timestamp(self, h_file: BinaryIO, pos: int, limit: int) -> Optional[Tuple[datetime, int, int]]:
+        """1st timestamped line starting in (pos, limit), as (timestamp, line start, line end)."""
+        h_file.seek(pos)
+        if pos > 0:
+            pos += len(h_file.readline())   # partial line
+        for _ in range(self._SEARCH_PROBE_LINES):
+            if pos >= limit:
+                break
+            raw = h_file.readline()
+            if not raw.endswith(b'\n'):
+                break
+            timestamp = self.parse_timestamp(raw.decode('utf-8', errors='replace'))
+            if timestamp is not None:
+                return timestamp, pos, pos + len(raw)
+            pos += len(raw)
+        return None
@@ -1,6 +1,9 @@
 from loguru import logger as LOGGER
 from starlette.websockets import WebSocket, WebSocketState, WebSocketDisconnect
+from utils.metrics import Metrics
+from utils.profiler import Profiler
 import asyncio
+import time
 
 
 class WsConnectionManager():
@@ -9,13 +12,18 @@ class WsConnectionManager():
         JSON  = 'json'
         TEXT  = 'text'
 
-    def __init__(self, websocket: WebSocket, recv_handler: callable, send_handler: callable, r_msg_type: MsgType = MsgType.JSON, s_msg_type: MsgType = MsgType.TEXT):
+    END_STATUS = (1001, 'Stream ended')
+
+    def __init__(self, websocket: WebSocket, recv_handler: callable, send_handler: callable, r_msg_type: MsgType = MsgType.JSON, s_msg_type: MsgType = MsgType.TEXT,
+                 end_status: callable = None):
         LOGGER.debug('ConnectionManager __init__()')
         self.websocket = websocket
         self.receiver  = recv_handler
         self._r_msg_type = r_msg_type
         self.sender    = send_handler
         self._s_msg_type = s_msg_type
+        # (code, reason) the websocket is closed with when the sender returns None (source ended)
+        self._end_status = end_status
         self._connected: bool = False
 
     @property
@@ -24,14 +32,14 @@ class WsConnectionManager():
 
     async def handle_connection(self):
         LOGGER.info('ConnectionManager.handler() - starting')
+        LOGGER.debug('- accept websocket connection')
+        await self.websocket.accept()
+        self._connected = True
+
         LOGGER.debug('- create consumer and producer')
         consumer_task = asyncio.create_task(self.receive_handler(), name='consumer_task')
         producer_task = asyncio.create_task(self.send_handler(), name='producer_task')
         tasks = [consumer_task, producer_task]
-
-        LOGGER.debug('- accept websocket connection')
-        await self.websocket.accept()
-        self._connected = True
         LOGGER.info('- wait for consumer/producer to terminate')
         done, pending = await asyncio.wait(
             tasks,
@@ -70,7 +78,7 @@ class WsConnectionManager():
                     if self.websocket.client_state != WebSocketState.CONNECTED:
                         LOGGER.error(f'- Websocked not CONNECTED [{self.websocket.client_state}], cannot receive message')
                         break
-                    LOGGER.debug(f'- waiting for message [{self._r_msg_type}]')
+                    LOGGER.debug('- waiting for message [{}]', self._r_msg_type)
                     # Can we make this smart (i.e. bytes, json, text)
                     if self._r_msg_type == self.MsgType.BYTES:
                         message = await self.websocket.receive_bytes()
@@ -99,13 +107,33 @@ class WsConnectionManager():
         LOGGER.debug('ConnectionManager - send_handler() triggered.')
         try:
             while True and self.is_connected:
+                span = time.perf_counter() if Profiler.active else None
                 message = await self.sender()
-                LOGGER.debug(f'- received: {message}')
-                await asyncio.sleep(.1)
+                if span is not None:
+                    Profiler.record('ws.wait_batch', span)
+                if isinstance(message, list):
+                    # Batch of lines, send as a single (multi-line) frame
+                    LOGGER.debug('- received batch: {} lines', len(message))
+                    if self._s_msg_type == self.MsgType.TEXT:
+                        message = '\n'.join(message)
+                    elif self._s_msg_type == self.MsgType.BYTES:
+                        message = b'\n'.join(message)
+                elif isinstance(message, dict):
+                    LOGGER.debug('- received frame: {} keys', len(message))
+                elif message is None:
+                    # Source ended, the sender would return None again without waiting
+                    code, reason = self.END_STATUS if self._end_status is None else self._end_status()
+                    LOGGER.warning(f'- sender ended, closing websocket [{code}] {reason}')
+                    if self.websocket.client_state == WebSocketState.CONNECTED:
+                        await self.websocket.close(code=code, reason=reason)
+                    break
+                else:
+                    LOGGER.debug('- received: {}', message)
                 if message is not None:
                     if self.websocket.client_state != WebSocketState.CONNECTED:
                         LOGGER.error(f'- Websocked not CONNECTED [{self.websocket.client_state}], cannot send message: {message}')
                         break
+                    start = time.perf_counter()
                     if self._s_msg_type == self.MsgType.BYTES:
                         await self.websocket.send_bytes(message)
                     elif self._s_msg_type == self.MsgType.JSON:
@@ -114,6 +142,10 @@ class WsConnectionManager():
                         await self.websocket.send_text(message)
                     else:
                         raise TypeError(f'Invalid MsgType [{self._s_msg_type}]')
+                    Metrics.ws_send_seconds.observe(time.perf_counter() - start)
+                    if Profiler.active:
+                        Profiler.record('ws.send', start)
+                    Metrics.ws_frames_sent += 1
         except WebSocketDisconnect:
             LOGGER.warning('- websocket disconneted.')
             self._connected = False
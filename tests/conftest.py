@@ -0,0 +1,6 @@
+import pathlib
+import sys
+
+# Modules of the app are imported as in main.py (utils.xxx), cfg first (as main.py)
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'dt-fileviewer'))
+from utils import cfg  # noqa: E402,F401
@@ -0,0 +1,32 @@
+import asyncio
+import json
+
+from utils.file_search import FileSearch
+
+
+def _search(filename, terms, cursor=None, limit=1000, regex=False):
+    async def collect():
+        return [json.loads(line) async for chunk in FileSearch(filename, terms, regex=regex).search(cursor, limit)
+                for line in chunk.splitlines()]
+    results = asyncio.run(collect())
+    return results[:-1], results[-1]
+
+
+def test_match_across_lines_keeps_line_numbers(tmp_path):
+    filename = tmp_path / 'app.log'
+    filename.write_text('zero\nstart one\nend two\nthree\nfour needle\nfive\nneedle six\n')
+    matches, summary = _search(filename, [r'start[^$]*?end', 'needle'], regex=True)
+    assert [(match['line'], match['text']) for match in matches] == [(1, 'start one\nend two'), (4, 'four needle'), (6, 'needle six')]
+    assert summary['done']
+
+
+def test_cursor_after_match_across_lines(tmp_path):
+    filename = tmp_path / 'app.log'
+    filename.write_text('start one\nend two\nthree\nfour needle\n')
+    matches, summary = _search(filename, [r'one\nend', 'needle'], limit=1, regex=True)
+    assert [match['line'] for match in matches] == [0]
+    offset, line_no = FileSearch.parse_cursor(summary['next_cursor'])
+    assert (offset, line_no) == (len('start one\nend two\n'), 2)
+
+    matches, _ = _search(filename, ['needle'], cursor=summary['next_cursor'])
+    assert [(match['offset'], match['line']) for match in matches] == [(len('start one\nend two\nthree\n'), 3)]
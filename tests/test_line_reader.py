@@ -0,0 +1,38 @@
+import asyncio
+
+from utils.line_reader import LineReader
+
+
+def _read_all(reader: LineReader):
+    async def collect():
+        batches = []
+        while True:
+            lines = await reader.read_lines()
+            if len(lines) == 0:
+                return batches
+            batches.append((lines, reader.line_offsets()))
+    return asyncio.run(collect())
+
+
+def test_long_line_truncated(tmp_path):
+    filename = tmp_path / 'app.log'
+    long_line = 'x' * (LineReader.MAX_LINE_LEN * 5)
+    filename.write_text(f'a\n{long_line}\nb\n')
+    with LineReader(filename, chunk_size=16 * 1024) as reader:
+        batches = _read_all(reader)
+        assert [lines for lines, _ in batches] == [['a'], [long_line[:LineReader.MAX_LINE_LEN]], ['b']]
+        assert [offsets for _, offsets in batches] == [[0], [2], [len(long_line) + 3]]
+        assert reader.position == filename.stat().st_size
+
+
+def test_long_line_still_written(tmp_path):
+    filename = tmp_path / 'app.log'
+    filename.write_text('a\n' + 'é' * LineReader.MAX_LINE_LEN)
+    with LineReader(filename, chunk_size=16 * 1024) as reader:
+        batches = _read_all(reader)
+        truncated = batches[-1][0][0]
+        # Cut at a character boundary, not inside a 2 byte character
+        assert truncated == 'é' * (LineReader.MAX_LINE_LEN // 2)
+        with open(filename, 'a') as h_file:
+            h_file.write('é' * 100 + '\nb\n')
+        assert [lines for lines, _ in _read_all(reader)] == [['b']]
@@ -0,0 +1,128 @@
+import hashlib
+import multiprocessing
+import os
+import struct
+import time
+
+import pytest
+from utils import cfg
+from utils.shared_ring import SharedLineRing
+
+
+def _line(n: int) -> str:
+    # Self checking: the payload (length varies, some lines wrap) is derived from the line number
+    digest = hashlib.md5(str(n).encode()).hexdigest()
+    return f'{n} {digest * (n % 97)}'
+
+
+def _check(lines, offsets, first_expected: int) -> int:
+    """Lines must be intact and in order (gaps: skipped lines), returns the next expected line number."""
+    expected = first_expected
+    for line, offset in zip(lines, offsets):
+        n = int(line.split(' ', 1)[0])
+        assert n >= expected
+        assert line == _line(n), f'torn line {n}'
+        assert offset == n
+        expected = n + 1
+    return expected
+
+
+@pytest.fixture
+def ring(monkeypatch):
+    monkeypatch.setattr(cfg, 'shared_ring_mb', 1)
+    monkeypatch.setattr(cfg, 'shared_reader', True)
+    monkeypatch.setattr(cfg, 'num_workers', 2)
+    monkeypatch.setattr(cfg, 'auto_reload', False)
+    monkeypatch.setenv(SharedLineRing.RING_PREFIX_ENV, f'dtfv_test_{os.getpid()}')
+    writer = SharedLineRing.create('test', '/tmp/test.log', 0)
+    yield writer
+    writer.unlink()
+
+
+def test_wraparound(ring):
+    reader = SharedLineRing.attach('test', '/tmp/test.log')
+    written = 0
+    received = 0
+    skipped = 0
+    expected = 0
+    # ~30 times the ring capacity: records wrap, read often at first (no loss), then too
+    # rarely (records are overwritten before they are read)
+    for batch in range(400):
+        lines = [_line(n) for n in range(written, written + 50)]
+        ring.write_lines(lines, list(range(written, written + 50)), written + 50)
+        written += 50
+        if batch < 200 or batch % 20 == 0:
+            lost, lines, offsets, position = reader.read()
+            skipped += lost
+            received += len(lines)
+            expected = _check(lines, offsets, expected)
+            assert position == written
+    lost, lines, offsets, _ = reader.read()
+    skipped += lost
+    received += len(lines)
+    _check(lines, offsets, expected)
+    assert skipped > 0
+    assert received > written // 2
+    assert received + skipped == written
+    reader.close()
+
+
+def _write_process(prefix: str, total: int, ready, start, done):
+    # Writer in its own process (true concurrency with the reader), the ring is laps ahead of the reader
+    os.environ[SharedLineRing.RING_PREFIX_ENV] = prefix
+    cfg.shared_ring_mb = 1
+    writer = SharedLineRing.create('concurrent', '/tmp/test.log', 0)
+    ready.set()
+    start.wait(30)
+    written = 0
+    while written < total:
+        count = min(25, total - written)
+        writer.write_lines([_line(n) for n in range(written, written + count)], list(range(written, written + count)), written + count)
+        written += count
+    done.wait(30)
+    writer.unlink()
+
+
+def test_concurrent_reader_no_torn_lines(ring):
+    total = 100000
+    context = multiprocessing.get_context('spawn')
+    ready, start, done = context.Event(), context.Event(), context.Event()
+    process = context.Process(target=_write_process, args=(os.environ[SharedLineRing.RING_PREFIX_ENV], total, ready, start, done))
+    process.start()
+    try:
+        assert ready.wait(30)
+        reader = SharedLineRing.attach('concurrent', '/tmp/test.log')
+        start.set()
+        received = skipped = expected = 0
+        position = 0
+        while position < total or received + skipped < total:
+            lost, lines, offsets, position = reader.read()
+            skipped += lost
+            received += len(lines)
+            expected = _check(lines, offsets, expected)
+            # Fall behind, the next read starts at the oldest records: the ones being overwritten
+            time.sleep(0.005)
+        assert received + skipped == total
+        assert skipped > 0
+        reader.close()
+    finally:
+        done.set()
+        process.join(30)
+
+
+def test_stalled_writer_times_out(ring, monkeypatch):
+    reader = SharedLineRing.attach('test', '/tmp/test.log')
+    monkeypatch.setattr(SharedLineRing, '_HEADER_TIMEOUT', 0.05)
+    # Writer died inside _commit(): lock seq left odd
+    struct.pack_into('<Q', ring._buf, SharedLineRing._LOCK_SEQ_POS, ring._lock_seq + 1)
+    with pytest.raises(TimeoutError):
+        reader.read()
+    assert SharedLineRing.attach('test', '/tmp/test.log') is None
+    reader.close()
+
+
+def test_ring_name_prefix_from_environment(monkeypatch):
+    monkeypatch.setenv(SharedLineRing.RING_PREFIX_ENV, 'dtfv_8123')
+    assert SharedLineRing.name_for('app').startswith('dtfv_8123_')
+    SharedLineRing.publish_prefix(8200)
+    assert SharedLineRing.name_for('app').startswith('dtfv_8200_')